@@ -1,7 +1,21 @@
 """
 __init__.py para módulo de API
+
+As classes são importadas sob demanda, para que usar só o motor de
+recomendação não carregue os drivers de banco.
 """
+import importlib
+
+_MODULOS = {
+    'RecommendationAPI': '.api',
+    'AsyncRecommendationAPI': '.async_api',
+    'RecommendationEngine': '.recommendation_engine',
+}
+
+__all__ = ['RecommendationAPI', 'AsyncRecommendationAPI', 'RecommendationEngine']
 
-from .api import RecommendationAPI
 
-__all__ = ['RecommendationAPI']
+def __getattr__(nome):
+    if nome in _MODULOS:
+        return getattr(importlib.import_module(_MODULOS[nome], __name__), nome)
+    raise AttributeError(f"module {__name__!r} has no attribute {nome!r}")
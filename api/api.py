@@ -1,10 +1,14 @@
 """
 API de integração entre todas as bases de dados
 """
+import time
 from database.postgres_db import PostgresDB
 from database.mongo_db import MongoDB
 from database.neo4j_db import Neo4jDB
+from database.redis_comandos import para_timestamp
 from database.redis_db import RedisDB
+from database.conexoes import conectar_em_paralelo, imprimir_status
+from api.recommendation_engine import RecommendationEngine
 
 
 class RecommendationAPI:
@@ -13,16 +17,20 @@ class RecommendationAPI:
         self.mongo = MongoDB()
         self.neo4j = Neo4jDB()
         self.redis = RedisDB()
+        self._motor = None
+        self.status_conexoes = {}
     
     def conectar_todos(self):
-        """Conecta em todos os bancos de dados"""
+        """Conecta em todos os bancos de dados ao mesmo tempo"""
         print("\n=== Conectando aos bancos de dados ===")
-        resultado = True
-        resultado &= self.postgres.connect()
-        resultado &= self.mongo.connect()
-        resultado &= self.neo4j.connect()
-        resultado &= self.redis.connect()
-        return resultado
+        self.status_conexoes = conectar_em_paralelo({
+            'PostgreSQL': self.postgres,
+            'MongoDB': self.mongo,
+            'Neo4j': self.neo4j,
+            'Redis': self.redis
+        })
+        imprimir_status(self.status_conexoes)
+        return all(item['ok'] for item in self.status_conexoes.values())
     
     def desconectar_todos(self):
         """Desconecta de todos os bancos de dados"""
@@ -36,10 +44,23 @@ class RecommendationAPI:
         """Inicializa as tabelas e estruturas nos bancos"""
         print("\n=== Inicializando estruturas ===")
         self.postgres.create_tables()
+        self.postgres.migrate()
         self.neo4j.delete_all()  # Limpa dados anteriores
+        self.neo4j.create_schema()
         self.mongo.delete_collection('clientes_interesses')
         self.redis.clear_cache()
     
+    def atualizar_esquemas(self):
+        """Cria o que faltar nos esquemas, sem apagar dados (ao contrário de inicializar_bancos).
+        
+        Tabelas e migrações pendentes no PostgreSQL, constraints e índices
+        no Neo4j. Retorna True se tudo foi aplicado.
+        """
+        print("\n=== Atualizando esquemas ===")
+        postgres = self.postgres.create_tables() and self.postgres.migrate()
+        neo4j = self.neo4j.create_schema()
+        return postgres and neo4j
+    
     def adicionar_cliente(self, cpf, nome, endereco, cidade, uf, email, interesses=[]):
         """Adiciona um cliente em todos os bancos"""
         print(f"\n=== Adicionando cliente {nome} ===")
@@ -48,6 +69,8 @@ class RecommendationAPI:
         cliente_id = self.postgres.insert_cliente(cpf, nome, endereco, cidade, uf, email)
         if not cliente_id:
             return None
+        # O CPF pode ter sido buscado (e marcado como inexistente) antes do cadastro
+        self.redis.limpar_cpfs_ausentes([cpf])
         
         # MongoDB
         self.mongo.insert_cliente_interesses(cliente_id, cpf, nome, interesses)
@@ -57,10 +80,86 @@ class RecommendationAPI:
         
         return cliente_id
     
+    def _reportar_vazao(self, banco, quantidade, inicio):
+        """Imprime quantos registros um banco gravou e a taxa por segundo"""
+        duracao = time.perf_counter() - inicio
+        taxa = quantidade / duracao if duracao > 0 else 0
+        print(f"  • {banco}: {quantidade} registro(s) em {duracao:.2f} s ({taxa:.0f}/s)")
+    
+    def adicionar_clientes_lote(self, clientes):
+        """Adiciona vários clientes em todos os bancos; retorna os IDs.
+        
+        Cada cliente é um dicionário com cpf, nome, endereco, cidade, uf,
+        email e, opcionalmente, interesses.
+        """
+        clientes = list(clientes)
+        print(f"\n=== Adicionando {len(clientes)} clientes em lote ===")
+        
+        # PostgreSQL
+        inicio = time.perf_counter()
+        ids = self.postgres.insert_clientes_lote(clientes)
+        self._reportar_vazao('PostgreSQL', len(ids), inicio)
+        # Só segue com os clientes que o PostgreSQL confirmou
+        inseridos = list(zip(ids, clientes))
+        self.redis.limpar_cpfs_ausentes(cliente['cpf'] for _, cliente in inseridos)
+        
+        # MongoDB
+        inicio = time.perf_counter()
+        total = self.mongo.insert_clientes_interesses_lote({
+            'cliente_id': cliente_id,
+            'cpf': cliente['cpf'],
+            'nome': cliente['nome'],
+            'interesses': cliente.get('interesses', [])
+        } for cliente_id, cliente in inseridos)
+        self._reportar_vazao('MongoDB', total, inicio)
+        
+        # Neo4j
+        inicio = time.perf_counter()
+        total = self.neo4j.create_clientes_lote({
+            'id': cliente_id, 'cpf': cliente['cpf'], 'nome': cliente['nome']
+        } for cliente_id, cliente in inseridos)
+        self._reportar_vazao('Neo4j', total, inicio)
+        
+        return ids
+    
+    def adicionar_amizades_lote(self, amizades):
+        """Adiciona várias relações de amizade (pares de IDs de clientes)"""
+        amizades = list(amizades)
+        print(f"\n=== Criando {len(amizades)} amizades em lote ===")
+        inicio = time.perf_counter()
+        total = self.neo4j.create_amizades_lote(amizades)
+        self._motor = None
+        self._reportar_vazao('Neo4j', total, inicio)
+        return total
+    
+    def adicionar_produtos_lote(self, produtos):
+        """Adiciona vários produtos (dicionários produto, valor, quantidade, tipo)"""
+        produtos = list(produtos)
+        print(f"\n=== Adicionando {len(produtos)} produtos em lote ===")
+        inicio = time.perf_counter()
+        ids = self.postgres.insert_produtos_lote(produtos)
+        self._reportar_vazao('PostgreSQL', len(ids), inicio)
+        return ids
+    
+    def registrar_compras_lote(self, compras):
+        """Registra várias compras (pares cliente_id, produto_id) e sincroniza o cache uma vez"""
+        compras = list(compras)
+        print(f"\n=== Registrando {len(compras)} compras em lote ===")
+        inicio = time.perf_counter()
+        ids = self.postgres.insert_compras_lote(compras)
+        self._reportar_vazao('PostgreSQL', len(ids), inicio)
+        
+        if ids:
+            inicio = time.perf_counter()
+            self.sincronizar_cache_incremental()
+            self._reportar_vazao('Redis', len(ids), inicio)
+        return ids
+    
     def adicionar_amizade(self, cliente_id1, cliente_id2):
         """Adiciona uma relação de amizade entre dois clientes"""
         print(f"\n=== Criando amizade entre {cliente_id1} e {cliente_id2} ===")
         self.neo4j.create_amizade(cliente_id1, cliente_id2)
+        self._motor = None
     
     def adicionar_produto(self, produto, valor, quantidade, tipo):
         """Adiciona um produto"""
@@ -71,49 +170,267 @@ class RecommendationAPI:
         print(f"\n=== Registrando compra ===")
         compra_id = self.postgres.insert_compra(cliente_id, produto_id)
         if compra_id:
-            self.sincronizar_cache()
+            self.sincronizar_cache_incremental()
         return compra_id
     
     def sincronizar_cache(self):
-        """Sincroniza todos os dados com Redis"""
+        """Reconstrói todo o cache no Redis (operação administrativa).
+        
+        Tudo é gravado em um namespace novo; quem lê o cache continua no
+        anterior, completo, até a troca do ponteiro no final. Só um processo
+        reconstrói por vez: os demais esperam (até reconstrucao_espera
+        segundos) pela reconstrução em andamento em vez de repeti-la.
+        """
         print("\n=== Sincronizando cache ===")
-        self.redis.clear_cache()
+        token = self.redis.adquirir_trava_reconstrucao()
+        if token is None:
+            print("Outro processo está reconstruindo o cache, aguardando...")
+            return self.redis.aguardar_reconstrucao()
+        
+        self._motor = None
+        try:
+            ns = self.redis.iniciar_reconstrucao()
+            try:
+                concluido = self._reconstruir_cache(ns, token)
+            except Exception:
+                self.redis.abortar_reconstrucao(ns)
+                raise
+            if not concluido:
+                print("✗ Reconstrução incompleta: o cache anterior continua em uso")
+                self.redis.abortar_reconstrucao(ns)
+                return False
+            return self.redis.concluir_reconstrucao(ns, token) is not False
+        finally:
+            self.redis.liberar_trava_reconstrucao(token)
+    
+    def _reconstruir_cache(self, ns, token):
+        """Grava clientes, compras, amigos e recomendações no namespace em construção ns.
+        
+        Cada lote gravado renova a trava (token); se ela passou a outro
+        processo, a reconstrução para e retorna False.
+        """
+        # Sincronizar clientes (em streaming, guardando só os IDs)
+        cliente_ids = []
+        
+        def clientes_stream():
+            for cliente in self.postgres.iter_clientes():
+                cliente_ids.append(cliente['id'])
+                yield cliente
         
-        # Sincronizar clientes
-        clientes = self.postgres.get_all_clientes()
-        self.redis.store_clientes(clientes)
+        if self.redis.store_clientes(clientes_stream(), ns, token) is False:
+            return False
         
-        # Sincronizar compras
-        compras = self.postgres.get_all_compras()
-        self.redis.store_compras(compras)
+        # Sincronizar compras (em streaming, guardando a maior para a marca
+        # d'água e alimentando o cálculo das recomendações pontuadas)
+        ultima_compra = 0
+        motor = RecommendationEngine()
         
-        # Sincronizar amigos
-        for cliente in clientes:
-            amigos = self.neo4j.get_amigos(cliente['id'])
-            self.redis.store_amigos(cliente['id'], amigos)
+        def compras_stream():
+            nonlocal ultima_compra
+            for compra in self.postgres.iter_compras():
+                ultima_compra = max(ultima_compra, compra['id'])
+                motor.adicionar_compra(
+                    compra['cliente_id'], compra['produto_id'], para_timestamp(compra['data'])
+                )
+                yield compra
         
-        # Sincronizar recomendações
-        for cliente in clientes:
-            recomendacoes = self.neo4j.get_recomendacoes_para_amigo(cliente['id'])
-            self.redis.store_recomendacoes(cliente['id'], recomendacoes)
+        if self.redis.store_compras(compras_stream(), ns, token) is False:
+            return False
+        
+        # Sincronizar amigos e recomendações (uma consulta por lote de IDs)
+        adjacencias = self.neo4j.get_adjacencias(cliente_ids)
+        if adjacencias is None or not self.redis.renovar_trava_reconstrucao(token):
+            return False
+        if self.redis.store_amigos_lote({
+            cliente_id: adj['amigos'] for cliente_id, adj in adjacencias.items()
+        }, ns, token) is False:
+            return False
+        if self.redis.store_recomendacoes_lote({
+            cliente_id: adj['recomendacoes'] for cliente_id, adj in adjacencias.items()
+        }, ns, token) is False:
+            return False
+        
+        # Recomendações pontuadas (nova geração de recomendacoes:top)
+        for cliente_id, adj in adjacencias.items():
+            for amigo in adj['amigos']:
+                motor.adicionar_amizade(cliente_id, amigo['id'])
+        if self.precomputar_recomendacoes(motor, ns=ns, token=token) is None:
+            return False
+        
+        # Marca d'água: a sincronização incremental parte da maior compra gravada
+        return self.redis.set_ultima_compra_sincronizada(ultima_compra, ns)
+    
+    def sincronizar_cache_incremental(self):
+        """Sincroniza apenas as compras novas e os clientes afetados por elas"""
+        print("\n=== Sincronizando cache (incremental) ===")
+        self._motor = None
+        ultima_compra = self.redis.get_ultima_compra_sincronizada()
+        if ultima_compra is None:
+            print("Cache sem marca de sincronização, reconstruindo...")
+            return self.sincronizar_cache()
+        
+        # IDs vêm de uma sequência, mas as transações não confirmam em ordem:
+        # confere os IDs de uma janela abaixo da marca (só o índice) e busca
+        # do PostgreSQL apenas os que faltam no cache, mais os acima da marca
+        ids = self.postgres.get_compra_ids(
+            max(0, ultima_compra - self.redis.janela_compras), ultima_compra
+        )
+        faltando = self.redis.compras_ausentes(ids) if ids is not None else None
+        if faltando is None:
+            return
+        
+        def compras_novas():
+            nonlocal ultima_compra
+            if faltando:
+                yield from self.postgres.iter_compras(ids=faltando)
+            for compra in self.postgres.iter_compras(desde_id=ultima_compra):
+                ultima_compra = max(ultima_compra, compra['id'])
+                yield compra
+        
+        relatorio = self.redis.append_compras(compras_novas())
+        if not relatorio:
+            return
+        # As compras gravadas ficam pendentes até clientes, amigos e
+        # recomendações serem atualizados; a marca já pode avançar
+        self.redis.set_ultima_compra_sincronizada(ultima_compra)
+        aplicadas = self._aplicar_compras_pendentes()
+        print(f"✓ {relatorio['gravadas']} compra(s) nova(s) sincronizada(s), "
+              f"{aplicadas} aplicada(s) a clientes e recomendações")
+    
+    def _aplicar_compras_pendentes(self):
+        """Atualiza cliente, amigos e recomendações de quem fez as compras pendentes.
+        
+        Inclui as que sobraram de sincronizações interrompidas. Vai em lotes
+        de chunk_size compras; cada lote só sai das pendentes se todos os
+        passos deram certo. Retorna quantas compras foram aplicadas.
+        """
+        aplicadas = 0
+        while True:
+            compras = self.redis.get_compras_pendentes()
+            if not compras:
+                return aplicadas
+            
+            afetados = {compra['cliente_id'] for compra in compras}
+            clientes = self.postgres.get_clientes_by_ids(afetados)
+            if clientes is None or not self.redis.upsert_clientes(clientes):
+                return aplicadas
+            adjacencias = self.neo4j.get_adjacencias(afetados)
+            if adjacencias is None:
+                # Sem o grafo, as listas em cache ficam como estão (não são apagadas)
+                return aplicadas
+            if self.redis.store_amigos_lote({
+                cliente_id: adj['amigos'] for cliente_id, adj in adjacencias.items()
+            }) is False:
+                return aplicadas
+            if self.redis.store_recomendacoes_lote({
+                cliente_id: adj['recomendacoes'] for cliente_id, adj in adjacencias.items()
+            }) is False:
+                return aplicadas
+            
+            # Quem recebe recomendações de quem comprou ganha pontos no produto
+            if self.redis.atualizar_recomendacoes_top(compras, {
+                cliente_id: [rec['cliente_id'] for rec in adj['recomendacoes']]
+                for cliente_id, adj in adjacencias.items()
+            }) is None:
+                return aplicadas
+            if not self.redis.concluir_compras_pendentes(compra['id'] for compra in compras):
+                return aplicadas
+            aplicadas += len(compras)
     
     def atualizar_interesses(self, cliente_id, interesses):
         """Atualiza os interesses de um cliente"""
         print(f"\n=== Atualizando interesses do cliente {cliente_id} ===")
         self.mongo.update_cliente_interesses(cliente_id, interesses)
     
-    def get_dados_consolidados(self):
-        """Retorna todos os dados consolidados do Redis"""
+    def buscar_cliente_por_cpf(self, cpf):
+        """Busca um cliente pelo CPF no Redis, indo ao PostgreSQL só na falta"""
+        return self.redis.buscar_cliente_por_cpf(cpf, self.postgres.get_cliente_by_cpf)
+    
+    def get_dados_consolidados(self, apos_id=None, limite=None):
+        """Retorna os dados consolidados do Redis.
+        
+        Sem `limite`, traz todos os clientes. Com `limite`, traz a página de
+        clientes com ID maior que `apos_id` e as compras deles; o campo
+        'proximo_id' indica de onde continuar (None na última página).
+        """
+        if limite is None:
+            clientes = self.redis.get_clientes()
+            compras = self.redis.get_compras()
+        else:
+            clientes = self.redis.get_clientes_pagina(apos_id or 0, limite)
+            compras = self.redis.get_compras_clientes(cliente['id'] for cliente in clientes)
+        
+        cliente_ids = [int(cliente['id']) for cliente in clientes]
+        relacoes = self.redis.get_relacoes_lote(cliente_ids)
+        
         dados = {
-            'clientes': self.redis.get_clientes(),
-            'compras': self.redis.get_compras(),
-            'amigos': {},
-            'recomendacoes': {}
+            'clientes': clientes,
+            'compras': compras,
+            'amigos': relacoes['amigos'],
+            'recomendacoes': relacoes['recomendacoes']
         }
-        
-        for cliente in dados['clientes']:
-            cliente_id = int(cliente['id'])
-            dados['amigos'][cliente_id] = self.redis.get_amigos(cliente_id)
-            dados['recomendacoes'][cliente_id] = self.redis.get_recomendacoes(cliente_id)
+        if limite is not None:
+            dados['proximo_id'] = (
+                cliente_ids[-1] if cliente_ids and len(cliente_ids) == limite else None
+            )
         
         return dados
+    
+    def precomputar_recomendacoes(self, motor=None, k=None, ns=None, token=None):
+        """Calcula e grava no Redis os k melhores produtos de cada cliente.
+        
+        Sem `motor`, monta um a partir das compras e amizades em cache. A
+        pontuação combina compras dos amigos, quão recentes elas são e a
+        popularidade do produto (RecommendationEngine.pontuar). ns é o
+        namespace em construção, quando chamado de uma reconstrução, e
+        token o da trava dela. Retorna a geração gravada (None em caso de erro).
+        """
+        if motor is None:
+            try:
+                motor = self._montar_motor(por_id=True)
+            except Exception:
+                # Já impresso por RedisDB.iter_*: sem o cache inteiro, não grava nada
+                return None
+        k = k or self.redis.top_k_recomendacoes
+        return self.redis.store_recomendacoes_top(motor.pontuar(k), ns, token)
+    
+    def _montar_motor(self, por_id=False):
+        """Monta o motor de recomendação a partir das compras e amigos em cache.
+        
+        Com por_id, os produtos são identificados pelo ID e as compras
+        levam a data (para RecommendationEngine.pontuar). Um erro na leitura
+        do cache é repassado.
+        """
+        motor = RecommendationEngine()
+        for compra in self.redis.iter_compras():
+            if por_id:
+                motor.adicionar_compra(
+                    int(compra['cliente_id']), int(compra['produto_id']),
+                    para_timestamp(compra['data'])
+                )
+            else:
+                motor.adicionar_compra(int(compra['cliente_id']), compra['produto'])
+        
+        cliente_ids = [int(cliente['id']) for cliente in self.redis.iter_clientes()]
+        amigos = self.redis.get_relacoes_lote(cliente_ids)['amigos']
+        for cliente_id, lista in amigos.items():
+            for amigo in lista:
+                motor.adicionar_amizade(cliente_id, amigo['id'])
+        motor.calcular()
+        return motor
+    
+    def recomendar(self, cliente_id, k=10):
+        """Até k pares (produto, pontuação) que os amigos do cliente compraram e ele não.
+        
+        Lê as recomendações pré-calculadas do Redis; se ainda não há uma
+        geração calculada, usa o motor em memória (pontuação = amigos que compraram).
+        """
+        top = self.redis.get_recomendacoes_top(cliente_id, k)
+        if top is not None:
+            return [(produto.get('produto', produto['id']), produto['pontuacao']) for produto in top]
+        if self._motor is None:
+            try:
+                self._motor = self._montar_motor()
+            except Exception:
+                return []
+        return self._motor.recommend(cliente_id, k)
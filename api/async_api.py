@@ -0,0 +1,668 @@
+"""
+Versão assíncrona (asyncio) da API de integração
+
+Usa os clientes assíncronos do Redis, MongoDB e Neo4j; o PostgreSQL
+(psycopg2, bloqueante) roda em um pool de threads. Escritas independentes
+em bancos diferentes e consultas ao grafo por lote de clientes são feitas
+ao mesmo tempo, limitadas por um semáforo.
+"""
+import asyncio
+import json
+import time
+from concurrent.futures import ThreadPoolExecutor
+
+import redis.asyncio as aioredis
+from neo4j import AsyncGraphDatabase
+from pymongo import AsyncMongoClient
+
+from api.recommendation_engine import RecommendationEngine
+from config.databases import MONGO_CONFIG, NEO4J_CONFIG, REDIS_CONFIG
+from database.postgres_db import PostgresDB
+from database.neo4j_db import CONSULTA_ADJACENCIAS
+from database.cache_local import CANAL_INVALIDACAO, INVALIDAR_TUDO
+from database.codec import criar_codecs, tentar_decodificar_lista
+from database.redis_comandos import (
+    CHAVE_COMPRAS_PENDENTES, CHAVE_DESCARTADOS, CHAVE_GERACAO_RECOMENDACOES, CHAVE_NAMESPACE,
+    CHAVE_SEQ_NAMESPACE, CHAVE_SEQ_RECOMENDACOES, CHAVE_TRAVA_RECONSTRUCAO, CHAVE_ULTIMA_COMPRA,
+    LUA_ADQUIRIR_TRAVA, LUA_ATUALIZAR_RECOMENDACOES, LUA_AVANCAR_MARCA, LUA_GRAVAR_COMPRA,
+    LUA_LIBERAR_TRAVA, LUA_RENOVAR_TRAVA, LUA_TROCAR_NAMESPACE, PRAZO_CONSTRUCAO,
+    PREFIXO_RECOMENDACOES_TOP, TravaPerdida, argumentos_adquirir_trava, argumentos_avancar_marca,
+    argumentos_liberar_trava, argumentos_renovar_trava, argumentos_trocar_namespace,
+    atualizar_recomendacoes_top, chave_legada, clientes_novos, compras_pendentes,
+    copiar_compra, gravar_cliente, gravar_compra, gravar_lista, gravar_recomendacoes_top,
+    ler_compra_pendente, ler_lista, limpar_cpf_ausente, namespace_de, outro_formato, para_timestamp, renovar_trava
+)
+
+
+class AsyncRecommendationAPI:
+    def __init__(self, concorrencia=8):
+        self.postgres = PostgresDB()
+        self.mongo_client = None
+        self.mongo = None
+        self.neo4j = None
+        self.redis = None
+        self.redis_binario = None
+        self._script_gravar_compra = None
+        self._script_avancar_marca = None
+        self._script_atualizar_top = None
+        self._script_adquirir_trava = None
+        self._script_renovar_trava = None
+        self._script_liberar_trava = None
+        self._script_trocar_namespace = None
+        self.listas_binarias = REDIS_CONFIG.get('codec_listas', 'binario') == 'binario'
+        self.codecs = criar_codecs(REDIS_CONFIG.get('codec_limite_compressao', 1024))
+        self.chunk_size = REDIS_CONFIG.get('chunk_size', 1000)
+        self.janela_compras = REDIS_CONFIG.get('sync_janela_compras', 500)
+        self.top_k_recomendacoes = REDIS_CONFIG.get('recomendacoes_top_k', 50)
+        self.chunk_grafo = NEO4J_CONFIG.get('chunk_size', 1000)
+        # Operações simultâneas por tipo (lotes do grafo, lotes do Redis, ...)
+        self._limite = asyncio.Semaphore(concorrencia)
+        self._executor = ThreadPoolExecutor(max_workers=self.postgres.pool_max)
+        self.carencia_namespace = REDIS_CONFIG.get('namespace_carencia', 300)
+        self.lease_reconstrucao = REDIS_CONFIG.get('reconstrucao_lease', 120)
+        self.espera_reconstrucao = REDIS_CONFIG.get('reconstrucao_espera', 30)
+        self._coletas = set()
+    
+    async def _pg(self, funcao, *args):
+        """Executa uma chamada bloqueante do PostgresDB no pool de threads"""
+        loop = asyncio.get_running_loop()
+        return await loop.run_in_executor(self._executor, funcao, *args)
+    
+    async def _limitado(self, corrotina):
+        """Aguarda a corrotina respeitando o limite de concorrência"""
+        async with self._limite:
+            return await corrotina
+    
+    async def _conectar_postgres(self):
+        return await self._pg(self.postgres.connect)
+    
+    async def _conectar_mongo(self):
+        try:
+            timeout_ms = int(MONGO_CONFIG.get('connect_timeout', 10) * 1000)
+            self.mongo_client = AsyncMongoClient(
+                f"mongodb://{MONGO_CONFIG['host']}:{MONGO_CONFIG['port']}/",
+                connectTimeoutMS=timeout_ms,
+                serverSelectionTimeoutMS=timeout_ms
+            )
+            self.mongo = self.mongo_client[MONGO_CONFIG['database']]
+            await self.mongo.command('ping')
+            print("✓ Conectado ao MongoDB (async)")
+            return True
+        except Exception as e:
+            print(f"✗ Erro ao conectar MongoDB: {e}")
+            return False
+    
+    async def _conectar_neo4j(self):
+        try:
+            self.neo4j = AsyncGraphDatabase.driver(
+                NEO4J_CONFIG['uri'],
+                auth=(NEO4J_CONFIG['username'], NEO4J_CONFIG['password']),
+                connection_timeout=NEO4J_CONFIG.get('connect_timeout', 10)
+            )
+            await self.neo4j.verify_connectivity()
+            print("✓ Conectado ao Neo4j (async)")
+            return True
+        except Exception as e:
+            print(f"✗ Erro ao conectar Neo4j: {e}")
+            return False
+    
+    async def _conectar_redis(self):
+        try:
+            self.redis = aioredis.Redis(
+                host=REDIS_CONFIG['host'],
+                port=REDIS_CONFIG['port'],
+                db=REDIS_CONFIG['db'],
+                decode_responses=True,
+                socket_connect_timeout=REDIS_CONFIG.get('connect_timeout', 10)
+            )
+            await self.redis.ping()
+            self._script_gravar_compra = self.redis.register_script(LUA_GRAVAR_COMPRA)
+            self._script_avancar_marca = self.redis.register_script(LUA_AVANCAR_MARCA)
+            self._script_atualizar_top = self.redis.register_script(LUA_ATUALIZAR_RECOMENDACOES)
+            self._script_adquirir_trava = self.redis.register_script(LUA_ADQUIRIR_TRAVA)
+            self._script_renovar_trava = self.redis.register_script(LUA_RENOVAR_TRAVA)
+            self._script_liberar_trava = self.redis.register_script(LUA_LIBERAR_TRAVA)
+            self._script_trocar_namespace = self.redis.register_script(LUA_TROCAR_NAMESPACE)
+            self.redis_binario = aioredis.Redis(
+                host=REDIS_CONFIG['host'],
+                port=REDIS_CONFIG['port'],
+                db=REDIS_CONFIG['db'],
+                socket_connect_timeout=REDIS_CONFIG.get('connect_timeout', 10)
+            )
+            print("✓ Conectado ao Redis (async)")
+            return True
+        except Exception as e:
+            print(f"✗ Erro ao conectar Redis: {e}")
+            return False
+    
+    async def conectar_todos(self):
+        """Conecta em todos os bancos de dados ao mesmo tempo"""
+        print("\n=== Conectando aos bancos de dados (async) ===")
+        resultados = await asyncio.gather(
+            self._conectar_postgres(),
+            self._conectar_mongo(),
+            self._conectar_neo4j(),
+            self._conectar_redis()
+        )
+        return all(resultados)
+    
+    async def desconectar_todos(self):
+        """Desconecta de todos os bancos de dados"""
+        print("\n=== Desconectando dos bancos de dados (async) ===")
+        await self._pg(self.postgres.disconnect)
+        if self.mongo_client:
+            await self.mongo_client.close()
+        if self.neo4j:
+            await self.neo4j.close()
+        if self.redis_binario:
+            await self.redis_binario.aclose()
+        if self.redis:
+            await self.redis.aclose()
+        self._executor.shutdown(wait=False)
+    
+    async def adicionar_cliente(self, cpf, nome, endereco, cidade, uf, email, interesses=None):
+        """Adiciona um cliente em todos os bancos (MongoDB e Neo4j em paralelo)"""
+        print(f"\n=== Adicionando cliente {nome} ===")
+        cliente_id = await self._pg(
+            self.postgres.insert_cliente, cpf, nome, endereco, cidade, uf, email
+        )
+        if not cliente_id:
+            return None
+        
+        async def inserir_mongo():
+            await self.mongo['clientes_interesses'].insert_one({
+                'cliente_id': cliente_id,
+                'cpf': cpf,
+                'nome': nome,
+                'interesses': interesses or []
+            })
+        
+        async def criar_neo4j():
+            await self.neo4j.execute_query(
+                "CREATE (c:Cliente {id: $id, cpf: $cpf, nome: $nome})",
+                id=cliente_id, cpf=cpf, nome=nome
+            )
+        
+        async def limpar_redis():
+            # O CPF pode ter sido buscado (e marcado como inexistente) antes do cadastro
+            pipe = self.redis.pipeline(transaction=False)
+            limpar_cpf_ausente(pipe, cpf, await self._namespace())
+            await pipe.execute()
+        
+        resultados = await asyncio.gather(
+            inserir_mongo(), criar_neo4j(), limpar_redis(), return_exceptions=True
+        )
+        for banco, resultado in zip(('MongoDB', 'Neo4j', 'Redis'), resultados):
+            if isinstance(resultado, Exception):
+                print(f"✗ Erro ao gravar cliente no {banco}: {resultado}")
+        return cliente_id
+    
+    async def registrar_compra(self, cliente_id, produto_id):
+        """Registra uma compra e atualiza o cache"""
+        print(f"\n=== Registrando compra ===")
+        compra_id = await self._pg(self.postgres.insert_compra, cliente_id, produto_id)
+        if compra_id:
+            # A compra já está no PostgreSQL: um erro no cache não a desfaz
+            try:
+                await self.sincronizar_cache_incremental()
+            except Exception as e:
+                print(f"✗ Erro ao sincronizar o cache: {e}")
+        return compra_id
+    
+    async def _get_adjacencias(self, cliente_ids):
+        """Amigos e recomendações por cliente, com os lotes do grafo em paralelo.
+        
+        Como Neo4jDB.get_adjacencias, retorna None em caso de erro, para não
+        confundir uma falha do grafo com clientes sem amigos.
+        """
+        ids = list(cliente_ids)
+        
+        async def consultar(lote):
+            records, _, _ = await self.neo4j.execute_query(CONSULTA_ADJACENCIAS, ids=lote)
+            return records
+        
+        try:
+            lotes = await asyncio.gather(*(
+                self._limitado(consultar(ids[i:i + self.chunk_grafo]))
+                for i in range(0, len(ids), self.chunk_grafo)
+            ))
+        except Exception as e:
+            print(f"✗ Erro ao buscar adjacências: {e}")
+            return None
+        adjacencias = {id_: {'amigos': [], 'recomendacoes': []} for id_ in ids}
+        for records in lotes:
+            for record in records:
+                adjacencias[record['id']] = {
+                    'amigos': [dict(amigo) for amigo in record['amigos']],
+                    'recomendacoes': [dict(rec) for rec in record['recomendacoes']]
+                }
+        return adjacencias
+    
+    def _pipeline(self, token=None):
+        """Pipeline sem transação; com o token da reconstrução, começa renovando a trava"""
+        pipe = self.redis.pipeline(transaction=False)
+        if token is not None:
+            renovar_trava(pipe, self._script_renovar_trava, token, self.lease_reconstrucao)
+        return pipe
+    
+    async def _executar(self, pipe, token=None):
+        """Executa um pipeline de _pipeline; TravaPerdida se a trava passou a outro processo"""
+        respostas = await pipe.execute()
+        if token is None:
+            return respostas
+        if not respostas[0]:
+            raise TravaPerdida()
+        return respostas[1:]
+    
+    async def _namespace(self):
+        """Prefixo do namespace em uso no cache ('' antes da primeira reconstrução)"""
+        return await self.redis.get(CHAVE_NAMESPACE) or ''
+    
+    async def _store_relacoes(self, adjacencias, ns, invalidar=True, token=None):
+        """Regrava amigos:{id} e recomendacoes:{id}, um pipeline por lote de clientes"""
+        itens = list(adjacencias.items())
+        
+        async def escrever(lote):
+            pipe = self._pipeline(token)
+            for cliente_id, adj in lote:
+                for prefixo in ('amigos', 'recomendacoes'):
+                    gravar_lista(
+                        pipe, self.codecs[prefixo], f"{ns}{prefixo}:{cliente_id}",
+                        adj[prefixo], self.listas_binarias
+                    )
+            # Caches locais de outros processos (RedisDB com cache_local)
+            if invalidar:
+                pipe.publish(CANAL_INVALIDACAO, json.dumps([
+                    f"{prefixo}:{cliente_id}"
+                    for cliente_id, _ in lote for prefixo in ('amigos', 'recomendacoes')
+                ]))
+            await self._executar(pipe, token)
+        
+        await asyncio.gather(*(
+            self._limitado(escrever(itens[i:i + self.chunk_size]))
+            for i in range(0, len(itens), self.chunk_size)
+        ))
+    
+    async def sincronizar_cache(self):
+        """Reconstrói todo o cache no Redis (operação administrativa).
+        
+        Grava em um namespace novo e troca o ponteiro no final, com a mesma
+        trava e o mesmo token de RedisDB (só um processo, síncrono ou não,
+        reconstrói por vez; uma troca com token vencido é recusada). Lê o
+        PostgreSQL página a página; enquanto uma página é gravada no Redis,
+        a próxima já está sendo buscada.
+        """
+        print("\n=== Sincronizando cache (async) ===")
+        keys, args = argumentos_adquirir_trava(self.lease_reconstrucao)
+        token = await self._script_adquirir_trava(keys=keys, args=args)
+        if token is None:
+            print("Outro processo está reconstruindo o cache, aguardando...")
+            return await self._aguardar_reconstrucao()
+        
+        try:
+            ns = namespace_de(await self.redis.incr(CHAVE_SEQ_NAMESPACE))
+            # Se a reconstrução não terminar, a coleta apaga o que sobrou depois do prazo
+            await self.redis.zadd(CHAVE_DESCARTADOS, {ns: time.time() + PRAZO_CONSTRUCAO})
+            try:
+                total = await self._reconstruir_cache(ns, token)
+            except TravaPerdida as e:
+                print(f"✗ {e}")
+                total = False
+            except Exception:
+                await self._abortar_reconstrucao(ns)
+                raise
+            if total is False:
+                print("✗ Reconstrução incompleta: o cache anterior continua em uso")
+                await self._abortar_reconstrucao(ns)
+                return False
+            
+            keys, args = argumentos_trocar_namespace(ns, token, self.carencia_namespace)
+            anterior = await self._script_trocar_namespace(keys=keys, args=args)
+            if anterior is None:
+                print(f"✗ Namespace {ns} descartado: o cache já foi trocado por uma reconstrução mais nova")
+                await self._abortar_reconstrucao(ns)
+                return False
+            await self.redis.publish(CANAL_INVALIDACAO, INVALIDAR_TUDO)
+        finally:
+            keys, args = argumentos_liberar_trava(token)
+            await self._script_liberar_trava(keys=keys, args=args)
+        
+        self._agendar_coleta(self.carencia_namespace + 1)
+        print(f"✓ Cache reconstruído no namespace {ns}: {total} clientes")
+        return True
+    
+    async def _abortar_reconstrucao(self, ns):
+        """Descarta o namespace em construção e agenda a coleta dele"""
+        await self.redis.zadd(CHAVE_DESCARTADOS, {ns: 0})
+        self._agendar_coleta()
+    
+    def _agendar_coleta(self, atraso=0):
+        """Roda _coletar_namespaces em segundo plano, depois de `atraso` segundos"""
+        coleta = asyncio.ensure_future(self._coletar_namespaces(atraso))
+        self._coletas.add(coleta)
+        coleta.add_done_callback(self._coletas.discard)
+    
+    async def _renovar_trava(self, token):
+        """Estende a validade da trava da reconstrução; False se ela passou a outro processo"""
+        keys, args = argumentos_renovar_trava(token, self.lease_reconstrucao)
+        renovada = await self._script_renovar_trava(keys=keys, args=args)
+        if not renovada:
+            print("⚠ Trava da reconstrução perdida para outro processo")
+        return bool(renovada)
+    
+    async def _aguardar_reconstrucao(self, intervalo=0.2):
+        """Espera até reconstrucao_espera segundos a reconstrução de outro processo.
+        
+        Retorna True se ela terminou, False se o tempo acabou antes.
+        """
+        limite = time.monotonic() + self.espera_reconstrucao
+        while await self.redis.exists(CHAVE_TRAVA_RECONSTRUCAO):
+            if time.monotonic() >= limite:
+                return False
+            await asyncio.sleep(intervalo)
+        return True
+    
+    async def _coletar_namespaces(self, atraso=0):
+        """Apaga, depois de `atraso` segundos, os namespaces descartados já vencidos"""
+        await asyncio.sleep(atraso)
+        vencidos = await self.redis.zrangebyscore(CHAVE_DESCARTADOS, '-inf', time.time())
+        for namespace in vencidos:
+            if namespace == await self.redis.get(CHAVE_NAMESPACE):
+                continue
+            lote = []
+            async for key in self.redis.scan_iter(
+                match=namespace + '*' if namespace else None, count=self.chunk_size
+            ):
+                # Sem prefixo (legado): tudo que não é de um namespace nem do controle
+                if not namespace and not chave_legada(key):
+                    continue
+                lote.append(key)
+                if len(lote) >= self.chunk_size:
+                    await self.redis.delete(*lote)
+                    lote = []
+            if lote:
+                await self.redis.delete(*lote)
+            await self.redis.zrem(CHAVE_DESCARTADOS, namespace)
+    
+    async def _reconstruir_cache(self, ns, token):
+        """Copia clientes, compras, amigos e recomendações para o namespace ns.
+        
+        Cada lote gravado renova a trava da reconstrução (token); se ela
+        passou a outro processo, levanta TravaPerdida. Retorna o total de
+        clientes, ou False se o grafo não respondeu.
+        """
+        # Clientes, paginados por ID
+        cliente_ids = []
+        
+        async def gravar_clientes(clientes):
+            pipe = self._pipeline(token)
+            for cliente in clientes:
+                gravar_cliente(pipe, cliente, ns)
+                pipe.lpush(ns + 'clientes', f"cliente:{cliente['id']}")
+                cliente_ids.append(cliente['id'])
+            await self._executar(pipe, token)
+        
+        await self._copiar_paginas(
+            lambda apos: self._pg(self.postgres.get_clientes_pagina, apos or 0, self.chunk_size),
+            lambda pagina: pagina[-1]['id'],
+            gravar_clientes
+        )
+        
+        # Compras, paginadas por (data, id), guardando a maior para a marca
+        # d'água e alimentando o cálculo das recomendações pontuadas
+        ultima_compra = 0
+        motor = RecommendationEngine()
+        
+        async def gravar_compras(compras):
+            nonlocal ultima_compra
+            pipe = self._pipeline(token)
+            for compra in compras:
+                copiar_compra(pipe, compra, ns)
+                ultima_compra = max(ultima_compra, compra['id'])
+                motor.adicionar_compra(
+                    compra['cliente_id'], compra['produto_id'], para_timestamp(compra['data'])
+                )
+            await self._executar(pipe, token)
+        
+        await self._copiar_paginas(
+            lambda apos: self._pg(self.postgres.get_compras_pagina, apos, self.chunk_size),
+            lambda pagina: (pagina[-1]['data'], pagina[-1]['id']),
+            gravar_compras
+        )
+        
+        # Amigos e recomendações
+        adjacencias = await self._get_adjacencias(cliente_ids)
+        if adjacencias is None or not await self._renovar_trava(token):
+            return False
+        await self._store_relacoes(adjacencias, ns, invalidar=False, token=token)
+        
+        # Recomendações pontuadas (primeira geração de recomendacoes:top em ns)
+        for cliente_id, adj in adjacencias.items():
+            for amigo in adj['amigos']:
+                motor.adicionar_amizade(cliente_id, amigo['id'])
+        ranking = await asyncio.to_thread(motor.pontuar, self.top_k_recomendacoes)
+        await self._store_recomendacoes_top(ranking, ns, token)
+        
+        keys, args = argumentos_avancar_marca(ultima_compra, ns)
+        await self._script_avancar_marca(keys=keys, args=args)
+        return len(cliente_ids)
+    
+    async def _store_recomendacoes_top(self, ranking_por_cliente, ns, token):
+        """Grava uma geração de recomendações pontuadas em ns e passa a usá-la.
+        
+        Como RedisDB.store_recomendacoes_top, mas só para um namespace em
+        construção (com o token da trava dele), que ainda não tem geração
+        anterior a apagar.
+        """
+        geracao = await self.redis.incr(ns + CHAVE_SEQ_RECOMENDACOES)
+        prefixo = f"{ns}{PREFIXO_RECOMENDACOES_TOP}{geracao}:"
+        itens = list(ranking_por_cliente.items())
+        
+        async def escrever(lote):
+            pipe = self._pipeline(token)
+            for cliente_id, ranking in lote:
+                gravar_recomendacoes_top(
+                    pipe, prefixo, cliente_id, ranking, self.top_k_recomendacoes
+                )
+            await self._executar(pipe, token)
+        
+        await asyncio.gather(*(
+            self._limitado(escrever(itens[i:i + self.chunk_size]))
+            for i in range(0, len(itens), self.chunk_size)
+        ))
+        await self.redis.set(ns + CHAVE_GERACAO_RECOMENDACOES, geracao)
+        return geracao
+    
+    async def _copiar_paginas(self, buscar, cursor_de, gravar):
+        """Copia páginas de `buscar` para `gravar`, buscando a próxima durante a gravação"""
+        pagina = await buscar(None)
+        while pagina:
+            proxima = None
+            if len(pagina) == self.chunk_size:
+                proxima = asyncio.ensure_future(buscar(cursor_de(pagina)))
+            await gravar(pagina)
+            pagina = await proxima if proxima else []
+    
+    async def sincronizar_cache_incremental(self):
+        """Sincroniza apenas as compras novas e os clientes afetados por elas"""
+        ns = await self._namespace()
+        ultima_compra = await self.redis.get(ns + CHAVE_ULTIMA_COMPRA)
+        if ultima_compra is None:
+            print("Cache sem marca de sincronização, reconstruindo...")
+            return await self.sincronizar_cache()
+        marca = int(ultima_compra)
+        
+        # IDs não confirmam em ordem: confere os IDs de uma janela abaixo da
+        # marca (só o índice) e busca apenas os que faltam no cache, mais os
+        # acima da marca
+        ids = await self._pg(
+            self.postgres.get_compra_ids, max(0, marca - self.janela_compras), marca
+        )
+        if ids is None:
+            return
+        faltando = []
+        for i in range(0, len(ids), self.chunk_size):
+            lote = ids[i:i + self.chunk_size]
+            pipe = self.redis.pipeline(transaction=False)
+            for compra_id in lote:
+                pipe.exists(f"{ns}compra:{compra_id}")
+            faltando.extend(
+                compra_id for compra_id, existe in zip(lote, await pipe.execute()) if not existe
+            )
+        try:
+            compras = await self._pg(lambda: (
+                (list(self.postgres.iter_compras(ids=faltando)) if faltando else []) +
+                list(self.postgres.iter_compras(desde_id=marca))
+            ))
+        except Exception:
+            # Já impresso por iter_compras; a marca não avança
+            return
+        
+        # Compras gravadas agora (resposta 1) ficam pendentes até os passos seguintes
+        gravadas = 0
+        for i in range(0, len(compras), self.chunk_size):
+            pipe = self.redis.pipeline(transaction=False)
+            for compra in compras[i:i + self.chunk_size]:
+                gravar_compra(pipe, self._script_gravar_compra, compra, ns)
+            gravadas += sum(await pipe.execute())
+        if compras:
+            marca = max(marca, max(compra['id'] for compra in compras))
+            keys, args = argumentos_avancar_marca(marca, ns)
+            await self._script_avancar_marca(keys=keys, args=args)
+        
+        aplicadas = await self._aplicar_compras_pendentes(ns)
+        print(f"✓ {gravadas} compra(s) nova(s) sincronizada(s), "
+              f"{aplicadas} aplicada(s) a clientes e recomendações")
+    
+    async def _aplicar_compras_pendentes(self, ns):
+        """Atualiza cliente, amigos e recomendações de quem fez as compras pendentes.
+        
+        Como RecommendationAPI._aplicar_compras_pendentes: em lotes de
+        chunk_size, e cada lote só sai das pendentes se todos os passos
+        deram certo. Retorna quantas compras foram aplicadas.
+        """
+        aplicadas = 0
+        while True:
+            ids = await self.redis.zrange(ns + CHAVE_COMPRAS_PENDENTES, 0, self.chunk_size - 1)
+            if not ids:
+                return aplicadas
+            pipe = self.redis.pipeline(transaction=False)
+            for compra_id in ids:
+                ler_compra_pendente(pipe, compra_id, ns)
+            compras, sem_hash = compras_pendentes(ids, await pipe.execute())
+            if sem_hash:
+                await self.redis.zrem(ns + CHAVE_COMPRAS_PENDENTES, *sem_hash)
+            if not compras:
+                continue
+            
+            afetados = {compra['cliente_id'] for compra in compras}
+            try:
+                # Cadastro no PostgreSQL e vizinhança no grafo ao mesmo tempo
+                clientes, adjacencias = await asyncio.gather(
+                    self._pg(self.postgres.get_clientes_by_ids, afetados),
+                    self._get_adjacencias(afetados)
+                )
+                if clientes is None or adjacencias is None:
+                    # Sem o grafo, as listas em cache ficam como estão (não são apagadas)
+                    return aplicadas
+                
+                pipe = self.redis.pipeline(transaction=False)
+                for cliente in clientes:
+                    gravar_cliente(pipe, cliente, ns)
+                pipe.publish(CANAL_INVALIDACAO, json.dumps(
+                    [f"compra:{compra['id']}" for compra in compras] +
+                    [f"cliente:{cliente['id']}" for cliente in clientes]
+                ))
+                resultados = await pipe.execute()
+                
+                # ZADD retorna 1 só para clientes que ainda não estavam no índice
+                novos = clientes_novos(clientes, resultados)
+                if novos:
+                    await self.redis.lpush(ns + 'clientes', *novos)
+                
+                await self._store_relacoes(adjacencias, ns)
+                
+                # Quem recebe recomendações de quem comprou ganha pontos no produto
+                pipe = self.redis.pipeline(transaction=False)
+                for compra in compras:
+                    recebem_de = [
+                        rec['cliente_id']
+                        for rec in adjacencias.get(compra['cliente_id'], {}).get('recomendacoes', [])
+                    ]
+                    atualizar_recomendacoes_top(
+                        pipe, self._script_atualizar_top, compra, recebem_de, ns,
+                        k=self.top_k_recomendacoes
+                    )
+                await pipe.execute()
+                await self.redis.zrem(
+                    ns + CHAVE_COMPRAS_PENDENTES, *[compra['id'] for compra in compras]
+                )
+            except Exception as e:
+                print(f"✗ Erro ao aplicar compras pendentes: {e}")
+                return aplicadas
+            aplicadas += len(compras)
+    
+    async def _hgetall_lista(self, lista, ns):
+        """Lê os hashes indexados por uma lista, em pipelines paralelos"""
+        keys = await self.redis.lrange(ns + lista, 0, -1)
+        
+        async def ler(lote):
+            pipe = self.redis.pipeline(transaction=False)
+            for key in lote:
+                pipe.hgetall(ns + key)
+            return [registro for registro in await pipe.execute() if registro]
+        
+        lotes = await asyncio.gather(*(
+            self._limitado(ler(keys[i:i + self.chunk_size]))
+            for i in range(0, len(keys), self.chunk_size)
+        ))
+        return [registro for lote in lotes for registro in lote]
+    
+    async def _ler_listas(self, keys, ns):
+        """Lê listas de amigos/recomendações em blob ou no formato JSON antigo.
+        
+        Como em RedisDB._ler_listas, uma chave ilegível vem como lista vazia.
+        """
+        async def ler(keys, blob):
+            pipe = self.redis_binario.pipeline(transaction=False)
+            for key in keys:
+                ler_lista(pipe, ns + key, blob)
+            return await pipe.execute(raise_on_error=False)
+        
+        valores = await ler(keys, self.listas_binarias)
+        relerem = outro_formato(valores)
+        if relerem:
+            relidos = await ler([keys[i] for i in relerem], not self.listas_binarias)
+            for i, valor in zip(relerem, relidos):
+                valores[i] = valor
+        return [
+            tentar_decodificar_lista(self.codecs, key, valor) or []
+            for key, valor in zip(keys, valores)
+        ]
+    
+    async def get_dados_consolidados(self):
+        """Retorna todos os dados consolidados do Redis"""
+        ns = await self._namespace()
+        clientes, compras = await asyncio.gather(
+            self._hgetall_lista('clientes', ns),
+            self._hgetall_lista('compras', ns)
+        )
+        cliente_ids = [int(cliente['id']) for cliente in clientes]
+        
+        async def ler_relacoes(lote):
+            keys = [
+                f"{prefixo}:{cliente_id}"
+                for cliente_id in lote for prefixo in ('amigos', 'recomendacoes')
+            ]
+            return lote, await self._ler_listas(keys, ns)
+        
+        dados = {'clientes': clientes, 'compras': compras, 'amigos': {}, 'recomendacoes': {}}
+        lotes = await asyncio.gather(*(
+            self._limitado(ler_relacoes(cliente_ids[i:i + self.chunk_size]))
+            for i in range(0, len(cliente_ids), self.chunk_size)
+        ))
+        for lote, valores in lotes:
+            for j, cliente_id in enumerate(lote):
+                dados['amigos'][cliente_id] = valores[2 * j]
+                dados['recomendacoes'][cliente_id] = valores[2 * j + 1]
+        return dados
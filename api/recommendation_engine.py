@@ -0,0 +1,120 @@
+"""
+Motor de recomendação baseado em compras de amigos
+
+Recomenda a um cliente os produtos que os amigos dele compraram e ele
+ainda não. As compras de cada cliente ficam em conjuntos de códigos
+inteiros de produto, então cada diferença custa O(tamanho do conjunto)
+em vez de uma busca em lista por produto.
+"""
+import math
+import time
+from collections import Counter
+
+
+class RecommendationEngine:
+    def __init__(self):
+        self.produtos = []      # código -> produto
+        self._codigos = {}      # produto -> código
+        self.compras = {}       # cliente -> conjunto de códigos de produto
+        self.amigos = {}        # cliente -> conjunto de amigos (de quem ele recebe recomendações)
+        self.datas = {}         # cliente -> {código: timestamp da compra mais recente}
+        self._recomendacoes = None
+    
+    def _codificar(self, produto):
+        """Retorna o código inteiro do produto, criando um se for novo"""
+        codigo = self._codigos.get(produto)
+        if codigo is None:
+            codigo = len(self.produtos)
+            self._codigos[produto] = codigo
+            self.produtos.append(produto)
+        return codigo
+    
+    def adicionar_compra(self, cliente, produto, data=None):
+        """Registra que `cliente` comprou `produto` (data: timestamp, opcional)"""
+        codigo = self._codificar(produto)
+        self.compras.setdefault(cliente, set()).add(codigo)
+        if data is not None:
+            datas = self.datas.setdefault(cliente, {})
+            datas[codigo] = max(datas.get(codigo, data), data)
+        self._recomendacoes = None
+    
+    def adicionar_compras(self, compras, campo_cliente='cliente_id', campo_produto='produto'):
+        """Registra compras (dicionários); os campos indicam cliente e produto"""
+        for compra in compras:
+            self.adicionar_compra(compra[campo_cliente], compra[campo_produto])
+    
+    def adicionar_amizade(self, cliente, amigo):
+        """Faz `cliente` receber recomendações do que `amigo` compra"""
+        self.amigos.setdefault(cliente, set()).add(amigo)
+        self._recomendacoes = None
+    
+    def limpar_amizades(self):
+        """Esquece as amizades (as compras ficam), para recarregá-las"""
+        self.amigos = {}
+        self._recomendacoes = None
+    
+    def calcular(self):
+        """Calcula de uma vez as recomendações de todos os clientes.
+        
+        A pontuação de um produto é o número de amigos que o compraram.
+        """
+        vazio = frozenset()
+        self._recomendacoes = {}
+        for cliente, amigos in self.amigos.items():
+            meus = self.compras.get(cliente, vazio)
+            contagem = Counter()
+            for amigo in amigos:
+                contagem.update(self.compras.get(amigo, vazio) - meus)
+            self._recomendacoes[cliente] = sorted(
+                contagem.items(), key=lambda item: (-item[1], str(self.produtos[item[0]]))
+            )
+    
+    def pontuar(self, k=10, agora=None, meia_vida_dias=30, peso_popularidade=0.5):
+        """Calcula os k melhores produtos de cada cliente, com pontuação.
+        
+        Cada amigo que comprou o produto soma 0.5 ** (idade da compra em
+        dias / meia_vida_dias): compras recentes valem perto de 1. A
+        popularidade (compradores do produto sobre os do mais comprado,
+        em escala log) soma até peso_popularidade. Retorna
+        {cliente: [(produto, pontuação)]}, da maior pontuação para a menor.
+        """
+        agora = time.time() if agora is None else agora
+        meia_vida = meia_vida_dias * 86400
+        vazio = frozenset()
+        
+        compradores = Counter()
+        for codigos in self.compras.values():
+            compradores.update(codigos)
+        escala = math.log1p(max(compradores.values(), default=0)) or 1.0
+        
+        resultado = {}
+        for cliente, amigos in self.amigos.items():
+            meus = self.compras.get(cliente, vazio)
+            pontos = Counter()
+            for amigo in amigos:
+                datas = self.datas.get(amigo, {})
+                for codigo in self.compras.get(amigo, vazio) - meus:
+                    data = datas.get(codigo)
+                    idade = max(agora - data, 0) if data is not None else meia_vida
+                    pontos[codigo] += 0.5 ** (idade / meia_vida)
+            for codigo in pontos:
+                pontos[codigo] += peso_popularidade * math.log1p(compradores[codigo]) / escala
+            resultado[cliente] = [
+                (self.produtos[codigo], round(pontuacao, 6))
+                for codigo, pontuacao in pontos.most_common(k)
+            ]
+        return resultado
+    
+    def recommend(self, client_id, k=10):
+        """Retorna até k pares (produto, amigos que compraram), do mais indicado ao menos"""
+        if self._recomendacoes is None:
+            self.calcular()
+        return [
+            (self.produtos[codigo], pontos)
+            for codigo, pontos in self._recomendacoes.get(client_id, [])[:k]
+        ]
+    
+    def recomendar_de(self, amigo, cliente):
+        """Produtos que `amigo` comprou e `cliente` não, em ordem alfabética"""
+        diferenca = self.compras.get(amigo, frozenset()) - self.compras.get(cliente, frozenset())
+        return sorted((self.produtos[codigo] for codigo in diferenca), key=str)
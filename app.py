@@ -3,19 +3,26 @@ Interface CLI para consultar dados integrados de múltiplos bancos
 Funciona com dados já existentes nos bancos
 """
 import os
-from database.postgres_db import PostgresDB
-from database.mongo_db import MongoDB
-from database.neo4j_db import Neo4jDB
-from database.redis_db import RedisDB
+import sys
+from config.databases import POSTGRES_CONFIG, MONGO_CONFIG, NEO4J_CONFIG, REDIS_CONFIG
+from database.conexoes import conectar_em_paralelo, imprimir_status
+from database.lazy import ConexaoPreguicosa
+from api.recommendation_engine import RecommendationEngine
 
 
 class InterfaceConsultaDados:
-    def __init__(self):
-        self.postgres = PostgresDB()
-        self.mongo = MongoDB()
-        self.neo4j = Neo4jDB()
-        self.redis = RedisDB()
+    def __init__(self, lazy=False):
+        # Os drivers só são importados quando cada banco é usado pela primeira vez
+        self.postgres = ConexaoPreguicosa('PostgreSQL', 'database.postgres_db', 'PostgresDB', POSTGRES_CONFIG)
+        self.mongo = ConexaoPreguicosa('MongoDB', 'database.mongo_db', 'MongoDB', MONGO_CONFIG)
+        self.neo4j = ConexaoPreguicosa('Neo4j', 'database.neo4j_db', 'Neo4jDB', NEO4J_CONFIG)
+        self.redis = ConexaoPreguicosa('Redis', 'database.redis_db', 'RedisDB', REDIS_CONFIG)
+        # Modo lazy: não conecta tudo na abertura, só o que cada tela usar
+        self.lazy = lazy
         self.conectado = False
+        self.tamanho_pagina = 20
+        # (versão das compras em cache, motor montado com elas)
+        self._motor_compras = None
     
     def limpar_tela(self):
         """Limpa a tela do terminal"""
@@ -25,10 +32,13 @@ class InterfaceConsultaDados:
         """Conecta em todos os bancos"""
         print("\n=== CONECTANDO AOS BANCOS DE DADOS ===\n")
         
-        self.postgres.connect()
-        self.mongo.connect()
-        self.neo4j.connect()
-        self.redis.connect()
+        status = conectar_em_paralelo({
+            'PostgreSQL': self.postgres,
+            'MongoDB': self.mongo,
+            'Neo4j': self.neo4j,
+            'Redis': self.redis
+        })
+        imprimir_status(status)
         
         self.conectado = True
         input("\nPressione Enter para continuar...")
@@ -40,6 +50,15 @@ class InterfaceConsultaDados:
         self.neo4j.disconnect()
         self.redis.disconnect()
     
+    def imprimir_tempos_carga(self):
+        """Mostra o tempo de import e de conexão dos bancos usados na sessão"""
+        for banco in (self.postgres, self.mongo, self.neo4j, self.redis):
+            if banco.carregado and banco.tempo_conexao is not None:
+                print(f"  • {banco.nome}: import {banco.tempo_import * 1000:.0f} ms, "
+                      f"conexão {banco.tempo_conexao * 1000:.0f} ms")
+            else:
+                print(f"  • {banco.nome}: não utilizado")
+    
     def exibir_menu_principal(self):
         """Exibe menu principal"""
         self.limpar_tela()
@@ -55,6 +74,37 @@ class InterfaceConsultaDados:
         print("7. Sair")
         print("\n" + "=" * 70)
     
+    def paginar(self, buscar_pagina, exibir):
+        """Exibe resultados página a página, até o fim ou até o usuário parar.
+        
+        buscar_pagina(cursor) retorna (linhas, proximo_cursor), com
+        proximo_cursor None na última página. Retorna quantas linhas exibiu.
+        """
+        cursor = None
+        exibidas = 0
+        while True:
+            linhas, cursor = buscar_pagina(cursor)
+            for linha in linhas:
+                exibir(linha)
+            exibidas += len(linhas)
+            if cursor is None:
+                return exibidas
+            if input("-- Enter: próxima página | q: parar -- ").strip().lower() == 'q':
+                return exibidas
+    
+    def pagina_clientes_postgres(self, apos_id):
+        """Página de clientes do PostgreSQL, continuando do ID informado"""
+        clientes = self.postgres.get_clientes_pagina(apos_id or 0, self.tamanho_pagina)
+        proximo = clientes[-1]['id'] if len(clientes) == self.tamanho_pagina else None
+        return clientes, proximo
+    
+    def pagina_compras_postgres(self, apos):
+        """Página de compras do PostgreSQL, continuando do par (data, id) informado"""
+        compras = self.postgres.get_compras_pagina(apos, self.tamanho_pagina)
+        if len(compras) < self.tamanho_pagina:
+            return compras, None
+        return compras, (compras[-1]['data'], compras[-1]['id'])
+    
     def visualizar_postgres(self):
         """Visualiza dados do PostgreSQL"""
         self.limpar_tela()
@@ -62,16 +112,17 @@ class InterfaceConsultaDados:
         
         print("📋 CLIENTES:")
         print("-" * 70)
-        clientes = self.postgres.get_all_clientes()
         print(f"{'ID':<5} {'CPF':<15} {'Nome':<25} {'Cidade':<20} {'UF':<3}")
         print("-" * 70)
-        for cliente in clientes:
-            print(f"{cliente['id']:<5} {cliente['cpf']:<15} {cliente['nome']:<25} {cliente['cidade']:<20} {cliente['uf']:<3}")
+        total_clientes = self.paginar(
+            self.pagina_clientes_postgres,
+            lambda cliente: print(f"{cliente['id']:<5} {cliente['cpf']:<15} {cliente['nome']:<25} {cliente['cidade']:<20} {cliente['uf']:<3}")
+        )
         
         print(f"\n📦 PRODUTOS:")
         print("-" * 70)
         try:
-            with self.postgres.conn.cursor() as cur:
+            with self.postgres.cursor() as cur:
                 cur.execute("SELECT id, produto, valor, tipo FROM produtos")
                 produtos = cur.fetchall()
                 print(f"{'ID':<5} {'Produto':<30} {'Valor':<15} {'Tipo':<20}")
@@ -83,13 +134,14 @@ class InterfaceConsultaDados:
         
         print(f"\n🛍️  COMPRAS:")
         print("-" * 70)
-        compras = self.postgres.get_all_compras()
         print(f"{'ID':<5} {'Cliente':<25} {'Produto':<30} {'Valor':<15} {'Data':<20}")
         print("-" * 70)
-        for compra in compras:
-            print(f"{compra['id']:<5} {compra['cliente_nome']:<25} {compra['produto']:<30} R$ {compra['valor']:<13.2f} {str(compra['data']):<20}")
+        total_compras = self.paginar(
+            self.pagina_compras_postgres,
+            lambda compra: print(f"{compra['id']:<5} {compra['cliente_nome']:<25} {compra['produto']:<30} R$ {compra['valor']:<13.2f} {str(compra['data']):<20}")
+        )
         
-        input(f"\n\nTotal: {len(clientes)} clientes | {len(compras)} compras\nPressione Enter para continuar...")
+        input(f"\n\nExibidos: {total_clientes} clientes | {total_compras} compras\nPressione Enter para continuar...")
     
     def visualizar_mongodb(self):
         """Visualiza dados do MongoDB"""
@@ -155,91 +207,190 @@ class InterfaceConsultaDados:
         
         input("\nPressione Enter para continuar...")
     
-    def sincronizar_redis(self):
-        """Sincroniza dados para Redis"""
+    def sincronizar_redis(self, somente_se_vazio=False):
+        """Sincroniza dados para Redis.
+        
+        Só um processo reconstrói por vez; os outros esperam por ele. Com
+        somente_se_vazio, desiste se o cache já tiver sido preenchido por
+        outro processo enquanto esta chamada esperava a trava.
+        """
         print("\n=== SINCRONIZANDO CACHE REDIS ===\n")
         
+        token = None
+        ns = None
         try:
-            print("Limpando cache anterior...")
-            self.redis.clear_cache()
-            
-            print("Copiando dados do PostgreSQL...")
-            clientes = self.postgres.get_all_clientes()
-            self.redis.store_clientes(clientes)
-            
-            compras = self.postgres.get_all_compras()
-            self.redis.store_compras(compras)
-            
-            print("Copiando dados do Neo4j...")
-            with self.neo4j.driver.session() as session:
-                # Copiar amigos para Redis
-                result = session.run("""
-                    MATCH (p:Pessoa)-[:AMIGO_DE]->(amigo:Pessoa)
-                    RETURN p.id as pessoa_id, amigo.id as amigo_id, amigo.nome as amigo_nome, amigo.cpf as amigo_cpf
-                """)
-                
-                amigos_por_pessoa = {}
-                for record in result:
-                    pessoa_id = record['pessoa_id']
-                    if pessoa_id not in amigos_por_pessoa:
-                        amigos_por_pessoa[pessoa_id] = []
-                    amigos_por_pessoa[pessoa_id].append({
-                        'id': record['amigo_id'],
-                        'nome': record['amigo_nome'],
-                        'cpf': record['amigo_cpf']
-                    })
-                
-                for pessoa_id, amigos in amigos_por_pessoa.items():
-                    self.redis.store_amigos(pessoa_id, amigos)
-            
-            print("\n✓ Cache sincronizado com sucesso!")
-            
+            token = self.redis.adquirir_trava_reconstrucao()
+            if token is None:
+                print("Outro processo já está sincronizando o cache, aguardando...")
+                if self.redis.aguardar_reconstrucao():
+                    print("✓ Cache sincronizado por outro processo")
+                else:
+                    print("⚠ A sincronização ainda não terminou; exibindo o cache atual")
+            elif somente_se_vazio and not self.redis.cache_vazio():
+                print("✓ Cache já sincronizado por outro processo")
+            else:
+                # O cache atual continua sendo lido até a troca no final
+                print("Preparando namespace novo...")
+                ns = self.redis.iniciar_reconstrucao()
+                if not self._copiar_para_cache(ns, token):
+                    print("✗ Sincronização incompleta: o cache anterior continua em uso")
+                    self.redis.abortar_reconstrucao(ns)
+                elif self.redis.concluir_reconstrucao(ns, token):
+                    print("\n✓ Cache sincronizado com sucesso!")
+        
         except Exception as e:
+            self.redis.abortar_reconstrucao(ns)
             print(f"✗ Erro: {e}")
+        finally:
+            if token is not None:
+                self.redis.liberar_trava_reconstrucao(token)
         
         input("\nPressione Enter para continuar...")
     
+    def _copiar_para_cache(self, ns, token):
+        """Copia clientes, compras, amigos e recomendações para o namespace em construção ns.
+        
+        Grava as mesmas chaves da reconstrução da API (incluindo a geração
+        de recomendacoes:top), mas com as Pessoas do grafo. Retorna False se
+        alguma gravação falhou (o namespace não deve ser usado).
+        """
+        print("Copiando dados do PostgreSQL...")
+        if self.redis.store_clientes(self.postgres.iter_clientes(), ns, token) is False:
+            return False
+        
+        # Maior compra copiada: marca d'água da sincronização incremental.
+        # As compras também alimentam as recomendações pontuadas
+        ultima_compra = 0
+        motor = RecommendationEngine()
+        
+        def compras_stream():
+            nonlocal ultima_compra
+            for compra in self.postgres.iter_compras():
+                ultima_compra = max(ultima_compra, compra['id'])
+                motor.adicionar_compra(
+                    compra['cliente_id'], compra['produto_id'], compra['data'].timestamp()
+                )
+                yield compra
+        
+        if self.redis.store_compras(compras_stream(), ns, token) is False:
+            return False
+        
+        print("Copiando dados do Neo4j...")
+        with self.neo4j.driver.session() as session:
+            # Copiar amigos para Redis
+            result = session.run("""
+                MATCH (p:Pessoa)-[:AMIGO_DE]->(amigo:Pessoa)
+                RETURN p.id as pessoa_id, p.nome as pessoa_nome,
+                       amigo.id as amigo_id, amigo.nome as amigo_nome, amigo.cpf as amigo_cpf
+            """)
+            
+            # Amigos de cada pessoa e, para cada amigo, quem o tem como amigo
+            # (os mesmos campos das recomendações de Neo4jDB.get_adjacencias)
+            amigos_por_pessoa = {}
+            recomendacoes_por_amigo = {}
+            for record in result:
+                pessoa_id = record['pessoa_id']
+                amigo_id = record['amigo_id']
+                if pessoa_id not in amigos_por_pessoa:
+                    amigos_por_pessoa[pessoa_id] = []
+                amigos_por_pessoa[pessoa_id].append({
+                    'id': amigo_id,
+                    'nome': record['amigo_nome'],
+                    'cpf': record['amigo_cpf']
+                })
+                recomendacoes_por_amigo.setdefault(amigo_id, []).append({
+                    'cliente_id': pessoa_id,
+                    'cliente_nome': record['pessoa_nome'],
+                    'amigo_id': amigo_id,
+                    'amigo_nome': record['amigo_nome']
+                })
+                motor.adicionar_amizade(pessoa_id, amigo_id)
+        
+        if not self.redis.renovar_trava_reconstrucao(token):
+            return False
+        if self.redis.store_amigos_lote(amigos_por_pessoa, ns, token) is False:
+            return False
+        if self.redis.store_recomendacoes_lote(recomendacoes_por_amigo, ns, token) is False:
+            return False
+        
+        print("Calculando recomendações pontuadas...")
+        ranking = motor.pontuar(self.redis.top_k_recomendacoes)
+        if self.redis.store_recomendacoes_top(ranking, ns, token) is None:
+            return False
+        return self.redis.set_ultima_compra_sincronizada(ultima_compra, ns)
+    
+    def pagina_clientes_redis(self, apos_id):
+        """Página de clientes do cache, continuando do ID informado"""
+        clientes = self.redis.get_clientes_pagina(apos_id or 0, self.tamanho_pagina)
+        proximo = int(clientes[-1]['id']) if len(clientes) == self.tamanho_pagina else None
+        return clientes, proximo
+    
+    def pagina_compras_redis(self, offset):
+        """Página de compras do cache, continuando da posição informada"""
+        offset = offset or 0
+        compras = self.redis.get_compras(offset, self.tamanho_pagina)
+        proximo = offset + len(compras) if len(compras) == self.tamanho_pagina else None
+        return compras, proximo
+    
+    def motor_compras(self):
+        """Motor de recomendação com as compras em cache, remontado só quando elas mudam.
+        
+        As amizades são recarregadas a cada uso (limpar_amizades). Retorna
+        None se as compras não puderam ser lidas por inteiro.
+        """
+        versao = self.redis.versao_compras()
+        if versao is not None and self._motor_compras and self._motor_compras[0] == versao:
+            motor = self._motor_compras[1]
+        else:
+            # Compras por cliente (pelo nome, que é o que liga as Pessoas do grafo)
+            motor = RecommendationEngine()
+            try:
+                motor.adicionar_compras(self.redis.iter_compras(), campo_cliente='cliente_nome')
+            except Exception:
+                # Já impresso por RedisDB.iter_compras
+                return None
+            self._motor_compras = (versao, motor) if versao is not None else None
+        motor.limpar_amizades()
+        return motor
+    
     def consultar_dados_consolidados(self):
         """Consulta dados consolidados"""
         self.limpar_tela()
         print("=== DADOS CONSOLIDADOS ===\n")
         
         # Tentar obter do Redis
-        clientes_redis = self.redis.get_clientes()
-        compras_redis = self.redis.get_compras()
-        
-        if not clientes_redis:
+        if not self.redis.get_clientes(limit=1):
             print("Cache vazio. Sincronizando...")
-            self.sincronizar_redis()
-            clientes_redis = self.redis.get_clientes()
-            compras_redis = self.redis.get_compras()
+            self.sincronizar_redis(somente_se_vazio=True)
         
         print("\n📋 CLIENTES EM CACHE:")
         print("-" * 70)
         print(f"{'ID':<5} {'CPF':<15} {'Nome':<30} {'E-mail':<30}")
         print("-" * 70)
-        for cliente in clientes_redis:
-            print(f"{cliente['id']:<5} {cliente['cpf']:<15} {cliente['nome']:<30} {cliente['email']:<30}")
+        self.paginar(
+            self.pagina_clientes_redis,
+            lambda cliente: print(f"{cliente['id']:<5} {cliente['cpf']:<15} {cliente['nome']:<30} {cliente['email']:<30}")
+        )
         
         print(f"\n\n🛍️  COMPRAS EM CACHE:")
         print("-" * 70)
         print(f"{'Cliente':<25} {'Produto':<30} {'Valor':<15}")
         print("-" * 70)
-        for compra in compras_redis:
-            print(f"{compra['cliente_nome']:<25} {compra['produto']:<30} R$ {float(compra['valor']):<13.2f}")
+        self.paginar(
+            self.pagina_compras_redis,
+            lambda compra: print(f"{compra['cliente_nome']:<25} {compra['produto']:<30} R$ {float(compra['valor']):<13.2f}")
+        )
+        
+        print(f"\n\n🏆 PRODUTOS MAIS POPULARES:")
+        print("-" * 70)
+        for i, produto in enumerate(self.redis.get_top_produtos(5), 1):
+            tipo = f" [{produto['tipo']}]" if produto.get('tipo') else ""
+            print(f"{i}. {produto.get('produto', produto['id'])}{tipo}: {produto['compras']} compra(s)")
         
         print(f"\n\n🤝 AMIGOS CADASTRADOS E RECOMENDAÇÕES:")
         print("-" * 70)
         
-        # Obter dados de compras para recomendação
-        compras_por_cliente = {}
-        for compra in compras_redis:
-            cliente = compra['cliente_nome']
-            produto = compra['produto']
-            if cliente not in compras_por_cliente:
-                compras_por_cliente[cliente] = []
-            if produto not in compras_por_cliente[cliente]:
-                compras_por_cliente[cliente].append(produto)
+        motor = self.motor_compras()
         
         with self.neo4j.driver.session() as session:
             result = session.run("""
@@ -255,6 +406,8 @@ class InterfaceConsultaDados:
                 if pessoa not in pessoas_amigos:
                     pessoas_amigos[pessoa] = []
                 pessoas_amigos[pessoa].append(amigo)
+                if motor:
+                    motor.adicionar_amizade(pessoa, amigo)
             
             for pessoa, amigos in pessoas_amigos.items():
                 print(f"\n👤 {pessoa}:")
@@ -264,28 +417,26 @@ class InterfaceConsultaDados:
                 for amigo in amigos:
                     print(f"    • {amigo}")
                 
-                # Mostrar recomendações baseadas em compras
-                if pessoa in compras_por_cliente:
-                    produtos_comprados = compras_por_cliente[pessoa]
-                    print(f"\n  📋 Recomendações para seus amigos:")
-                    
-                    for amigo in amigos:
-                        # Filtrar produtos que o amigo ainda não comprou
-                        produtos_amigo = compras_por_cliente.get(amigo, [])
-                        recomendacoes = [p for p in produtos_comprados if p not in produtos_amigo]
-                        
-                        if recomendacoes:
-                            print(f"    Para {amigo}: {', '.join(recomendacoes)}")
-                        else:
-                            print(f"    Para {amigo}: Nenhuma recomendação (já comprou tudo)")
+                # Mostrar recomendações baseadas nas compras dos amigos
+                # (calculadas para todas as pessoas de uma vez, no primeiro recommend)
+                if motor is None:
+                    print(f"\n  ✗ Compras do cache indisponíveis para recomendar")
+                elif any(amigo in motor.compras for amigo in amigos):
+                    recomendacoes = motor.recommend(pessoa, 10)
+                    print(f"\n  📋 Recomendações (compradas pelos amigos):")
+                    if recomendacoes:
+                        for produto, compradores in recomendacoes:
+                            print(f"    • {produto} ({compradores} amigo(s))")
+                    else:
+                        print(f"    Nenhuma recomendação (já comprou tudo)")
                 else:
-                    print(f"\n  ℹ️  Sem compras registradas para recomendar")
+                    print(f"\n  ℹ️  Amigos sem compras registradas para recomendar")
         
         input("\n\nPressione Enter para continuar...")
     
     def executar(self):
         """Executa a interface"""
-        if not self.conectado:
+        if not self.conectado and not self.lazy:
             self.conectar()
         
         while True:
@@ -306,10 +457,19 @@ class InterfaceConsultaDados:
                 self.consultar_dados_consolidados()
             elif opcao == "7":
                 print("\n=== ENCERRANDO SISTEMA ===")
-                print("\nLimpando cache Redis...")
-                self.redis.clear_cache()
+                # O cache fica: ele é compartilhado com os outros processos.
+                # Antes de desconectar: depois, acessar o Redis pelo proxy reconectaria
+                estatisticas = None
+                if not self.lazy or self.redis.carregado:
+                    estatisticas = self.redis.estatisticas_cache()
                 print("Desconectando dos bancos...")
                 self.desconectar()
+                print("\nTempos de carga:")
+                self.imprimir_tempos_carga()
+                if estatisticas:
+                    print(f"\nCache local: {estatisticas['hits']} hits, "
+                          f"{estatisticas['misses']} misses "
+                          f"({estatisticas['taxa_acerto']:.0%} de acerto)")
                 print("\n✓ Sistema encerrado com sucesso!")
                 print("Até logo!")
                 break
@@ -318,5 +478,5 @@ class InterfaceConsultaDados:
 
 
 if __name__ == "__main__":
-    interface = InterfaceConsultaDados()
+    interface = InterfaceConsultaDados(lazy='--lazy' in sys.argv)
     interface.executar()
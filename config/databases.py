@@ -12,7 +12,18 @@ POSTGRES_CONFIG = {
     'user': 'postgres',
     'password': '190309',
     'database': 'PostgreInt',
-    'port': 5432
+    'port': 5432,
+    # Linhas por INSERT (e por commit) nas cargas em lote
+    'chunk_size': 1000,
+    'connect_timeout': 5,
+    # Pool de conexões: tamanho, espera máxima por uma conexão livre (s)
+    # e teste com SELECT 1 a cada empréstimo
+    'pool_min': 1,
+    'pool_max': 10,
+    'pool_timeout': 30,
+    'pool_health_check': True,
+    # Linhas buscadas por ida ao servidor nos cursores de streaming
+    'itersize': 2000
 }
 
 # MongoDB
@@ -20,6 +31,7 @@ MONGO_CONFIG = {
     'host': 'localhost',
     'port': 27017,
     'database': 'MongoInt',
+    'connect_timeout': 5
 }
 
 # Neo4j
@@ -27,12 +39,59 @@ NEO4J_CONFIG = {
     'uri': 'bolt://98.92.119.153',
     'username': 'neo4j',
     'password': 'civilian-test-ornament',
-    'database': 'neo4j'
+    'database': 'neo4j',
+    # Host remoto: mais tempo para o handshake Bolt
+    'connect_timeout': 15,
+    # IDs por consulta UNWIND nas leituras em lote
+    'chunk_size': 1000,
+    # Cria constraints e índices que faltarem (idempotente) ao conectar
+    'criar_esquema': True
 }
 
 # Redis
 REDIS_CONFIG = {
     'host': 'localhost',
     'port': 6379,
-    'db': 0
+    'db': 0,
+    # Tempo limite (s) para abrir a conexão, usado também na conexão em paralelo
+    'connect_timeout': 5,
+    # Escritas em lote: comandos por pipeline e uso de MULTI/EXEC
+    'chunk_size': 1000,
+    'pipeline_transacional': False,
+    # Cache local (L1) em memória na frente do Redis: liga/desliga, número
+    # máximo de chaves e TTL (s) por família de chave; famílias fora de
+    # cache_local_ttl sempre vão ao Redis
+    'cache_local': os.getenv('REDIS_CACHE_LOCAL', '0') == '1',
+    'cache_local_max_itens': 10000,
+    'cache_local_ttl': {
+        'amigos': 30,
+        'recomendacoes': 30,
+        'cliente': 60,
+        'compra': 300
+    },
+    # Formato das listas de amigos e recomendações: 'binario' (um blob por
+    # lista, comprimido com zlib acima de codec_limite_compressao bytes) ou
+    # 'json' (um elemento por item, formato antigo)
+    'codec_listas': 'binario',
+    'codec_limite_compressao': 1024,
+    # Por quanto tempo (s) um CPF não encontrado no PostgreSQL fica marcado
+    # como inexistente na busca por CPF
+    'cpf_ausente_ttl': 60,
+    # Validade (s) do ranking de produtos do círculo de amigos de um cliente
+    'ranking_amigos_ttl': 60,
+    # Produtos guardados por cliente nas recomendações pré-calculadas
+    'recomendacoes_top_k': 50,
+    # Reconstrução em namespace novo: por quanto tempo (s) cada processo
+    # reaproveita o ponteiro lido e quanto tempo o namespace anterior
+    # continua disponível depois da troca
+    'namespace_ttl': 1.0,
+    'namespace_carencia': 300,
+    # Trava da reconstrução completa: validade (s), renovada a cada lote, e
+    # quanto tempo (s) os outros processos esperam antes de seguir com o
+    # cache que houver
+    'reconstrucao_lease': 120,
+    'reconstrucao_espera': 30,
+    # A sincronização incremental relê os últimos N IDs abaixo da marca
+    # d'água: um ID menor pode ser confirmado depois de um maior
+    'sync_janela_compras': 500
 }
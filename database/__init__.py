@@ -1,10 +1,22 @@
 """
 __init__.py para módulo de banco de dados
+
+As classes são importadas sob demanda: importar um submódulo (ex.:
+database.conexoes) não carrega os quatro drivers.
 """
+import importlib
 
-from .postgres_db import PostgresDB
-from .mongo_db import MongoDB
-from .neo4j_db import Neo4jDB
-from .redis_db import RedisDB
+_MODULOS = {
+    'PostgresDB': '.postgres_db',
+    'MongoDB': '.mongo_db',
+    'Neo4jDB': '.neo4j_db',
+    'RedisDB': '.redis_db',
+}
 
 __all__ = ['PostgresDB', 'MongoDB', 'Neo4jDB', 'RedisDB']
+
+
+def __getattr__(nome):
+    if nome in _MODULOS:
+        return getattr(importlib.import_module(_MODULOS[nome], __name__), nome)
+    raise AttributeError(f"module {__name__!r} has no attribute {nome!r}")
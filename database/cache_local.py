@@ -0,0 +1,114 @@
+"""
+Cache local (L1) em memória, na frente do Redis
+"""
+import json
+import threading
+import time
+from collections import OrderedDict
+
+# Canal do Redis em que as escritas anunciam as chaves regravadas
+CANAL_INVALIDACAO = 'cache:invalidacao'
+
+# Mensagem que invalida o cache inteiro (ex.: depois de um FLUSHDB)
+INVALIDAR_TUDO = '*'
+
+
+class CacheLocal:
+    """Cache LRU limitado a `max_itens`, com TTL por família de chave.
+    
+    A família é o prefixo da chave antes do primeiro ':' ('amigos',
+    'cliente', ...). Famílias fora de `ttls` não são guardadas. As
+    leituras e escritas são protegidas por um lock, pois a invalidação
+    chega por uma thread de pub/sub.
+    """
+    
+    def __init__(self, max_itens=10000, ttls=None):
+        self.max_itens = max_itens
+        self.ttls = ttls or {}
+        self._itens = OrderedDict()     # chave -> (expira_em, valor)
+        self._lock = threading.Lock()
+        self._assinatura = None
+        self.hits = 0
+        self.misses = 0
+        self.expirados = 0
+        self.removidos = 0
+    
+    def _ttl(self, chave):
+        return self.ttls.get(chave.split(':', 1)[0])
+    
+    def cacheavel(self, chave):
+        """Indica se a família da chave tem TTL configurado"""
+        return self._ttl(chave) is not None
+    
+    def get(self, chave):
+        """Retorna (True, valor) se a chave está no cache e válida; senão (False, None)"""
+        with self._lock:
+            item = self._itens.get(chave)
+            if item is None:
+                self.misses += 1
+                return False, None
+            expira_em, valor = item
+            if expira_em <= time.monotonic():
+                del self._itens[chave]
+                self.expirados += 1
+                self.misses += 1
+                return False, None
+            self._itens.move_to_end(chave)
+            self.hits += 1
+            return True, valor
+    
+    def set(self, chave, valor):
+        """Guarda o valor, descartando os menos usados acima de max_itens"""
+        ttl = self._ttl(chave)
+        if ttl is None:
+            return
+        with self._lock:
+            self._itens[chave] = (time.monotonic() + ttl, valor)
+            self._itens.move_to_end(chave)
+            while len(self._itens) > self.max_itens:
+                self._itens.popitem(last=False)
+                self.removidos += 1
+    
+    def invalidar(self, chaves):
+        """Remove as chaves do cache"""
+        with self._lock:
+            for chave in chaves:
+                self._itens.pop(chave, None)
+    
+    def limpar(self):
+        """Esvazia o cache"""
+        with self._lock:
+            self._itens.clear()
+    
+    def estatisticas(self):
+        """Contadores de uso: itens, hits, misses, taxa de acerto, expirados e removidos"""
+        with self._lock:
+            total = self.hits + self.misses
+            return {
+                'itens': len(self._itens),
+                'hits': self.hits,
+                'misses': self.misses,
+                'taxa_acerto': self.hits / total if total else 0.0,
+                'expirados': self.expirados,
+                'removidos': self.removidos
+            }
+    
+    def _receber(self, mensagem):
+        """Trata uma mensagem do canal de invalidação"""
+        dados = mensagem['data']
+        if dados == INVALIDAR_TUDO:
+            self.limpar()
+        else:
+            self.invalidar(json.loads(dados))
+    
+    def assinar(self, client):
+        """Escuta o canal de invalidação em uma thread (o cliente deve decodificar respostas)"""
+        pubsub = client.pubsub(ignore_subscribe_messages=True)
+        pubsub.subscribe(**{CANAL_INVALIDACAO: self._receber})
+        self._assinatura = pubsub.run_in_thread(sleep_time=0.5, daemon=True)
+    
+    def encerrar(self):
+        """Para a thread de invalidação"""
+        if self._assinatura is not None:
+            self._assinatura.stop()
+            self._assinatura = None
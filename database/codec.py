@@ -0,0 +1,156 @@
+"""
+Codec binário das listas de amigos e recomendações no Redis
+
+Cada lista vira um único valor (SET) em vez de um elemento JSON por LPUSH.
+Formato: 1 byte de versão, 1 byte de flags e o corpo, com o número de
+itens seguido dos campos de cada item (inteiros em 8 bytes, textos em
+UTF-8 com o tamanho na frente). Com FLAG_ZLIB o corpo está comprimido.
+"""
+import json
+import struct
+import zlib
+
+VERSAO = 1
+FLAG_ZLIB = 0x01
+
+_CABECALHO = struct.Struct('<BB')
+_CONTAGEM = struct.Struct('<I')
+_INTEIRO = struct.Struct('<q')
+_TAMANHO = struct.Struct('<I')
+
+# Marcadores de campo ausente (None)
+_INTEIRO_NULO = -2 ** 63
+_INTEIRO_MAXIMO = 2 ** 63 - 1
+_TEXTO_NULO = 0xFFFFFFFF
+
+# Campos de cada família de lista, na ordem em que são gravados
+CAMPOS = {
+    'amigos': (('id', int), ('cpf', str), ('nome', str)),
+    'recomendacoes': (
+        ('cliente_id', int), ('cliente_nome', str),
+        ('amigo_id', int), ('amigo_nome', str)
+    ),
+}
+
+
+class CodecLista:
+    """Codifica listas de dicionários com os mesmos campos em um blob.
+    
+    Corpos com mais de `limite_compressao` bytes são comprimidos com zlib
+    (0 desliga a compressão).
+    """
+    
+    def __init__(self, campos, limite_compressao=1024, nivel=6):
+        self.campos = campos
+        self.limite_compressao = limite_compressao
+        self.nivel = nivel
+    
+    def aceita(self, itens):
+        """Indica se os itens cabem no formato sem perda.
+        
+        Só dicionários com campos conhecidos, inteiros de 64 bits nos campos
+        int e textos nos campos str (None vale em qualquer campo).
+        """
+        nomes = {nome for nome, _ in self.campos}
+        for item in itens:
+            if not isinstance(item, dict) or not nomes.issuperset(item):
+                return False
+            for nome, tipo in self.campos:
+                valor = item.get(nome)
+                if valor is None:
+                    continue
+                if tipo is int:
+                    if type(valor) is not int or not _INTEIRO_NULO < valor <= _INTEIRO_MAXIMO:
+                        return False
+                elif not isinstance(valor, str):
+                    return False
+        return True
+    
+    def codificar(self, itens):
+        """Retorna o blob (bytes) de uma lista de dicionários (confira antes com aceita)"""
+        partes = [_CONTAGEM.pack(len(itens))]
+        for item in itens:
+            for nome, tipo in self.campos:
+                valor = item.get(nome)
+                if tipo is int:
+                    partes.append(_INTEIRO.pack(_INTEIRO_NULO if valor is None else valor))
+                elif valor is None:
+                    partes.append(_TAMANHO.pack(_TEXTO_NULO))
+                else:
+                    texto = str(valor).encode('utf-8')
+                    partes.append(_TAMANHO.pack(len(texto)))
+                    partes.append(texto)
+        corpo = b''.join(partes)
+        
+        flags = 0
+        if self.limite_compressao and len(corpo) > self.limite_compressao:
+            corpo = zlib.compress(corpo, self.nivel)
+            flags |= FLAG_ZLIB
+        return _CABECALHO.pack(VERSAO, flags) + corpo
+    
+    def decodificar(self, blob):
+        """Retorna a lista de dicionários de um blob"""
+        versao, flags = _CABECALHO.unpack_from(blob)
+        if versao != VERSAO:
+            raise ValueError(f"Versão de codec desconhecida: {versao}")
+        corpo = blob[_CABECALHO.size:]
+        if flags & FLAG_ZLIB:
+            corpo = zlib.decompress(corpo)
+        
+        corpo = memoryview(corpo)
+        quantidade, = _CONTAGEM.unpack_from(corpo)
+        pos = _CONTAGEM.size
+        itens = []
+        for _ in range(quantidade):
+            item = {}
+            for nome, tipo in self.campos:
+                if tipo is int:
+                    valor, = _INTEIRO.unpack_from(corpo, pos)
+                    pos += _INTEIRO.size
+                    item[nome] = None if valor == _INTEIRO_NULO else valor
+                else:
+                    tamanho, = _TAMANHO.unpack_from(corpo, pos)
+                    pos += _TAMANHO.size
+                    if tamanho == _TEXTO_NULO:
+                        item[nome] = None
+                    else:
+                        item[nome] = str(corpo[pos:pos + tamanho], 'utf-8')
+                        pos += tamanho
+            itens.append(item)
+        return itens
+
+
+def criar_codecs(limite_compressao=1024):
+    """Um CodecLista por família de CAMPOS ({'amigos': ..., 'recomendacoes': ...})"""
+    return {
+        familia: CodecLista(campos, limite_compressao)
+        for familia, campos in CAMPOS.items()
+    }
+
+
+def decodificar_lista(codecs, chave, valor):
+    """Lista gravada em {prefixo}:{id}, em qualquer um dos formatos.
+    
+    valor é o que o Redis devolveu para a chave: um blob (GET), os
+    elementos JSON do formato antigo (LRANGE) ou None se a chave não existe.
+    """
+    if isinstance(valor, Exception):
+        raise valor
+    if valor is None:
+        return []
+    if isinstance(valor, (bytes, bytearray)):
+        return codecs[chave.split(':', 1)[0]].decodificar(valor)
+    return [json.loads(elemento) for elemento in valor]
+
+
+def tentar_decodificar_lista(codecs, chave, valor):
+    """Como decodificar_lista, mas retorna None (e avisa) se o valor é um erro ou está ilegível.
+    
+    Em uma leitura em lote, uma chave ruim não deve derrubar as outras: o
+    chamador a trata como ausente.
+    """
+    try:
+        return decodificar_lista(codecs, chave, valor)
+    except Exception as e:
+        print(f"⚠ Lista {chave} ilegível, tratada como ausente: {e}")
+        return None
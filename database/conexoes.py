@@ -0,0 +1,61 @@
+"""
+Conexão simultânea aos bancos de dados
+"""
+import time
+from concurrent.futures import ThreadPoolExecutor, TimeoutError as FuturoTimeout
+
+# Espera máxima padrão (s) por um banco sem 'connect_timeout' na configuração
+TIMEOUT_PADRAO = 10
+
+
+def _conectar(banco):
+    """Conecta um banco e mede o tempo gasto"""
+    inicio = time.perf_counter()
+    ok = bool(banco.connect())
+    return ok, time.perf_counter() - inicio
+
+
+def conectar_em_paralelo(bancos):
+    """Conecta todos os bancos ao mesmo tempo, cada um em uma thread.
+    
+    `bancos` é um dicionário {nome: objeto com connect()}. O tempo limite
+    de cada banco vem de banco.config['connect_timeout'] (padrão
+    TIMEOUT_PADRAO). Retorna {nome: {'ok', 'tempo', 'erro'}}, com o tempo
+    em segundos; o total fica perto do banco mais lento, não da soma.
+    """
+    executor = ThreadPoolExecutor(max_workers=max(len(bancos), 1))
+    inicio = time.perf_counter()
+    futuros = {nome: executor.submit(_conectar, banco) for nome, banco in bancos.items()}
+    
+    resultado = {}
+    for nome, futuro in futuros.items():
+        config = getattr(bancos[nome], 'config', None) or {}
+        limite = config.get('connect_timeout', TIMEOUT_PADRAO)
+        restante = max(0.0, inicio + limite - time.perf_counter())
+        try:
+            ok, tempo = futuro.result(timeout=restante)
+            resultado[nome] = {'ok': ok, 'tempo': tempo, 'erro': None if ok else 'falha ao conectar'}
+        except FuturoTimeout:
+            resultado[nome] = {
+                'ok': False,
+                'tempo': time.perf_counter() - inicio,
+                'erro': f"sem resposta em {limite}s"
+            }
+        except Exception as e:
+            resultado[nome] = {'ok': False, 'tempo': time.perf_counter() - inicio, 'erro': str(e)}
+    
+    # Não espera as conexões que estouraram o tempo limite
+    executor.shutdown(wait=False)
+    return resultado
+
+
+def imprimir_status(status):
+    """Imprime o resultado de conectar_em_paralelo, um banco por linha"""
+    print(f"\n{'Banco':<12} {'Status':<8} {'Tempo':>10}")
+    print("-" * 32)
+    for nome, item in status.items():
+        marca = "✓" if item['ok'] else "✗"
+        linha = f"{nome:<12} {marca:<8} {item['tempo'] * 1000:>7.0f} ms"
+        if item['erro']:
+            linha += f"  ({item['erro']})"
+        print(linha)
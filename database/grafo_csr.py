@@ -0,0 +1,195 @@
+"""
+Grafo de amizades em memória no formato CSR (compressed sparse row)
+
+Os IDs dos nós (de qualquer tipo que sirva de chave de dicionário e vá
+para JSON: inteiros, textos...) ficam em uma lista, com um dicionário
+ID -> posição; os vizinhos do nó na posição i são destinos[offsets[i]:
+offsets[i + 1]], guardados como posições, não IDs. offsets e destinos são
+arrays de inteiros de 8 bytes, que podem ser gravados em arquivo e lidos
+de volta com mmap, sem cópia.
+"""
+import json
+import mmap
+import struct
+from array import array
+from collections import Counter, deque
+
+# Arquivo: MAGICO, número de nós e de arestas e tamanho dos IDs, seguidos
+# de offsets e destinos (inteiros na ordem de bytes da máquina que gravou)
+# e da lista de IDs em JSON
+MAGICO = b'GRAFOCS2'
+_CABECALHO = struct.Struct('=8sqqq')
+
+
+class GrafoCSR:
+    """Adjacências somente leitura de um grafo dirigido.
+    
+    ids é a lista dos IDs originais; offsets e destinos são sequências de
+    inteiros (array('q') ou memoryview de um arquivo mapeado). Use
+    de_arestas para montar a partir de pares (origem, destino) e carregar
+    para abrir um arquivo de salvar.
+    """
+    
+    def __init__(self, ids, offsets, destinos, arquivo=None):
+        self.ids = ids
+        self._posicoes = {id_: i for i, id_ in enumerate(ids)}
+        self.offsets = offsets
+        self.destinos = destinos
+        self._arquivo = arquivo
+        self._mmap = None
+    
+    @classmethod
+    def de_arestas(cls, arestas, nos=()):
+        """Monta o grafo a partir de pares (origem, destino) de IDs.
+        
+        `nos` acrescenta IDs sem arestas (aparecem com grau 0). Os nós ficam
+        na ordem em que aparecem (primeiro `nos`, depois as arestas). Arestas
+        repetidas são gravadas uma vez só.
+        """
+        ids = []
+        posicao = {}
+        linhas = []
+        
+        def posicao_de(id_):
+            i = posicao.get(id_)
+            if i is None:
+                i = posicao[id_] = len(ids)
+                ids.append(id_)
+                linhas.append(set())
+            return i
+        
+        for id_ in nos:
+            posicao_de(id_)
+        for origem, destino in arestas:
+            i = posicao_de(origem)
+            linhas[i].add(posicao_de(destino))
+        
+        offsets = array('q', [0])
+        vizinhos = array('q')
+        for linha in linhas:
+            vizinhos.extend(sorted(linha))
+            offsets.append(len(vizinhos))
+        return cls(ids, offsets, vizinhos)
+    
+    @property
+    def total_nos(self):
+        return len(self.ids)
+    
+    @property
+    def total_arestas(self):
+        return len(self.destinos)
+    
+    def _posicao(self, id_):
+        """Posição do ID em ids, ou -1 se ele não está no grafo"""
+        return self._posicoes.get(id_, -1)
+    
+    def __contains__(self, id_):
+        return self._posicao(id_) >= 0
+    
+    def _vizinhos(self, i):
+        return self.destinos[self.offsets[i]:self.offsets[i + 1]]
+    
+    def vizinhos(self, id_):
+        """IDs dos vizinhos diretos (arestas de saída); [] se o ID não existe"""
+        i = self._posicao(id_)
+        if i < 0:
+            return []
+        return [self.ids[j] for j in self._vizinhos(i)]
+    
+    def grau(self, id_):
+        """Número de arestas de saída do nó (0 se o ID não existe)"""
+        i = self._posicao(id_)
+        if i < 0:
+            return 0
+        return self.offsets[i + 1] - self.offsets[i]
+    
+    def distribuicao_graus(self):
+        """Counter {grau: quantidade de nós com esse grau}"""
+        return Counter(self.offsets[i + 1] - self.offsets[i] for i in range(len(self.ids)))
+    
+    def mais_conectados(self, n=5):
+        """Os n nós de maior grau, como pares (id, grau); empates na ordem dos nós"""
+        graus = ((self.offsets[i + 1] - self.offsets[i], i) for i in range(len(self.ids)))
+        return [
+            (self.ids[i], grau)
+            for grau, i in sorted(graus, key=lambda par: (-par[0], par[1]))[:n]
+        ]
+    
+    def bfs(self, origem, max_saltos=None):
+        """Distância (em saltos) da origem até cada nó alcançável: {id: saltos}.
+        
+        A origem entra com distância 0; max_saltos limita a profundidade.
+        """
+        inicio = self._posicao(origem)
+        if inicio < 0:
+            return {}
+        distancias = {inicio: 0}
+        fila = deque([inicio])
+        while fila:
+            i = fila.popleft()
+            saltos = distancias[i]
+            if max_saltos is not None and saltos >= max_saltos:
+                continue
+            for j in self._vizinhos(i):
+                if j not in distancias:
+                    distancias[j] = saltos + 1
+                    fila.append(j)
+        return {self.ids[i]: saltos for i, saltos in distancias.items()}
+    
+    def k_saltos(self, id_, k=2):
+        """IDs a até k saltos do nó, sem ele mesmo (k=2: amigos e amigos de amigos)"""
+        return {outro for outro, saltos in self.bfs(id_, k).items() if saltos > 0}
+    
+    def distancia(self, origem, destino):
+        """Menor número de saltos de origem até destino, ou None se não há caminho"""
+        return self.bfs(origem).get(destino)
+    
+    def salvar(self, caminho):
+        """Grava o grafo em um arquivo que carregar abre com mmap"""
+        ids = json.dumps(self.ids).encode()
+        with open(caminho, 'wb') as arquivo:
+            arquivo.write(_CABECALHO.pack(MAGICO, len(self.ids), len(self.destinos), len(ids)))
+            for dados in (self.offsets, self.destinos):
+                arquivo.write(memoryview(dados).cast('B'))
+            arquivo.write(ids)
+    
+    @classmethod
+    def carregar(cls, caminho):
+        """Abre um arquivo de salvar mapeado em memória (somente leitura).
+        
+        offsets e destinos apontam direto para o arquivo (só a lista de IDs
+        é lida para a memória); chame fechar() ao terminar.
+        """
+        arquivo = open(caminho, 'rb')
+        try:
+            mapa = mmap.mmap(arquivo.fileno(), 0, access=mmap.ACCESS_READ)
+        except Exception:
+            arquivo.close()
+            raise
+        magico, nos, arestas, tamanho_ids = _CABECALHO.unpack_from(mapa)
+        if magico != MAGICO:
+            mapa.close()
+            arquivo.close()
+            raise ValueError(f"{caminho} não é um grafo CSR")
+        
+        dados = memoryview(mapa)
+        pos = _CABECALHO.size
+        partes = []
+        for tamanho in (nos + 1, arestas):
+            partes.append(dados[pos:pos + tamanho * 8].cast('q'))
+            pos += tamanho * 8
+        ids = json.loads(mapa[pos:pos + tamanho_ids])
+        grafo = cls(ids, *partes, arquivo=arquivo)
+        grafo._mmap = mapa
+        return grafo
+    
+    def fechar(self):
+        """Libera o arquivo mapeado (no-op para grafos montados em memória)"""
+        if self._mmap is None:
+            return
+        for dados in (self.offsets, self.destinos):
+            dados.release()
+        self._mmap.close()
+        self._arquivo.close()
+        self._mmap = None
+        self._arquivo = None
@@ -0,0 +1,63 @@
+"""
+Conexão preguiçosa: importa o driver e conecta só no primeiro uso
+"""
+import importlib
+import time
+
+
+class ConexaoPreguicosa:
+    """Representa um banco (PostgresDB, MongoDB, ...) sem carregá-lo.
+    
+    O módulo do banco (e com ele o driver) só é importado, e a conexão só
+    é aberta, no primeiro acesso a um atributo do banco. Os tempos de
+    import e de conexão ficam em tempo_import e tempo_conexao (segundos).
+    """
+    
+    def __init__(self, nome, modulo, classe, config):
+        self.nome = nome
+        self.config = config
+        self._modulo = modulo
+        self._classe = classe
+        self._instancia = None
+        self._conectado = False
+        self.tempo_import = None
+        self.tempo_conexao = None
+    
+    @property
+    def carregado(self):
+        """Indica se o driver já foi importado e o banco instanciado"""
+        return self._instancia is not None
+    
+    def _carregar(self):
+        """Importa o módulo do banco e cria a instância (só na primeira vez)"""
+        if self._instancia is None:
+            inicio = time.perf_counter()
+            modulo = importlib.import_module(self._modulo)
+            self.tempo_import = time.perf_counter() - inicio
+            self._instancia = getattr(modulo, self._classe)()
+        return self._instancia
+    
+    def connect(self):
+        """Carrega o banco, se preciso, e conecta"""
+        instancia = self._carregar()
+        inicio = time.perf_counter()
+        self._conectado = bool(instancia.connect())
+        self.tempo_conexao = time.perf_counter() - inicio
+        print(f"  ↳ {self.nome}: import {self.tempo_import * 1000:.0f} ms, "
+              f"conexão {self.tempo_conexao * 1000:.0f} ms")
+        return self._conectado
+    
+    def disconnect(self):
+        """Desconecta, se o banco chegou a ser carregado"""
+        if self._instancia is not None:
+            self._instancia.disconnect()
+            self._conectado = False
+    
+    def __getattr__(self, nome):
+        # Só é chamado para atributos do banco: conecta no primeiro uso.
+        # Nomes privados não são repassados (evita recursão antes do __init__)
+        if nome.startswith('_'):
+            raise AttributeError(nome)
+        if not self._conectado:
+            self.connect()
+        return getattr(self._instancia, nome)
@@ -0,0 +1,217 @@
+"""
+Migrações versionadas do esquema PostgreSQL
+
+Cada migração tem uma versão, uma descrição e, ou uma lista de índices
+criados com CREATE INDEX CONCURRENTLY (sem bloquear escritas em um banco
+em produção), ou uma lista de comandos executados em uma única transação.
+As versões aplicadas ficam registradas na tabela schema_migrations.
+
+Para migrar um banco em uso: python -m database.migrations
+"""
+import sys
+
+# Chave do advisory lock que impede dois processos de migrarem ao mesmo tempo
+LOCK_MIGRACOES = 7_281_001
+
+MIGRACOES = [
+    {
+        'versao': 1,
+        'descricao': 'Índices de compras por cliente, produto e data',
+        'indices': [
+            # Gasto por cliente: JOIN por id_cliente já traz o produto (index-only scan)
+            ('idx_compras_cliente', """
+                CREATE INDEX CONCURRENTLY IF NOT EXISTS idx_compras_cliente
+                ON compras (id_cliente) INCLUDE (id_produto)
+            """),
+            ('idx_compras_produto', """
+                CREATE INDEX CONCURRENTLY IF NOT EXISTS idx_compras_produto
+                ON compras (id_produto)
+            """),
+            # ORDER BY data DESC e paginação por (data, id)
+            ('idx_compras_data_id', """
+                CREATE INDEX CONCURRENTLY IF NOT EXISTS idx_compras_data_id
+                ON compras (data DESC, id DESC)
+            """),
+        ],
+    },
+    {
+        'versao': 2,
+        'descricao': 'Rollups diários de gasto por cliente e de vendas por produto',
+        'comandos': [
+            """
+            CREATE TABLE IF NOT EXISTS gastos_cliente_diario (
+                id_cliente INT NOT NULL REFERENCES clientes(id),
+                dia DATE NOT NULL,
+                total_compras INT NOT NULL DEFAULT 0,
+                total_gasto NUMERIC(14, 2) NOT NULL DEFAULT 0,
+                PRIMARY KEY (id_cliente, dia)
+            );
+            """,
+            """
+            CREATE TABLE IF NOT EXISTS vendas_produto_diario (
+                id_produto INT NOT NULL REFERENCES produtos(id),
+                dia DATE NOT NULL,
+                total_compras INT NOT NULL DEFAULT 0,
+                total_valor NUMERIC(14, 2) NOT NULL DEFAULT 0,
+                PRIMARY KEY (id_produto, dia)
+            );
+            """,
+            # Mantém os rollups a cada compra inserida ou removida, com o
+            # valor do produto no momento da compra
+            """
+            CREATE OR REPLACE FUNCTION atualizar_rollups_compras() RETURNS trigger
+            LANGUAGE plpgsql AS $$
+            DECLARE
+                linha compras%ROWTYPE;
+                sinal INT;
+                preco NUMERIC;
+            BEGIN
+                IF TG_OP = 'INSERT' THEN
+                    linha := NEW;
+                    sinal := 1;
+                ELSE
+                    linha := OLD;
+                    sinal := -1;
+                END IF;
+                SELECT COALESCE(valor, 0) INTO preco FROM produtos WHERE id = linha.id_produto;
+                preco := COALESCE(preco, 0);
+                
+                INSERT INTO gastos_cliente_diario AS g (id_cliente, dia, total_compras, total_gasto)
+                VALUES (linha.id_cliente, linha.data::date, sinal, sinal * preco)
+                ON CONFLICT (id_cliente, dia) DO UPDATE
+                SET total_compras = g.total_compras + EXCLUDED.total_compras,
+                    total_gasto = g.total_gasto + EXCLUDED.total_gasto;
+                
+                INSERT INTO vendas_produto_diario AS v (id_produto, dia, total_compras, total_valor)
+                VALUES (linha.id_produto, linha.data::date, sinal, sinal * preco)
+                ON CONFLICT (id_produto, dia) DO UPDATE
+                SET total_compras = v.total_compras + EXCLUDED.total_compras,
+                    total_valor = v.total_valor + EXCLUDED.total_valor;
+                RETURN NULL;
+            END;
+            $$;
+            """,
+            # Bloqueia novas compras até o fim da transação: o histórico
+            # copiado abaixo e o trigger não se sobrepõem
+            "LOCK TABLE compras IN SHARE ROW EXCLUSIVE MODE;",
+            "DROP TRIGGER IF EXISTS trg_compras_rollups ON compras;",
+            """
+            CREATE TRIGGER trg_compras_rollups
+            AFTER INSERT OR DELETE ON compras
+            FOR EACH ROW EXECUTE FUNCTION atualizar_rollups_compras();
+            """,
+            "TRUNCATE gastos_cliente_diario, vendas_produto_diario;",
+            """
+            INSERT INTO gastos_cliente_diario (id_cliente, dia, total_compras, total_gasto)
+            SELECT c.id_cliente, c.data::date, COUNT(*), COALESCE(SUM(p.valor), 0)
+            FROM compras c
+            JOIN produtos p ON c.id_produto = p.id
+            GROUP BY c.id_cliente, c.data::date;
+            """,
+            """
+            INSERT INTO vendas_produto_diario (id_produto, dia, total_compras, total_valor)
+            SELECT c.id_produto, c.data::date, COUNT(*), COALESCE(SUM(p.valor), 0)
+            FROM compras c
+            JOIN produtos p ON c.id_produto = p.id
+            GROUP BY c.id_produto, c.data::date;
+            """,
+        ],
+    },
+]
+
+
+def _remover_indice_invalido(cursor, nome):
+    """Remove o que sobrou de um CREATE INDEX CONCURRENTLY interrompido.
+    
+    Um build concorrente que falha deixa o índice marcado como inválido, e o
+    IF NOT EXISTS passaria a ignorá-lo para sempre.
+    """
+    cursor.execute("""
+        SELECT 1 FROM pg_index
+        WHERE indexrelid = to_regclass(%s) AND NOT indisvalid;
+    """, (nome,))
+    if cursor.fetchone():
+        cursor.execute(f'DROP INDEX CONCURRENTLY IF EXISTS "{nome}";')
+
+
+def _registrar(cursor, migracao):
+    """Marca a migração como aplicada"""
+    cursor.execute("""
+        INSERT INTO schema_migrations (versao, descricao) VALUES (%s, %s)
+        ON CONFLICT (versao) DO NOTHING;
+    """, (migracao['versao'], migracao['descricao']))
+
+
+def _aplicar(cursor, migracao):
+    """Aplica uma migração (a conexão deve estar em autocommit)"""
+    if 'indices' in migracao:
+        # CONCURRENTLY não roda dentro de transação: um comando por vez
+        for nome, sql in migracao['indices']:
+            _remover_indice_invalido(cursor, nome)
+            cursor.execute(sql)
+        _registrar(cursor, migracao)
+        return
+    
+    cursor.execute("BEGIN;")
+    try:
+        for sql in migracao['comandos']:
+            cursor.execute(sql)
+        _registrar(cursor, migracao)
+        cursor.execute("COMMIT;")
+    except Exception:
+        cursor.execute("ROLLBACK;")
+        raise
+
+
+def aplicar_migracoes(postgres):
+    """Aplica as migrações pendentes; retorna a versão final do esquema"""
+    with postgres.conexao() as conn:
+        conn.autocommit = True
+        try:
+            with conn.cursor() as cursor:
+                cursor.execute("SELECT pg_advisory_lock(%s);", (LOCK_MIGRACOES,))
+                try:
+                    cursor.execute("""
+                        CREATE TABLE IF NOT EXISTS schema_migrations (
+                            versao INT PRIMARY KEY,
+                            descricao TEXT NOT NULL,
+                            aplicada_em TIMESTAMP DEFAULT CURRENT_TIMESTAMP
+                        );
+                    """)
+                    cursor.execute("SELECT versao FROM schema_migrations;")
+                    aplicadas = {linha[0] for linha in cursor.fetchall()}
+                    
+                    for migracao in MIGRACOES:
+                        if migracao['versao'] in aplicadas:
+                            continue
+                        _aplicar(cursor, migracao)
+                        aplicadas.add(migracao['versao'])
+                        print(f"✓ Migração {migracao['versao']} aplicada: {migracao['descricao']}")
+                finally:
+                    cursor.execute("SELECT pg_advisory_unlock(%s);", (LOCK_MIGRACOES,))
+        finally:
+            conn.autocommit = False
+    return max(aplicadas, default=0)
+
+
+def migrar():
+    """Cria as tabelas que faltarem e aplica as migrações pendentes, sem apagar dados.
+    
+    É o que `python -m database.migrations` executa; ao contrário de
+    RecommendationAPI.inicializar_bancos, pode rodar em um banco em uso.
+    Retorna True se tudo foi aplicado.
+    """
+    # Importado aqui: postgres_db importa este módulo
+    from database.postgres_db import PostgresDB
+    
+    postgres = PostgresDB()
+    if not postgres.connect():
+        return False
+    try:
+        return postgres.create_tables() and postgres.migrate()
+    finally:
+        postgres.disconnect()
+
+
+if __name__ == "__main__":
+    sys.exit(0 if migrar() else 1)
@@ -14,8 +14,11 @@ class MongoDB:
     def connect(self):
         """Conecta ao MongoDB"""
         try:
+            timeout_ms = int(self.config.get('connect_timeout', 10) * 1000)
             self.client = MongoClient(
-                f"mongodb://{self.config['host']}:{self.config['port']}/"
+                f"mongodb://{self.config['host']}:{self.config['port']}/",
+                connectTimeoutMS=timeout_ms,
+                serverSelectionTimeoutMS=timeout_ms
             )
             self.db = self.client[self.config['database']]
             # Testa a conexão
@@ -49,6 +52,20 @@ class MongoDB:
             print(f"✗ Erro ao inserir interesses: {e}")
             return None
     
+    def insert_clientes_interesses_lote(self, documentos):
+        """Insere vários documentos de interesses com um único insert_many"""
+        try:
+            documentos = list(documentos)
+            if not documentos:
+                return 0
+            collection = self.db['clientes_interesses']
+            result = collection.insert_many(documentos, ordered=False)
+            print(f"✓ Interesses de {len(result.inserted_ids)} clientes inseridos")
+            return len(result.inserted_ids)
+        except Exception as e:
+            print(f"✗ Erro ao inserir interesses: {e}")
+            return 0
+    
     def update_cliente_interesses(self, cliente_id, interesses):
         """Atualiza interesses de um cliente"""
         try:
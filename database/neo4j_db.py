@@ -3,28 +3,101 @@ Conexão e operações com Neo4j
 """
 from neo4j import GraphDatabase
 from config.databases import NEO4J_CONFIG
+from database.grafo_csr import GrafoCSR
+
+# Esquema: unicidade de id (e do cpf dos clientes, único também no
+# PostgreSQL) e índice no cpf das pessoas. As constraints de unicidade
+# criam os índices que atendem os MATCH por propriedade
+ESQUEMA = [
+    "CREATE CONSTRAINT cliente_id IF NOT EXISTS FOR (c:Cliente) REQUIRE c.id IS UNIQUE",
+    "CREATE CONSTRAINT cliente_cpf IF NOT EXISTS FOR (c:Cliente) REQUIRE c.cpf IS UNIQUE",
+    "CREATE CONSTRAINT pessoa_id IF NOT EXISTS FOR (p:Pessoa) REQUIRE p.id IS UNIQUE",
+    "CREATE INDEX pessoa_cpf IF NOT EXISTS FOR (p:Pessoa) ON (p.cpf)",
+]
+
+CRIAR_AMIZADE = """
+    MATCH (c1:Cliente {id: $id1}), (c2:Cliente {id: $id2})
+    CREATE (c1)-[:AMIGO]->(c2)
+"""
+
+CONSULTA_AMIGOS = """
+    MATCH (c:Cliente {id: $id})-[:AMIGO]->(amigo:Cliente)
+    RETURN amigo.id as id, amigo.cpf as cpf, amigo.nome as nome
+"""
+
+CONSULTA_RECOMENDACOES = """
+    MATCH (amigo:Cliente {id: $id})<-[:AMIGO]-(cliente:Cliente)
+    RETURN cliente.id as cliente_id, cliente.nome as cliente_nome,
+           amigo.id as amigo_id, amigo.nome as amigo_nome
+"""
+
+# Amigos (AMIGO de saída) e recomendações (AMIGO de entrada) de uma lista de IDs
+CONSULTA_ADJACENCIAS = """
+    UNWIND $ids AS id
+    MATCH (c:Cliente {id: id})
+    RETURN c.id as id,
+           [(c)-[:AMIGO]->(amigo:Cliente) |
+               {id: amigo.id, cpf: amigo.cpf, nome: amigo.nome}] as amigos,
+           [(c)<-[:AMIGO]-(cliente:Cliente) |
+               {cliente_id: cliente.id, cliente_nome: cliente.nome,
+                amigo_id: c.id, amigo_nome: c.nome}] as recomendacoes
+"""
+
+# Relação de amizade de cada rótulo: Cliente (criados pela API) e Pessoa
+RELACOES_AMIZADE = {'Cliente': 'AMIGO', 'Pessoa': 'AMIGO_DE'}
+
+
+# Operadores que leem todos os nós (de um label ou do banco)
+VARREDURAS = ('NodeByLabelScan', 'AllNodesScan')
+
+
+def _operadores(plano):
+    """Gera o operatorType de cada operador do plano (dict do EXPLAIN)"""
+    yield plano.get('operatorType', '')
+    for filho in plano.get('children', []):
+        yield from _operadores(filho)
+
+
+def _usa_indice(plano):
+    """Indica se o plano (dict do EXPLAIN) ancora os nós só por busca em índice.
+    
+    Exige ao menos uma busca por índice e nenhuma varredura: em um MATCH
+    com duas âncoras, uma buscada e outra varrida, o custo ainda é O(nós).
+    """
+    if not plano:
+        return False
+    operadores = list(_operadores(plano))
+    return (
+        any('IndexSeek' in operador for operador in operadores)
+        and not any(varredura in operador for operador in operadores for varredura in VARREDURAS)
+    )
 
 
 class Neo4jDB:
     def __init__(self):
         self.config = NEO4J_CONFIG
         self.driver = None
+        self.chunk_size = self.config.get('chunk_size', 1000)
     
     def connect(self):
         """Conecta ao Neo4j"""
         try:
             self.driver = GraphDatabase.driver(
                 self.config['uri'],
-                auth=(self.config['username'], self.config['password'])
+                auth=(self.config['username'], self.config['password']),
+                connection_timeout=self.config.get('connect_timeout', 10)
             )
             # Testa a conexão
             with self.driver.session() as session:
                 session.run("RETURN 1")
             print("✓ Conectado ao Neo4j")
-            return True
         except Exception as e:
             print(f"✗ Erro ao conectar Neo4j: {e}")
             return False
+        # Sem apagar nada: o esquema não depende de inicializar_bancos
+        if self.config.get('criar_esquema', True):
+            self.create_schema()
+        return True
     
     def disconnect(self):
         """Desconecta do Neo4j"""
@@ -32,6 +105,48 @@ class Neo4jDB:
             self.driver.close()
             print("✓ Desconectado do Neo4j")
     
+    def create_schema(self, timeout=300):
+        """Cria constraints e índices (idempotente) e espera ficarem online.
+        
+        Depois confere, pelos planos das consultas por id, se os índices
+        estão sendo usados. Retorna True se todos os planos usam índice.
+        """
+        try:
+            with self.driver.session() as session:
+                for comando in ESQUEMA:
+                    session.run(comando).consume()
+                session.run("CALL db.awaitIndexes($timeout)", timeout=timeout).consume()
+            print(f"✓ Esquema do Neo4j criado ({len(ESQUEMA)} constraints/índices)")
+        except Exception as e:
+            print(f"✗ Erro ao criar esquema: {e}")
+            return False
+        return all(self.verificar_planos().values())
+    
+    def verificar_planos(self):
+        """Roda EXPLAIN nas consultas por id e indica quais usam busca por índice.
+        
+        Retorna {nome da consulta: True/False}; as que têm alguma varredura
+        por label (ou de todos os nós) são avisadas.
+        """
+        consultas = {
+            'create_amizade': (CRIAR_AMIZADE, {'id1': 0, 'id2': 0}),
+            'get_amigos': (CONSULTA_AMIGOS, {'id': 0}),
+            'get_recomendacoes_para_amigo': (CONSULTA_RECOMENDACOES, {'id': 0}),
+            'get_adjacencias': (CONSULTA_ADJACENCIAS, {'ids': [0]}),
+        }
+        resultado = {}
+        try:
+            with self.driver.session() as session:
+                for nome, (consulta, parametros) in consultas.items():
+                    plano = session.run("EXPLAIN " + consulta, **parametros).consume().plan
+                    resultado[nome] = _usa_indice(plano)
+                    if not resultado[nome]:
+                        print(f"⚠ {nome} não usa só índices (varredura por label)")
+        except Exception as e:
+            print(f"✗ Erro ao verificar planos: {e}")
+            return {nome: False for nome in consultas}
+        return resultado
+    
     def create_cliente(self, cliente_id, cpf, nome):
         """Cria um nó de cliente"""
         try:
@@ -50,35 +165,119 @@ class Neo4jDB:
         """Cria uma relação de amizade entre dois clientes"""
         try:
             with self.driver.session() as session:
-                session.run(
-                    """
-                    MATCH (c1:Cliente {id: $id1}), (c2:Cliente {id: $id2})
-                    CREATE (c1)-[:AMIGO]->(c2)
-                    """,
-                    id1=cliente_id1, id2=cliente_id2
-                )
+                session.run(CRIAR_AMIZADE, id1=cliente_id1, id2=cliente_id2)
             print(f"✓ Amizade criada entre {cliente_id1} e {cliente_id2}")
             return True
         except Exception as e:
             print(f"✗ Erro ao criar amizade: {e}")
             return False
     
+    def create_clientes_lote(self, clientes):
+        """Cria vários nós de cliente ({id, cpf, nome}) com UNWIND"""
+        clientes = list(clientes)
+        criados = 0
+        try:
+            with self.driver.session() as session:
+                for i in range(0, len(clientes), self.chunk_size):
+                    lote = clientes[i:i + self.chunk_size]
+                    session.run(
+                        """
+                        UNWIND $clientes AS cliente
+                        CREATE (c:Cliente {id: cliente.id, cpf: cliente.cpf, nome: cliente.nome})
+                        """,
+                        clientes=lote
+                    ).consume()
+                    criados += len(lote)
+            print(f"✓ {criados} clientes criados no Neo4j")
+        except Exception as e:
+            print(f"✗ Erro ao criar clientes: {e}")
+        return criados
+    
+    def create_amizades_lote(self, amizades):
+        """Cria várias relações de amizade (pares id1, id2) com UNWIND"""
+        pares = [[id1, id2] for id1, id2 in amizades]
+        criadas = 0
+        try:
+            with self.driver.session() as session:
+                for i in range(0, len(pares), self.chunk_size):
+                    result = session.run(
+                        """
+                        UNWIND $pares AS par
+                        MATCH (c1:Cliente {id: par[0]}), (c2:Cliente {id: par[1]})
+                        CREATE (c1)-[:AMIGO]->(c2)
+                        """,
+                        pares=pares[i:i + self.chunk_size]
+                    )
+                    criadas += result.consume().counters.relationships_created
+            print(f"✓ {criadas} amizades criadas no Neo4j")
+        except Exception as e:
+            print(f"✗ Erro ao criar amizades: {e}")
+        return criadas
+    
     def get_amigos(self, cliente_id):
         """Retorna os amigos de um cliente"""
         try:
             with self.driver.session() as session:
-                result = session.run(
-                    """
-                    MATCH (c:Cliente {id: $id})-[:AMIGO]->(amigo:Cliente)
-                    RETURN amigo.id as id, amigo.cpf as cpf, amigo.nome as nome
-                    """,
-                    id=cliente_id
-                )
+                result = session.run(CONSULTA_AMIGOS, id=cliente_id)
                 return [dict(record) for record in result]
         except Exception as e:
             print(f"✗ Erro ao buscar amigos: {e}")
             return []
     
+    def get_adjacencias(self, cliente_ids):
+        """Retorna amigos e recomendações de vários clientes.
+        
+        Resultado: {id: {'amigos': [...], 'recomendacoes': [...]}}, com os
+        mesmos campos de get_amigos e get_recomendacoes_para_amigo. Usa uma
+        consulta UNWIND por lote de chunk_size IDs, em uma única sessão.
+        Retorna None em caso de erro, para não confundir falha com "sem amigos".
+        """
+        ids = list(cliente_ids)
+        adjacencias = {id_: {'amigos': [], 'recomendacoes': []} for id_ in ids}
+        try:
+            with self.driver.session() as session:
+                for i in range(0, len(ids), self.chunk_size):
+                    result = session.run(CONSULTA_ADJACENCIAS, ids=ids[i:i + self.chunk_size])
+                    for record in result:
+                        adjacencias[record['id']] = {
+                            'amigos': [dict(amigo) for amigo in record['amigos']],
+                            'recomendacoes': [dict(rec) for rec in record['recomendacoes']]
+                        }
+            return adjacencias
+        except Exception as e:
+            print(f"✗ Erro ao buscar adjacências: {e}")
+            return None
+    
+    def exportar_amizades(self, rotulo='Cliente'):
+        """Copia os nós e as amizades de um rótulo para um GrafoCSR em memória.
+        
+        rotulo é 'Cliente' (relação AMIGO) ou 'Pessoa' (relação AMIGO_DE).
+        Nós sem amizade entram com grau 0; nós sem a propriedade id entram
+        com o elementId do Neo4j. Retorna None em caso de erro.
+        """
+        relacao = RELACOES_AMIZADE[rotulo]
+        try:
+            with self.driver.session() as session:
+                ids = [
+                    record['id']
+                    for record in session.run(
+                        f"MATCH (n:{rotulo}) RETURN coalesce(n.id, elementId(n)) as id"
+                    )
+                ]
+                result = session.run(
+                    f"MATCH (a:{rotulo})-[:{relacao}]->(b:{rotulo}) "
+                    "RETURN coalesce(a.id, elementId(a)) as origem, "
+                    "coalesce(b.id, elementId(b)) as destino"
+                )
+                grafo = GrafoCSR.de_arestas(
+                    ((record['origem'], record['destino']) for record in result), ids
+                )
+            print(f"✓ Grafo exportado do Neo4j: {grafo.total_nos} nós, {grafo.total_arestas} arestas")
+            return grafo
+        except Exception as e:
+            print(f"✗ Erro ao exportar grafo: {e}")
+            return None
+    
     def get_all_clientes(self):
         """Retorna todos os clientes"""
         try:
@@ -106,14 +305,7 @@ class Neo4jDB:
         """Retorna clientes que compraram produtos e seus amigos"""
         try:
             with self.driver.session() as session:
-                result = session.run(
-                    """
-                    MATCH (amigo:Cliente {id: $id})<-[:AMIGO]-(cliente:Cliente)
-                    RETURN cliente.id as cliente_id, cliente.nome as cliente_nome,
-                           amigo.id as amigo_id, amigo.nome as amigo_nome
-                    """,
-                    id=amigo_id
-                )
+                result = session.run(CONSULTA_RECOMENDACOES, id=amigo_id)
                 return [dict(record) for record in result]
         except Exception as e:
             print(f"✗ Erro ao buscar recomendações: {e}")
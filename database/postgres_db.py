@@ -1,25 +1,49 @@
 """
 Conexão e operações com PostgreSQL
 """
+import threading
+import uuid
+from contextlib import contextmanager
 import psycopg2
 import psycopg2.extras
+import psycopg2.pool
 from config.databases import POSTGRES_CONFIG
+from database.migrations import aplicar_migracoes
+
+# Compras com os dados do cliente e do produto (sem WHERE/ORDER BY)
+SELECT_COMPRAS = """
+    SELECT c.id, cl.id as cliente_id, cl.nome as cliente_nome,
+           p.id as produto_id, p.produto, p.valor, p.tipo, c.data
+    FROM compras c
+    JOIN clientes cl ON c.id_cliente = cl.id
+    JOIN produtos p ON c.id_produto = p.id
+"""
 
 
 class PostgresDB:
     def __init__(self):
         self.config = POSTGRES_CONFIG
-        self.conn = None
+        self.pool = None
+        self.chunk_size = self.config.get('chunk_size', 1000)
+        self.pool_max = self.config.get('pool_max', 10)
+        self.pool_timeout = self.config.get('pool_timeout', 30)
+        self.health_check = self.config.get('pool_health_check', True)
+        self.itersize = self.config.get('itersize', 2000)
+        # Limita os empréstimos a pool_max: sem isso o getconn falha em vez de esperar
+        self._vagas = threading.BoundedSemaphore(self.pool_max)
     
     def connect(self):
-        """Conecta ao banco PostgreSQL"""
+        """Conecta ao banco PostgreSQL (cria o pool de conexões)"""
         try:
-            self.conn = psycopg2.connect(
+            self.pool = psycopg2.pool.ThreadedConnectionPool(
+                self.config.get('pool_min', 1),
+                self.pool_max,
                 host=self.config['host'],
                 user=self.config['user'],
                 password=self.config['password'],
                 dbname=self.config['database'],
-                port=self.config['port']
+                port=self.config['port'],
+                connect_timeout=self.config.get('connect_timeout', 10)
             )
             print("✓ Conectado ao PostgreSQL")
             return True
@@ -29,121 +53,228 @@ class PostgresDB:
     
     def disconnect(self):
         """Desconecta do banco PostgreSQL"""
-        if self.conn:
-            self.conn.close()
+        if self.pool:
+            self.pool.closeall()
+            self.pool = None
             print("✓ Desconectado do PostgreSQL")
     
+    def _obter_conexao_saudavel(self):
+        """Retira uma conexão do pool, descartando as que caíram"""
+        # No pior caso todas as conexões ociosas morreram (ex.: restart do servidor)
+        for _ in range(self.pool_max + 1):
+            conn = self.pool.getconn()
+            try:
+                if conn.closed:
+                    raise psycopg2.InterfaceError("conexão fechada")
+                if self.health_check:
+                    with conn.cursor() as cursor:
+                        cursor.execute("SELECT 1")
+                    conn.rollback()
+                return conn
+            except psycopg2.Error:
+                self.pool.putconn(conn, close=True)
+        raise psycopg2.OperationalError("Nenhuma conexão saudável disponível no pool")
+    
+    @contextmanager
+    def conexao(self):
+        """Empresta uma conexão do pool: commit ao sair, rollback em caso de erro"""
+        if not self._vagas.acquire(timeout=self.pool_timeout):
+            raise TimeoutError(f"Nenhuma conexão livre no pool após {self.pool_timeout}s")
+        conn = None
+        try:
+            conn = self._obter_conexao_saudavel()
+            yield conn
+            conn.commit()
+        except Exception:
+            if conn is not None and not conn.closed:
+                conn.rollback()
+            raise
+        finally:
+            if conn is not None:
+                self.pool.putconn(conn, close=bool(conn.closed))
+            self._vagas.release()
+    
+    @contextmanager
+    def cursor(self, cursor_factory=None):
+        """Cursor em uma conexão emprestada do pool, com commit ao sair"""
+        with self.conexao() as conn:
+            cursor = conn.cursor(cursor_factory=cursor_factory)
+            try:
+                yield cursor
+            finally:
+                cursor.close()
+    
     def create_tables(self):
         """Cria as tabelas necessárias"""
         try:
-            cursor = self.conn.cursor()
-            
-            # Tabela Clientes
-            cursor.execute("""
-                CREATE TABLE IF NOT EXISTS clientes (
-                    id SERIAL PRIMARY KEY,
-                    cpf VARCHAR(11) UNIQUE NOT NULL,
-                    nome VARCHAR(255) NOT NULL,
-                    endereco VARCHAR(255),
-                    cidade VARCHAR(100),
-                    uf VARCHAR(2),
-                    email VARCHAR(255)
-                );
-            """)
+            with self.cursor() as cursor:
+                # Tabela Clientes
+                cursor.execute("""
+                    CREATE TABLE IF NOT EXISTS clientes (
+                        id SERIAL PRIMARY KEY,
+                        cpf VARCHAR(11) UNIQUE NOT NULL,
+                        nome VARCHAR(255) NOT NULL,
+                        endereco VARCHAR(255),
+                        cidade VARCHAR(100),
+                        uf VARCHAR(2),
+                        email VARCHAR(255)
+                    );
+                """)
+                
+                # Tabela Produtos
+                cursor.execute("""
+                    CREATE TABLE IF NOT EXISTS produtos (
+                        id SERIAL PRIMARY KEY,
+                        produto VARCHAR(255) NOT NULL,
+                        valor DECIMAL(10, 2),
+                        quantidade INT,
+                        tipo VARCHAR(100)
+                    );
+                """)
+                
+                # Tabela Compras
+                cursor.execute("""
+                    CREATE TABLE IF NOT EXISTS compras (
+                        id SERIAL PRIMARY KEY,
+                        id_cliente INT NOT NULL,
+                        id_produto INT NOT NULL,
+                        data TIMESTAMP DEFAULT CURRENT_TIMESTAMP,
+                        FOREIGN KEY (id_cliente) REFERENCES clientes(id),
+                        FOREIGN KEY (id_produto) REFERENCES produtos(id)
+                    );
+                """)
             
-            # Tabela Produtos
-            cursor.execute("""
-                CREATE TABLE IF NOT EXISTS produtos (
-                    id SERIAL PRIMARY KEY,
-                    produto VARCHAR(255) NOT NULL,
-                    valor DECIMAL(10, 2),
-                    quantidade INT,
-                    tipo VARCHAR(100)
-                );
-            """)
-            
-            # Tabela Compras
-            cursor.execute("""
-                CREATE TABLE IF NOT EXISTS compras (
-                    id SERIAL PRIMARY KEY,
-                    id_cliente INT NOT NULL,
-                    id_produto INT NOT NULL,
-                    data TIMESTAMP DEFAULT CURRENT_TIMESTAMP,
-                    FOREIGN KEY (id_cliente) REFERENCES clientes(id),
-                    FOREIGN KEY (id_produto) REFERENCES produtos(id)
-                );
-            """)
-            
-            self.conn.commit()
             print("✓ Tabelas criadas no PostgreSQL")
             return True
         except Exception as e:
-            self.conn.rollback()
             print(f"✗ Erro ao criar tabelas: {e}")
             return False
     
+    def migrate(self):
+        """Aplica as migrações de esquema pendentes (índices etc.)"""
+        try:
+            versao = aplicar_migracoes(self)
+            print(f"✓ Esquema do PostgreSQL na versão {versao}")
+            return True
+        except Exception as e:
+            print(f"✗ Erro ao aplicar migrações: {e}")
+            return False
+    
     def insert_cliente(self, cpf, nome, endereco, cidade, uf, email):
         """Insere um cliente"""
         try:
-            cursor = self.conn.cursor()
-            cursor.execute("""
-                INSERT INTO clientes (cpf, nome, endereco, cidade, uf, email)
-                VALUES (%s, %s, %s, %s, %s, %s)
-                RETURNING id;
-            """, (cpf, nome, endereco, cidade, uf, email))
-            cliente_id = cursor.fetchone()[0]
-            self.conn.commit()
+            with self.cursor() as cursor:
+                cursor.execute("""
+                    INSERT INTO clientes (cpf, nome, endereco, cidade, uf, email)
+                    VALUES (%s, %s, %s, %s, %s, %s)
+                    RETURNING id;
+                """, (cpf, nome, endereco, cidade, uf, email))
+                cliente_id = cursor.fetchone()[0]
             print(f"✓ Cliente {nome} inserido com ID {cliente_id}")
             return cliente_id
         except Exception as e:
-            self.conn.rollback()
             print(f"✗ Erro ao inserir cliente: {e}")
             return None
     
     def insert_produto(self, produto, valor, quantidade, tipo):
         """Insere um produto"""
         try:
-            cursor = self.conn.cursor()
-            cursor.execute("""
-                INSERT INTO produtos (produto, valor, quantidade, tipo)
-                VALUES (%s, %s, %s, %s)
-                RETURNING id;
-            """, (produto, valor, quantidade, tipo))
-            produto_id = cursor.fetchone()[0]
-            self.conn.commit()
+            with self.cursor() as cursor:
+                cursor.execute("""
+                    INSERT INTO produtos (produto, valor, quantidade, tipo)
+                    VALUES (%s, %s, %s, %s)
+                    RETURNING id;
+                """, (produto, valor, quantidade, tipo))
+                produto_id = cursor.fetchone()[0]
             print(f"✓ Produto {produto} inserido com ID {produto_id}")
             return produto_id
         except Exception as e:
-            self.conn.rollback()
             print(f"✗ Erro ao inserir produto: {e}")
             return None
     
     def insert_compra(self, id_cliente, id_produto):
         """Insere uma compra"""
         try:
-            cursor = self.conn.cursor()
-            cursor.execute("""
-                INSERT INTO compras (id_cliente, id_produto)
-                VALUES (%s, %s)
-                RETURNING id;
-            """, (id_cliente, id_produto))
-            compra_id = cursor.fetchone()[0]
-            self.conn.commit()
+            with self.cursor() as cursor:
+                cursor.execute("""
+                    INSERT INTO compras (id_cliente, id_produto)
+                    VALUES (%s, %s)
+                    RETURNING id;
+                """, (id_cliente, id_produto))
+                compra_id = cursor.fetchone()[0]
             print(f"✓ Compra inserida com ID {compra_id}")
             return compra_id
         except Exception as e:
-            self.conn.rollback()
             print(f"✗ Erro ao inserir compra: {e}")
             return None
     
+    def _inserir_em_lotes(self, sql, linhas, descricao):
+        """Insere linhas com INSERT multi-valores, um commit por lote.
+        
+        `sql` deve ter um único %s no VALUES e terminar em RETURNING id.
+        Retorna os IDs gerados, na ordem das linhas; se um lote falhar,
+        ele é desfeito e só os IDs dos lotes já confirmados são retornados.
+        """
+        ids = []
+        linhas = list(linhas)
+        try:
+            with self.conexao() as conn, conn.cursor() as cursor:
+                for i in range(0, len(linhas), self.chunk_size):
+                    lote = linhas[i:i + self.chunk_size]
+                    resultado = psycopg2.extras.execute_values(
+                        cursor, sql, lote, page_size=len(lote), fetch=True
+                    )
+                    conn.commit()
+                    ids.extend(linha[0] for linha in resultado)
+            print(f"✓ {descricao}: {len(ids)} linha(s) inserida(s)")
+        except Exception as e:
+            print(f"✗ Erro ao inserir {descricao} (a partir da linha {len(ids)}): {e}")
+        return ids
+    
+    def insert_clientes_lote(self, clientes):
+        """Insere vários clientes; retorna os IDs na ordem recebida"""
+        return self._inserir_em_lotes(
+            """
+            INSERT INTO clientes (cpf, nome, endereco, cidade, uf, email)
+            VALUES %s
+            RETURNING id;
+            """,
+            ((c['cpf'], c['nome'], c.get('endereco'), c.get('cidade'),
+              c.get('uf'), c.get('email')) for c in clientes),
+            'clientes'
+        )
+    
+    def insert_produtos_lote(self, produtos):
+        """Insere vários produtos; retorna os IDs na ordem recebida"""
+        return self._inserir_em_lotes(
+            """
+            INSERT INTO produtos (produto, valor, quantidade, tipo)
+            VALUES %s
+            RETURNING id;
+            """,
+            ((p['produto'], p.get('valor'), p.get('quantidade'), p.get('tipo'))
+             for p in produtos),
+            'produtos'
+        )
+    
+    def insert_compras_lote(self, compras):
+        """Insere várias compras (pares id_cliente, id_produto); retorna os IDs"""
+        return self._inserir_em_lotes(
+            """
+            INSERT INTO compras (id_cliente, id_produto)
+            VALUES %s
+            RETURNING id;
+            """,
+            compras,
+            'compras'
+        )
+    
     def get_all_clientes(self):
         """Retorna todos os clientes"""
         try:
-            cursor = self.conn.cursor(cursor_factory=psycopg2.extras.RealDictCursor)
-            cursor.execute("SELECT * FROM clientes;")
-            resultado = cursor.fetchall() or []
-            cursor.close()
-            return resultado
+            with self.cursor(psycopg2.extras.RealDictCursor) as cursor:
+                cursor.execute("SELECT * FROM clientes;")
+                return cursor.fetchall() or []
         except Exception as e:
             print(f"✗ Erro ao buscar clientes: {e}")
             return []
@@ -151,30 +282,217 @@ class PostgresDB:
     def get_all_compras(self):
         """Retorna todas as compras com dados do cliente e produto"""
         try:
-            cursor = self.conn.cursor(cursor_factory=psycopg2.extras.RealDictCursor)
-            cursor.execute("""
-                SELECT c.id, cl.id as cliente_id, cl.nome as cliente_nome,
-                       p.id as produto_id, p.produto, p.valor, c.data
-                FROM compras c
-                JOIN clientes cl ON c.id_cliente = cl.id
-                JOIN produtos p ON c.id_produto = p.id
-                ORDER BY c.data DESC;
-            """)
-            resultado = cursor.fetchall() or []
-            cursor.close()
-            return resultado
+            with self.cursor(psycopg2.extras.RealDictCursor) as cursor:
+                cursor.execute(SELECT_COMPRAS + " ORDER BY c.data DESC;")
+                return cursor.fetchall() or []
+        except Exception as e:
+            print(f"✗ Erro ao buscar compras: {e}")
+            return []
+    
+    def get_clientes_by_ids(self, cliente_ids):
+        """Retorna os clientes cujos IDs estão na lista (None em caso de erro)"""
+        try:
+            with self.cursor(psycopg2.extras.RealDictCursor) as cursor:
+                cursor.execute("SELECT * FROM clientes WHERE id = ANY(%s);", (list(cliente_ids),))
+                return cursor.fetchall() or []
+        except Exception as e:
+            print(f"✗ Erro ao buscar clientes: {e}")
+            return None
+    
+    def get_compra_ids(self, desde_id, ate_id):
+        """IDs das compras com desde_id < ID <= ate_id, em ordem (None em caso de erro).
+        
+        Só lê o índice da chave primária, sem os JOINs de SELECT_COMPRAS.
+        """
+        try:
+            with self.cursor() as cursor:
+                cursor.execute(
+                    "SELECT id FROM compras WHERE id > %s AND id <= %s ORDER BY id;",
+                    (desde_id, ate_id)
+                )
+                return [linha[0] for linha in cursor.fetchall()]
+        except Exception as e:
+            print(f"✗ Erro ao buscar compras: {e}")
+            return None
+    
+    def _iter_consulta(self, sql, params=None, itersize=None):
+        """Executa uma consulta em um cursor nomeado (do lado do servidor).
+        
+        As linhas chegam em blocos de `itersize`, então a memória usada não
+        depende do tamanho do resultado. A conexão fica emprestada até o
+        gerador terminar (ou ser fechado).
+        """
+        with self.conexao() as conn:
+            nome = f"stream_{uuid.uuid4().hex}"
+            with conn.cursor(name=nome, cursor_factory=psycopg2.extras.RealDictCursor) as cursor:
+                cursor.itersize = itersize or self.itersize
+                cursor.execute(sql, params)
+                yield from cursor
+    
+    def iter_clientes(self, itersize=None):
+        """Gera todos os clientes em streaming, em ordem de ID.
+        
+        Um erro no meio do caminho é impresso e repassado, para que um
+        resultado parcial não seja tomado por completo.
+        """
+        try:
+            yield from self._iter_consulta("SELECT * FROM clientes ORDER BY id;", itersize=itersize)
+        except Exception as e:
+            print(f"✗ Erro ao buscar clientes: {e}")
+            raise
+    
+    def iter_compras(self, desde_id=None, ids=None, itersize=None):
+        """Gera as compras em streaming (mais recentes primeiro).
+        
+        Com `desde_id`, gera só as compras de ID maior; com `ids`, só as
+        desses IDs; nos dois casos em ordem de ID. Como em iter_clientes,
+        um erro no meio do caminho é repassado.
+        """
+        try:
+            if ids is not None:
+                yield from self._iter_consulta(
+                    SELECT_COMPRAS + " WHERE c.id = ANY(%s) ORDER BY c.id;",
+                    (list(ids),), itersize=itersize
+                )
+            elif desde_id is None:
+                yield from self._iter_consulta(
+                    SELECT_COMPRAS + " ORDER BY c.data DESC;", itersize=itersize
+                )
+            else:
+                yield from self._iter_consulta(
+                    SELECT_COMPRAS + " WHERE c.id > %s ORDER BY c.id;",
+                    (desde_id,), itersize=itersize
+                )
+        except Exception as e:
+            print(f"✗ Erro ao buscar compras: {e}")
+            raise
+    
+    def get_clientes_pagina(self, apos_id=0, limite=50):
+        """Retorna até `limite` clientes com ID maior que apos_id (paginação por chave)"""
+        try:
+            with self.cursor(psycopg2.extras.RealDictCursor) as cursor:
+                cursor.execute(
+                    "SELECT * FROM clientes WHERE id > %s ORDER BY id LIMIT %s;",
+                    (apos_id, limite)
+                )
+                return cursor.fetchall() or []
+        except Exception as e:
+            print(f"✗ Erro ao buscar clientes: {e}")
+            return []
+    
+    def get_compras_pagina(self, apos=None, limite=50):
+        """Retorna até `limite` compras, das mais recentes para as mais antigas.
+        
+        `apos` é o par (data, id) da última compra da página anterior;
+        None começa do início.
+        """
+        try:
+            with self.cursor(psycopg2.extras.RealDictCursor) as cursor:
+                if apos is None:
+                    cursor.execute(
+                        SELECT_COMPRAS + " ORDER BY c.data DESC, c.id DESC LIMIT %s;",
+                        (limite,)
+                    )
+                else:
+                    cursor.execute(
+                        SELECT_COMPRAS + """
+                        WHERE (c.data, c.id) < (%s, %s)
+                        ORDER BY c.data DESC, c.id DESC LIMIT %s;
+                        """,
+                        (apos[0], apos[1], limite)
+                    )
+                return cursor.fetchall() or []
         except Exception as e:
             print(f"✗ Erro ao buscar compras: {e}")
             return []
     
+    def get_estatisticas_vendas(self, limite_produtos=5):
+        """Estatísticas de vendas lidas dos rollups diários.
+        
+        Retorna {'total_vendas', 'clientes': [(nome, compras, gasto)],
+        'produtos': [(produto, compras, valor)]}, ordenados pelo valor. Em
+        um banco sem os rollups (migrate() ainda não aplicado), agrega
+        direto das compras.
+        """
+        try:
+            with self.cursor() as cursor:
+                cursor.execute("""
+                    SELECT to_regclass('gastos_cliente_diario') IS NOT NULL
+                       AND to_regclass('vendas_produto_diario') IS NOT NULL;
+                """)
+                if not cursor.fetchone()[0]:
+                    return self._estatisticas_vendas_agregadas(cursor, limite_produtos)
+                
+                cursor.execute("SELECT COALESCE(SUM(total_gasto), 0) FROM gastos_cliente_diario;")
+                total_vendas = cursor.fetchone()[0]
+                
+                cursor.execute("""
+                    SELECT c.nome, r.total, r.total_gasto
+                    FROM (
+                        SELECT id_cliente, SUM(total_compras) as total, SUM(total_gasto) as total_gasto
+                        FROM gastos_cliente_diario
+                        GROUP BY id_cliente
+                    ) r
+                    JOIN clientes c ON c.id = r.id_cliente
+                    WHERE r.total > 0
+                    ORDER BY r.total_gasto DESC;
+                """)
+                clientes = cursor.fetchall()
+                
+                cursor.execute("""
+                    SELECT p.produto, r.total, r.total_valor
+                    FROM (
+                        SELECT id_produto, SUM(total_compras) as total, SUM(total_valor) as total_valor
+                        FROM vendas_produto_diario
+                        GROUP BY id_produto
+                    ) r
+                    JOIN produtos p ON p.id = r.id_produto
+                    WHERE r.total > 0
+                    ORDER BY r.total_valor DESC
+                    LIMIT %s;
+                """, (limite_produtos,))
+                produtos = cursor.fetchall()
+            return {'total_vendas': total_vendas, 'clientes': clientes, 'produtos': produtos}
+        except Exception as e:
+            print(f"✗ Erro ao buscar estatísticas: {e}")
+            return None
+    
+    def _estatisticas_vendas_agregadas(self, cursor, limite_produtos):
+        """Mesmo resultado de get_estatisticas_vendas, agregando a tabela de compras"""
+        cursor.execute("""
+            SELECT COALESCE(SUM(p.valor), 0)
+            FROM compras c
+            JOIN produtos p ON c.id_produto = p.id;
+        """)
+        total_vendas = cursor.fetchone()[0]
+        
+        cursor.execute("""
+            SELECT c.nome, COUNT(comp.id) as total, COALESCE(SUM(p.valor), 0) as total_gasto
+            FROM clientes c
+            JOIN compras comp ON c.id = comp.id_cliente
+            LEFT JOIN produtos p ON comp.id_produto = p.id
+            GROUP BY c.id, c.nome
+            ORDER BY total_gasto DESC;
+        """)
+        clientes = cursor.fetchall()
+        
+        cursor.execute("""
+            SELECT p.produto, COUNT(c.id) as total, COALESCE(SUM(p.valor), 0) as total_valor
+            FROM compras c
+            JOIN produtos p ON c.id_produto = p.id
+            GROUP BY p.id, p.produto
+            ORDER BY total_valor DESC
+            LIMIT %s;
+        """, (limite_produtos,))
+        produtos = cursor.fetchall()
+        return {'total_vendas': total_vendas, 'clientes': clientes, 'produtos': produtos}
+    
     def get_cliente_by_cpf(self, cpf):
-        """Busca um cliente pelo CPF"""
+        """Busca um cliente pelo CPF (None se não existe, False em caso de erro)"""
         try:
-            cursor = self.conn.cursor(cursor_factory=psycopg2.extras.RealDictCursor)
-            cursor.execute("SELECT * FROM clientes WHERE cpf = %s;", (cpf,))
-            resultado = cursor.fetchone()
-            cursor.close()
-            return resultado
+            with self.cursor(psycopg2.extras.RealDictCursor) as cursor:
+                cursor.execute("SELECT * FROM clientes WHERE cpf = %s;", (cpf,))
+                return cursor.fetchone()
         except Exception as e:
             print(f"✗ Erro ao buscar cliente: {e}")
-            return None
+            return False
@@ -0,0 +1,477 @@
+"""
+Chaves, scripts Lua e montagem de comandos do cache no Redis
+
+Compartilhado por RedisDB e pela API assíncrona: as funções daqui só
+enfileiram comandos em um pipeline (síncrono ou assíncrono) ou montam os
+parâmetros de um script; quem executa é o chamador. Assim as duas APIs
+gravam e leem exatamente as mesmas chaves.
+"""
+import json
+import re
+import time
+from datetime import datetime
+from redis.exceptions import ResponseError
+
+# Namespaces versionados: cada reconstrução completa grava as chaves sob
+# g{n}: e, ao terminar, troca o ponteiro CHAVE_NAMESPACE de uma vez. Os
+# namespaces substituídos ficam em CHAVE_DESCARTADOS (score = quando podem
+# ser apagados); '' é o namespace sem prefixo, de antes do versionamento
+CHAVE_NAMESPACE = 'cache:namespace'
+CHAVE_SEQ_NAMESPACE = 'cache:namespace:seq'
+CHAVE_DESCARTADOS = 'cache:namespace:descartados'
+NAMESPACE_VERSIONADO = re.compile(r'g\d+:')
+
+# Trava da reconstrução completa (só um processo reconstrói por vez). O
+# valor é o token de CHAVE_SEQ_TRAVA de quem a detém; CHAVE_TOKEN_NAMESPACE
+# guarda o token da última troca de namespace, e uma troca com token menor
+# (de quem perdeu a trava por expiração) é recusada
+CHAVE_TRAVA_RECONSTRUCAO = 'cache:reconstrucao:trava'
+CHAVE_SEQ_TRAVA = 'cache:reconstrucao:token'
+CHAVE_TOKEN_NAMESPACE = 'cache:namespace:token'
+
+# Prazo (s) de um namespace em construção em CHAVE_DESCARTADOS: se a
+# reconstrução não terminar, a coleta apaga o que sobrou
+PRAZO_CONSTRUCAO = 86400
+
+# Gera um token (CHAVE_SEQ_TRAVA) e tenta pegar a trava com ele por ARGV[1]
+# ms; retorna o token, ou nada se outro processo já detém a trava
+LUA_ADQUIRIR_TRAVA = """
+local token = redis.call('INCR', KEYS[2])
+if redis.call('SET', KEYS[1], token, 'NX', 'PX', ARGV[1]) then
+    return token
+end
+return false
+"""
+
+# Renova / libera a trava só se ela ainda for de quem tem o token ARGV[1]
+LUA_RENOVAR_TRAVA = """
+if redis.call('GET', KEYS[1]) == ARGV[1] then
+    return redis.call('PEXPIRE', KEYS[1], ARGV[2])
+end
+return 0
+"""
+
+LUA_LIBERAR_TRAVA = """
+if redis.call('GET', KEYS[1]) == ARGV[1] then
+    return redis.call('DEL', KEYS[1])
+end
+return 0
+"""
+
+# Troca o ponteiro para o namespace ARGV[1] e descarta o anterior (prazo
+# ARGV[3]); com token (ARGV[2]), recusa se uma troca mais nova já aconteceu
+LUA_TROCAR_NAMESPACE = """
+local token = tonumber(ARGV[2])
+if token then
+    if token < tonumber(redis.call('GET', KEYS[3]) or '0') then
+        return false
+    end
+    redis.call('SET', KEYS[3], token)
+end
+local anterior = redis.call('GET', KEYS[1]) or ''
+redis.call('SET', KEYS[1], ARGV[1])
+redis.call('ZREM', KEYS[2], ARGV[1])
+redis.call('ZADD', KEYS[2], ARGV[3], anterior)
+return anterior
+"""
+
+# Marca d'água da sincronização incremental (último compras.id no cache)
+CHAVE_ULTIMA_COMPRA = 'sync:ultima_compra'
+
+# Compras já gravadas por uma sincronização incremental cujos passos
+# seguintes (clientes, amigos, recomendações) ainda não terminaram; score = ID
+CHAVE_COMPRAS_PENDENTES = 'sync:compras:pendentes'
+
+# A marca só avança: uma sincronização atrasada não a faz voltar
+LUA_AVANCAR_MARCA = """
+local atual = tonumber(redis.call('GET', KEYS[1]) or '0')
+if tonumber(ARGV[1]) > atual then
+    redis.call('SET', KEYS[1], ARGV[1])
+    return 1
+end
+return 0
+"""
+
+# Compras de cada cliente (compra:{id}), com a data da compra como score
+PREFIXO_COMPRAS_CLIENTE = 'compras:cliente:'
+
+# Grava uma compra incremental só se compra:{id} (KEYS[1]) ainda não
+# existe: hash (ARGV[1], JSON), fim da lista 'compras', linha do tempo do
+# cliente e a contagem do produto ARGV[4] nos rankings (KEYS[4], KEYS[5] e,
+# se houver tipo, KEYS[8]) com o hash do produto (KEYS[6], ARGV[5]); o ID
+# (ARGV[6]) entra nas compras pendentes (KEYS[7]). Retorna 1 se gravou, 0
+# se a compra já estava no cache, então sincronizações repetidas ou
+# simultâneas não duplicam nem recontam nada
+LUA_GRAVAR_COMPRA = """
+local function gravar_hash(key, json)
+    local campos = {}
+    for campo, valor in pairs(cjson.decode(json)) do
+        campos[#campos + 1] = campo
+        campos[#campos + 1] = valor
+    end
+    redis.call('HSET', key, unpack(campos))
+end
+if redis.call('EXISTS', KEYS[1]) == 1 then
+    return 0
+end
+gravar_hash(KEYS[1], ARGV[1])
+redis.call('RPUSH', KEYS[2], ARGV[2])
+redis.call('ZADD', KEYS[3], ARGV[3], ARGV[2])
+redis.call('ZINCRBY', KEYS[4], 1, ARGV[4])
+redis.call('ZINCRBY', KEYS[5], 1, ARGV[4])
+if KEYS[8] then
+    redis.call('ZINCRBY', KEYS[8], 1, ARGV[4])
+end
+gravar_hash(KEYS[6], ARGV[5])
+redis.call('ZADD', KEYS[7], ARGV[6], ARGV[6])
+return 1
+"""
+
+# Rankings de popularidade: compras por produto (no total e por tipo), por
+# cliente (base do ranking do círculo de amigos) e dados de cada produto
+CHAVE_RANKING_PRODUTOS = 'ranking:produtos'
+PREFIXO_RANKING_TIPO = 'ranking:produtos:tipo:'
+PREFIXO_RANKING_AMIGOS = 'ranking:produtos:amigos:'
+PREFIXO_PRODUTOS_CLIENTE = 'produtos:cliente:'
+
+# Recomendações pré-calculadas: um sorted set por cliente e geração
+# (recomendacoes:top:{geração}:{id}, produto -> pontuação) e o ponteiro
+# para a geração em uso
+CHAVE_GERACAO_RECOMENDACOES = 'recomendacoes:geracao'
+CHAVE_SEQ_RECOMENDACOES = 'recomendacoes:geracao:seq'
+PREFIXO_RECOMENDACOES_TOP = 'recomendacoes:top:'
+
+# Top-k da geração em uso; resolver o ponteiro e ler no mesmo script evita
+# ler uma geração que acabou de ser apagada
+LUA_TOP_RECOMENDACOES = """
+local geracao = redis.call('GET', KEYS[1])
+if not geracao then
+    return false
+end
+local key = ARGV[1] .. geracao .. ':' .. ARGV[2]
+return redis.call('ZREVRANGE', key, 0, tonumber(ARGV[3]) - 1, 'WITHSCORES')
+"""
+
+# Ajusta a geração em uso depois de uma compra: o produto sai das
+# recomendações do comprador e ganha ARGV[4] pontos para quem recebe
+# recomendações dele e ainda não o comprou (segundo os conjuntos
+# ARGV[2]{id}); cada conjunto fica com no máximo ARGV[5] produtos
+LUA_ATUALIZAR_RECOMENDACOES = """
+local geracao = redis.call('GET', KEYS[1])
+if not geracao then
+    return 0
+end
+local prefixo = ARGV[1] .. geracao .. ':'
+local produto = ARGV[3]
+local limite = tonumber(ARGV[5])
+redis.call('ZREM', prefixo .. ARGV[6], produto)
+local alterados = 0
+for i = 7, #ARGV do
+    if not redis.call('ZSCORE', ARGV[2] .. ARGV[i], produto) then
+        local key = prefixo .. ARGV[i]
+        redis.call('ZINCRBY', key, ARGV[4], produto)
+        redis.call('ZREMRANGEBYRANK', key, 0, -(limite + 1))
+        alterados = alterados + 1
+    end
+end
+return alterados
+"""
+
+# Índice CPF -> ID dos clientes em cache e marcador de CPF sem cadastro
+CHAVE_INDICE_CPF = 'clientes:cpf'
+PREFIXO_CPF_AUSENTE = 'cpf:ausente:'
+
+# Busca por CPF em uma ida ao servidor: 1 e o hash do cliente, 0 se o CPF
+# está marcado como inexistente, -1 se o cache não sabe nada do CPF.
+# (O hash ARGV[2]cliente:{id} é montado no script, então só vale fora de cluster.)
+LUA_CLIENTE_POR_CPF = """
+local id = redis.call('HGET', KEYS[1], ARGV[1])
+if id then
+    local cliente = redis.call('HGETALL', ARGV[2] .. 'cliente:' .. id)
+    if #cliente > 0 then
+        return {1, cliente}
+    end
+end
+if redis.call('EXISTS', KEYS[2]) == 1 then
+    return {0}
+end
+return {-1}
+"""
+
+
+def cliente_mapping(cliente):
+    """Converte um cliente no hash armazenado em cliente:{id}"""
+    return {
+        'id': cliente['id'],
+        'cpf': cliente['cpf'],
+        'nome': cliente['nome'],
+        'email': cliente.get('email', ''),
+        'endereco': cliente.get('endereco', ''),
+        'cidade': cliente.get('cidade', ''),
+        'uf': cliente.get('uf', '')
+    }
+
+
+def para_timestamp(data):
+    """Converte uma data (datetime, texto ISO ou número) em segundos desde a época"""
+    if isinstance(data, (int, float)):
+        return data
+    if isinstance(data, str):
+        data = datetime.fromisoformat(data)
+    return data.timestamp()
+
+
+def indexar_compra(pipe, compra, ns=''):
+    """Enfileira a compra na linha do tempo do cliente (ns: prefixo do namespace)"""
+    pipe.zadd(
+        f"{ns}{PREFIXO_COMPRAS_CLIENTE}{compra['cliente_id']}",
+        {f"compra:{compra['id']}": para_timestamp(compra['data'])}
+    )
+
+
+def produto_mapping(compra):
+    """Converte os dados do produto de uma compra no hash produto:{id}"""
+    return {
+        'id': compra['produto_id'],
+        'produto': compra['produto'],
+        'tipo': compra.get('tipo') or '',
+        'valor': str(compra['valor'])
+    }
+
+
+def contar_compra(pipe, compra, ns=''):
+    """Enfileira a contagem da compra nos rankings de produtos (ns: prefixo do namespace).
+    
+    Não é idempotente: só para namespaces em construção, onde cada compra é
+    gravada uma vez; as compras incrementais são contadas por gravar_compra.
+    """
+    produto_id = compra['produto_id']
+    pipe.zincrby(f"{ns}{CHAVE_RANKING_PRODUTOS}", 1, produto_id)
+    if compra.get('tipo'):
+        pipe.zincrby(f"{ns}{PREFIXO_RANKING_TIPO}{compra['tipo']}", 1, produto_id)
+    pipe.zincrby(f"{ns}{PREFIXO_PRODUTOS_CLIENTE}{compra['cliente_id']}", 1, produto_id)
+    pipe.hset(f"{ns}produto:{produto_id}", mapping=produto_mapping(compra))
+
+
+def gravar_cliente(pipe, cliente, ns=''):
+    """Enfileira o hash do cliente e suas entradas nos índices de ID e de CPF.
+    
+    São quatro comandos; a resposta do segundo (ZADD em clientes:ids) é 1
+    só para clientes que ainda não estavam no índice.
+    """
+    key = f"cliente:{cliente['id']}"
+    pipe.hset(ns + key, mapping=cliente_mapping(cliente))
+    pipe.zadd(ns + 'clientes:ids', {key: cliente['id']})
+    indexar_cpf(pipe, cliente, ns)
+
+
+def copiar_compra(pipe, compra, ns=''):
+    """Enfileira uma compra de uma reconstrução: hash, lista, linha do tempo e rankings"""
+    key = f"compra:{compra['id']}"
+    pipe.hset(ns + key, mapping=compra_mapping(compra))
+    pipe.lpush(ns + 'compras', key)
+    indexar_compra(pipe, compra, ns)
+    contar_compra(pipe, compra, ns)
+
+
+def gravar_compra(pipe, script, compra, ns=''):
+    """Enfileira a gravação idempotente de uma compra (script LUA_GRAVAR_COMPRA).
+    
+    Grava e conta a compra nos rankings de uma vez e a deixa pendente
+    (CHAVE_COMPRAS_PENDENTES) até os passos seguintes da sincronização.
+    Serve para pipelines síncronos e assíncronos; a resposta do comando é
+    1 se a compra foi gravada agora e 0 se já estava no cache.
+    """
+    key = f"compra:{compra['id']}"
+    produto_id = compra['produto_id']
+    keys = [
+        ns + key,
+        ns + 'compras',
+        f"{ns}{PREFIXO_COMPRAS_CLIENTE}{compra['cliente_id']}",
+        f"{ns}{CHAVE_RANKING_PRODUTOS}",
+        f"{ns}{PREFIXO_PRODUTOS_CLIENTE}{compra['cliente_id']}",
+        f"{ns}produto:{produto_id}",
+        ns + CHAVE_COMPRAS_PENDENTES
+    ]
+    if compra.get('tipo'):
+        keys.append(f"{ns}{PREFIXO_RANKING_TIPO}{compra['tipo']}")
+    texto = lambda mapping: json.dumps({campo: str(valor) for campo, valor in mapping.items()})
+    pipe.scripts.add(script)
+    pipe.evalsha(
+        script.sha, len(keys), *keys,
+        texto(compra_mapping(compra)), key, para_timestamp(compra['data']),
+        produto_id, texto(produto_mapping(compra)), compra['id']
+    )
+
+
+def indexar_cpf(pipe, cliente, ns=''):
+    """Enfileira a entrada do cliente no índice CPF -> ID (ns: prefixo do namespace)"""
+    pipe.hset(ns + CHAVE_INDICE_CPF, cliente['cpf'], cliente['id'])
+    limpar_cpf_ausente(pipe, cliente['cpf'], ns)
+
+
+def limpar_cpf_ausente(pipe, cpf, ns=''):
+    """Enfileira a remoção da marca de CPF inexistente (o CPF acabou de ser cadastrado)"""
+    pipe.delete(ns + PREFIXO_CPF_AUSENTE + cpf)
+
+
+def gravar_recomendacoes_top(pipe, prefixo, cliente_id, ranking, k):
+    """Enfileira os k primeiros pares (produto, pontuação) do ranking do cliente.
+    
+    prefixo é o da geração (recomendacoes:top:{geração}:). Retorna quantas
+    chaves gravou (0 para um ranking vazio).
+    """
+    if not ranking:
+        return 0
+    pipe.zadd(f"{prefixo}{cliente_id}", dict(ranking[:k]))
+    return 1
+
+
+def atualizar_recomendacoes_top(pipe, script, compra, recebem_de, ns='', peso=1.0, k=50):
+    """Enfileira a aplicação de uma compra nova à geração em uso (LUA_ATUALIZAR_RECOMENDACOES).
+    
+    recebem_de são os IDs de quem recebe recomendações do comprador.
+    """
+    keys = [ns + CHAVE_GERACAO_RECOMENDACOES]
+    args = [
+        ns + PREFIXO_RECOMENDACOES_TOP, ns + PREFIXO_PRODUTOS_CLIENTE,
+        compra['produto_id'], peso, k, compra['cliente_id'], *recebem_de
+    ]
+    pipe.scripts.add(script)
+    pipe.evalsha(script.sha, len(keys), *keys, *args)
+
+
+def gravar_lista(pipe, codec, key, itens, binario=True):
+    """Enfileira a regravação de uma lista de amigos ou recomendações.
+    
+    Vai em blob (SET) quando binario e os itens cabem no codec; senão no
+    formato JSON, um elemento por item, que a leitura também aceita.
+    """
+    if not itens:
+        pipe.delete(key)
+    elif binario and codec.aceita(itens):
+        # SET substitui a chave mesmo que ela ainda seja uma LIST antiga
+        pipe.set(key, codec.codificar(itens))
+    else:
+        pipe.delete(key)
+        pipe.lpush(key, *[json.dumps(item) for item in itens])
+
+
+def compra_mapping(compra):
+    """Converte uma compra no hash armazenado em compra:{id}"""
+    return {
+        'id': compra['id'],
+        'cliente_id': compra['cliente_id'],
+        'cliente_nome': compra['cliente_nome'],
+        'produto_id': compra.get('produto_id', ''),
+        'produto': compra['produto'],
+        'tipo': compra.get('tipo') or '',
+        'valor': str(compra['valor']),
+        'data': str(compra['data'])
+    }
+
+
+def namespace_de(seq):
+    """Prefixo do namespace de número seq (de CHAVE_SEQ_NAMESPACE)"""
+    return f"g{seq}:"
+
+
+def chave_legada(key):
+    """Indica se a chave é do namespace sem prefixo (nem versionada nem de controle)"""
+    return not (NAMESPACE_VERSIONADO.match(key) or key.startswith('cache:'))
+
+
+def argumentos_adquirir_trava(lease):
+    """keys e args de LUA_ADQUIRIR_TRAVA (lease em segundos)"""
+    return [CHAVE_TRAVA_RECONSTRUCAO, CHAVE_SEQ_TRAVA], [int(lease * 1000)]
+
+
+def argumentos_renovar_trava(token, lease):
+    """keys e args de LUA_RENOVAR_TRAVA (lease em segundos)"""
+    return [CHAVE_TRAVA_RECONSTRUCAO], [token, int(lease * 1000)]
+
+
+class TravaPerdida(RuntimeError):
+    """A trava da reconstrução expirou e passou a outro processo"""
+    
+    def __init__(self):
+        super().__init__("Trava da reconstrução perdida para outro processo")
+
+
+def renovar_trava(pipe, script, token, lease):
+    """Enfileira a renovação da trava (LUA_RENOVAR_TRAVA) em um pipeline.
+    
+    A resposta é 0 se a trava já não é deste token; quem executa deve
+    então parar a reconstrução (TravaPerdida).
+    """
+    keys, args = argumentos_renovar_trava(token, lease)
+    pipe.scripts.add(script)
+    pipe.evalsha(script.sha, len(keys), *keys, *args)
+
+
+def argumentos_liberar_trava(token):
+    """keys e args de LUA_LIBERAR_TRAVA"""
+    return [CHAVE_TRAVA_RECONSTRUCAO], [token]
+
+
+def argumentos_trocar_namespace(ns, token, carencia):
+    """keys e args de LUA_TROCAR_NAMESPACE (o anterior vence em carencia segundos)"""
+    return (
+        [CHAVE_NAMESPACE, CHAVE_DESCARTADOS, CHAVE_TOKEN_NAMESPACE],
+        [ns, '' if token is None else token, time.time() + carencia]
+    )
+
+
+def argumentos_avancar_marca(compra_id, ns=''):
+    """keys e args de LUA_AVANCAR_MARCA"""
+    return [ns + CHAVE_ULTIMA_COMPRA], [compra_id]
+
+
+def clientes_novos(clientes, respostas):
+    """Chaves dos clientes que gravar_cliente acabou de pôr no índice de IDs.
+    
+    respostas são as do pipeline, começando pelos comandos do primeiro cliente.
+    """
+    adicionados = respostas[1:4 * len(clientes):4]
+    return [f"cliente:{cliente['id']}" for cliente, novo in zip(clientes, adicionados) if novo]
+
+
+def ler_compra_pendente(pipe, compra_id, ns=''):
+    """Enfileira a leitura do cliente e do produto de uma compra pendente"""
+    pipe.hmget(f"{ns}compra:{compra_id}", 'cliente_id', 'produto_id')
+
+
+def compras_pendentes(compra_ids, respostas):
+    """Converte as respostas de ler_compra_pendente em (compras, IDs sem hash).
+    
+    Cada compra vem com id, cliente_id e produto_id inteiros; IDs sem hash
+    (namespace coletado) não têm o que aplicar.
+    """
+    compras = []
+    sem_hash = []
+    for compra_id, (cliente_id, produto_id) in zip(compra_ids, respostas):
+        if cliente_id is None:
+            sem_hash.append(compra_id)
+            continue
+        compras.append({
+            'id': int(compra_id),
+            'cliente_id': int(cliente_id),
+            'produto_id': int(produto_id) if produto_id else produto_id
+        })
+    return compras, sem_hash
+
+
+def ler_lista(pipe, key, blob):
+    """Enfileira a leitura de uma lista de amigos/recomendações (GET ou LRANGE)"""
+    if blob:
+        pipe.get(key)
+    else:
+        pipe.lrange(key, 0, -1)
+
+
+def outro_formato(valores):
+    """Posições das leituras de ler_lista que responderam WRONGTYPE.
+    
+    São chaves ainda no outro formato, a reler com o outro comando.
+    """
+    return [i for i, valor in enumerate(valores) if isinstance(valor, ResponseError)]
@@ -2,14 +2,74 @@
 Conexão e operações com Redis
 """
 import json
+import threading
+import time
 import redis
 from config.databases import REDIS_CONFIG
+from database.cache_local import CacheLocal, CANAL_INVALIDACAO, INVALIDAR_TUDO
+from database.codec import criar_codecs, tentar_decodificar_lista
+from database.redis_comandos import (
+    CHAVE_COMPRAS_PENDENTES, CHAVE_DESCARTADOS, CHAVE_GERACAO_RECOMENDACOES,
+    CHAVE_INDICE_CPF, CHAVE_NAMESPACE, CHAVE_RANKING_PRODUTOS, CHAVE_SEQ_NAMESPACE,
+    CHAVE_SEQ_RECOMENDACOES, CHAVE_TRAVA_RECONSTRUCAO, CHAVE_ULTIMA_COMPRA,
+    LUA_ADQUIRIR_TRAVA, LUA_ATUALIZAR_RECOMENDACOES, LUA_AVANCAR_MARCA,
+    LUA_CLIENTE_POR_CPF, LUA_GRAVAR_COMPRA, LUA_LIBERAR_TRAVA, LUA_RENOVAR_TRAVA,
+    LUA_TOP_RECOMENDACOES, LUA_TROCAR_NAMESPACE, PRAZO_CONSTRUCAO, PREFIXO_COMPRAS_CLIENTE,
+    PREFIXO_CPF_AUSENTE, PREFIXO_PRODUTOS_CLIENTE, PREFIXO_RANKING_AMIGOS,
+    PREFIXO_RANKING_TIPO, PREFIXO_RECOMENDACOES_TOP, TravaPerdida, argumentos_adquirir_trava,
+    argumentos_avancar_marca, argumentos_liberar_trava, argumentos_renovar_trava,
+    argumentos_trocar_namespace, atualizar_recomendacoes_top, chave_legada,
+    cliente_mapping, clientes_novos, compras_pendentes, copiar_compra, gravar_cliente,
+    gravar_compra, gravar_lista, gravar_recomendacoes_top, ler_compra_pendente, ler_lista,
+    limpar_cpf_ausente,
+    namespace_de, outro_formato, para_timestamp, renovar_trava
+)
+
 
 
 class RedisDB:
     def __init__(self):
         self.config = REDIS_CONFIG
         self.client = None
+        # Cliente sem decode_responses, para ler os blobs das listas
+        self.client_binario = None
+        self.chunk_size = self.config.get('chunk_size', 1000)
+        self.transacional = self.config.get('pipeline_transacional', False)
+        self.ttl_cpf_ausente = self.config.get('cpf_ausente_ttl', 60)
+        self.ttl_ranking_amigos = self.config.get('ranking_amigos_ttl', 60)
+        self.top_k_recomendacoes = self.config.get('recomendacoes_top_k', 50)
+        self.janela_compras = self.config.get('sync_janela_compras', 500)
+        self._script_top = None
+        self._script_atualizar_top = None
+        self._script_cpf = None
+        self._script_gravar_compra = None
+        self._script_avancar_marca = None
+        self._script_adquirir_trava = None
+        self._script_renovar_trava = None
+        self._script_liberar_trava = None
+        self._script_trocar_namespace = None
+        # Trava da reconstrução: validade (s) e espera máxima (s) de quem
+        # encontra outro processo reconstruindo
+        self.lease_reconstrucao = self.config.get('reconstrucao_lease', 120)
+        self.espera_reconstrucao = self.config.get('reconstrucao_espera', 30)
+        # Namespace em uso (lido do ponteiro e guardado por namespace_ttl
+        # segundos). O namespace em construção não fica na instância: quem
+        # reconstrói o passa como `ns` aos store_*, e as leituras (de
+        # qualquer thread) só enxergam o ponteiro
+        self.ttl_namespace = self.config.get('namespace_ttl', 1.0)
+        self.carencia_namespace = self.config.get('namespace_carencia', 300)
+        self._namespace = None
+        self._namespace_lido_em = 0.0
+        self.cache_local = None
+        if self.config.get('cache_local'):
+            self.cache_local = CacheLocal(
+                self.config.get('cache_local_max_itens', 10000),
+                self.config.get('cache_local_ttl')
+            )
+        # Amigos e recomendações: um blob por lista ('binario') ou uma LIST
+        # de elementos JSON ('json'); a leitura aceita os dois formatos
+        self.listas_binarias = self.config.get('codec_listas', 'binario') == 'binario'
+        self.codecs = criar_codecs(self.config.get('codec_limite_compressao', 1024))
     
     def connect(self):
         """Conecta ao Redis"""
@@ -18,9 +78,27 @@ class RedisDB:
                 host=self.config['host'],
                 port=self.config['port'],
                 db=self.config['db'],
-                decode_responses=True
+                decode_responses=True,
+                socket_connect_timeout=self.config.get('connect_timeout', 10)
             )
             self.client.ping()
+            self._script_cpf = self.client.register_script(LUA_CLIENTE_POR_CPF)
+            self._script_top = self.client.register_script(LUA_TOP_RECOMENDACOES)
+            self._script_atualizar_top = self.client.register_script(LUA_ATUALIZAR_RECOMENDACOES)
+            self._script_gravar_compra = self.client.register_script(LUA_GRAVAR_COMPRA)
+            self._script_avancar_marca = self.client.register_script(LUA_AVANCAR_MARCA)
+            self._script_adquirir_trava = self.client.register_script(LUA_ADQUIRIR_TRAVA)
+            self._script_renovar_trava = self.client.register_script(LUA_RENOVAR_TRAVA)
+            self._script_liberar_trava = self.client.register_script(LUA_LIBERAR_TRAVA)
+            self._script_trocar_namespace = self.client.register_script(LUA_TROCAR_NAMESPACE)
+            self.client_binario = redis.Redis(
+                host=self.config['host'],
+                port=self.config['port'],
+                db=self.config['db'],
+                socket_connect_timeout=self.config.get('connect_timeout', 10)
+            )
+            if self.cache_local:
+                self.cache_local.assinar(self.client)
             print("✓ Conectado ao Redis")
             return True
         except Exception as e:
@@ -29,121 +107,906 @@ class RedisDB:
     
     def disconnect(self):
         """Desconecta do Redis"""
+        if self.cache_local:
+            self.cache_local.encerrar()
+        if self.client_binario:
+            self.client_binario.close()
         if self.client:
             self.client.close()
             print("✓ Desconectado do Redis")
     
     def clear_cache(self):
-        """Limpa todo o cache"""
+        """Limpa todo o cache, trocando para um namespace novo e vazio.
+        
+        Não usa FLUSHDB: as sequências, os tokens e a trava da reconstrução
+        continuam valendo para os outros processos. O namespace anterior é
+        coletado depois de namespace_carencia segundos, como em uma
+        reconstrução.
+        """
         try:
-            self.client.flushdb()
+            ns = namespace_de(self.client.incr(CHAVE_SEQ_NAMESPACE))
+            if self.concluir_reconstrucao(ns) is False:
+                return False
             print("✓ Cache limpo")
             return True
         except Exception as e:
             print(f"✗ Erro ao limpar cache: {e}")
             return False
     
-    def store_clientes(self, clientes):
-        """Armazena lista de clientes"""
-        try:
-            self.client.delete('clientes')
-            for cliente in clientes:
-                key = f"cliente:{cliente['id']}"
-                self.client.hset(key, mapping={
-                    'id': cliente['id'],
-                    'cpf': cliente['cpf'],
-                    'nome': cliente['nome'],
-                    'email': cliente.get('email', ''),
-                    'endereco': cliente.get('endereco', ''),
-                    'cidade': cliente.get('cidade', ''),
-                    'uf': cliente.get('uf', '')
-                })
-                self.client.lpush('clientes', key)
-            print(f"✓ {len(clientes)} clientes armazenados no Redis")
-            return True
+    def _invalidar(self, pipe, keys):
+        """Enfileira o aviso de que as chaves foram regravadas.
+        
+        Os outros processos removem as chaves do cache local ao receber a
+        mensagem; o chamador remove do próprio cache depois do execute().
+        O aviso sai mesmo com o cache local deste processo desligado, pois
+        os leitores podem ter o deles ligado.
+        """
+        if keys:
+            pipe.publish(CANAL_INVALIDACAO, json.dumps(keys))
+    
+    def _namespace_atual(self):
+        """Prefixo do namespace em uso, relendo o ponteiro a cada namespace_ttl segundos"""
+        agora = time.monotonic()
+        if self._namespace is None or agora - self._namespace_lido_em >= self.ttl_namespace:
+            namespace = self.client.get(CHAVE_NAMESPACE) or ''
+            if namespace != self._namespace and self.cache_local:
+                # Outro processo trocou o namespace: nada do cache local vale mais
+                self.cache_local.limpar()
+            self._namespace = namespace
+            self._namespace_lido_em = agora
+        return self._namespace
+    
+    def _ns(self, ns=None):
+        """Prefixo das chaves: ns (namespace em construção) ou, sem ele, o em uso"""
+        return self._namespace_atual() if ns is None else ns
+    
+    def _k(self, key):
+        """Nome real no Redis de uma chave lógica (cliente:1, compras, ...)"""
+        return self._ns() + key
+    
+    def iniciar_reconstrucao(self):
+        """Reserva um namespace novo, invisível aos leitores até concluir_reconstrucao.
+        
+        Retorna o prefixo, a passar como `ns` aos store_* da reconstrução.
+        O namespace novo entra em CHAVE_DESCARTADOS com prazo de um dia: se
+        a reconstrução não terminar, a coleta apaga o que sobrou.
+        """
+        self.coletar_namespaces()
+        ns = namespace_de(self.client.incr(CHAVE_SEQ_NAMESPACE))
+        self.client.zadd(CHAVE_DESCARTADOS, {ns: time.time() + PRAZO_CONSTRUCAO})
+        print(f"✓ Reconstruindo o cache no namespace {ns}")
+        return ns
+    
+    def concluir_reconstrucao(self, ns, token=None):
+        """Troca o ponteiro para o namespace construído e agenda a coleta do anterior.
+        
+        Com o token da trava, a troca é recusada (e o namespace construído
+        descartado) se um processo com token mais novo já trocou o ponteiro.
+        Retorna o namespace ns, ou False se a troca foi recusada.
+        """
+        keys, args = argumentos_trocar_namespace(ns, token, self.carencia_namespace)
+        anterior = self._script_trocar_namespace(keys=keys, args=args)
+        if anterior is None:
+            print(f"✗ Namespace {ns} descartado: o cache já foi trocado por uma reconstrução mais nova")
+            self.abortar_reconstrucao(ns)
+            return False
+        
+        self._namespace = ns
+        self._namespace_lido_em = time.monotonic()
+        if self.cache_local:
+            self.cache_local.limpar()
+        self.client.publish(CANAL_INVALIDACAO, INVALIDAR_TUDO)
+        print(f"✓ Cache trocado para o namespace {ns}")
+        
+        # Quem ainda lê o namespace anterior tem namespace_carencia segundos
+        coleta = threading.Timer(self.carencia_namespace + 1, self.coletar_namespaces)
+        coleta.daemon = True
+        coleta.start()
+        return ns
+    
+    def abortar_reconstrucao(self, ns):
+        """Descarta o namespace em construção (os leitores não chegaram a vê-lo)"""
+        if ns is None:
+            return
+        try:
+            self.client.zadd(CHAVE_DESCARTADOS, {ns: 0})
+        except Exception as e:
+            # Fica com o prazo de iniciar_reconstrucao
+            print(f"✗ Erro ao descartar namespace {ns}: {e}")
+            return
+        self.coletar_namespaces()
+    
+    def adquirir_trava_reconstrucao(self):
+        """Tenta ser o único processo reconstruindo o cache.
+        
+        Retorna o token (fencing) da trava, válido por reconstrucao_lease
+        segundos, ou None se outro processo já está reconstruindo.
+        """
+        keys, args = argumentos_adquirir_trava(self.lease_reconstrucao)
+        return self._script_adquirir_trava(keys=keys, args=args)
+    
+    def renovar_trava_reconstrucao(self, token):
+        """Estende a validade da trava; False se ela expirou e passou a outro processo"""
+        keys, args = argumentos_renovar_trava(token, self.lease_reconstrucao)
+        renovada = self._script_renovar_trava(keys=keys, args=args)
+        if not renovada:
+            print("⚠ Trava da reconstrução perdida para outro processo")
+        return bool(renovada)
+    
+    def liberar_trava_reconstrucao(self, token):
+        """Libera a trava, se ela ainda for deste token"""
+        try:
+            keys, args = argumentos_liberar_trava(token)
+            self._script_liberar_trava(keys=keys, args=args)
+        except Exception as e:
+            print(f"✗ Erro ao liberar trava da reconstrução: {e}")
+    
+    def aguardar_reconstrucao(self, timeout=None, intervalo=0.2):
+        """Espera a reconstrução de outro processo terminar.
+        
+        Retorna True quando a trava é liberada (ou expira), False se ainda
+        houver reconstrução depois de `timeout` segundos (padrão
+        reconstrucao_espera); nesse caso o chamador segue com o cache que
+        houver, sem iniciar outra reconstrução.
+        """
+        limite = time.monotonic() + (self.espera_reconstrucao if timeout is None else timeout)
+        while self.client.exists(CHAVE_TRAVA_RECONSTRUCAO):
+            if time.monotonic() >= limite:
+                return False
+            time.sleep(intervalo)
+        # Relê o ponteiro: a troca acabou de acontecer
+        self._namespace_lido_em = 0.0
+        return True
+    
+    def cache_vazio(self):
+        """Indica se o namespace em uso não tem clientes (relendo o ponteiro)"""
+        self._namespace_lido_em = 0.0
+        return not self.client.exists(self._k('clientes'))
+    
+    def coletar_namespaces(self):
+        """Apaga os namespaces descartados cujo prazo já passou"""
+        try:
+            vencidos = self.client.zrangebyscore(CHAVE_DESCARTADOS, '-inf', time.time())
+            for namespace in vencidos:
+                if namespace == self.client.get(CHAVE_NAMESPACE):
+                    continue
+                if namespace:
+                    self._remover_chaves(namespace + '*')
+                else:
+                    self._remover_legado()
+                self.client.zrem(CHAVE_DESCARTADOS, namespace)
+                print(f"✓ Namespace {namespace or '(sem prefixo)'} removido")
+        except Exception as e:
+            print(f"✗ Erro ao coletar namespaces antigos: {e}")
+    
+    def _remover_legado(self):
+        """Apaga as chaves sem namespace (de antes do versionamento)"""
+        lote = []
+        for key in self.client.scan_iter(count=self.chunk_size):
+            if not chave_legada(key):
+                continue
+            lote.append(key)
+            if len(lote) >= self.chunk_size:
+                self.client.delete(*lote)
+                lote = []
+        if lote:
+            self.client.delete(*lote)
+    
+    def _escrever_em_lotes(self, itens, escrever, chave=None, somar=False, token=None):
+        """Envia escritas em pipelines de chunk_size itens.
+        
+        escrever(pipe, item) enfileira os comandos de um item e retorna
+        quantas chaves ele gravou. chave(item), se informada, dá a chave
+        do item a invalidar nos caches locais. Retorna um relatório com o
+        total de itens, de chaves e o tempo (em segundos) de cada lote;
+        com somar, também a soma das respostas do primeiro comando de cada
+        item ('soma'), acumulada lote a lote.
+        
+        Com o token da trava da reconstrução, cada lote começa renovando a
+        trava; se ela passou a outro processo, levanta TravaPerdida.
+        """
+        relatorio = {'itens': 0, 'chaves': 0, 'lotes': []}
+        if somar:
+            relatorio['soma'] = 0
+        invalidar = chave is not None
+        pipe = None
+        keys = []
+        posicoes = []
+        inicio = 0.0
+        
+        def executar():
+            if invalidar:
+                self._invalidar(pipe, keys)
+            respostas = pipe.execute()
+            if token is not None and not respostas[0]:
+                raise TravaPerdida()
+            if somar:
+                relatorio['soma'] += sum(respostas[i] for i in posicoes)
+            if invalidar and self.cache_local:
+                self.cache_local.invalidar(keys)
+            relatorio['lotes'].append(time.perf_counter() - inicio)
+        
+        no_lote = 0
+        for item in itens:
+            if pipe is None:
+                pipe = self.client.pipeline(transaction=self.transacional)
+                no_lote = 0
+                keys = []
+                posicoes = []
+                inicio = time.perf_counter()
+                if token is not None:
+                    renovar_trava(pipe, self._script_renovar_trava, token, self.lease_reconstrucao)
+            posicoes.append(len(pipe))
+            relatorio['chaves'] += escrever(pipe, item)
+            relatorio['itens'] += 1
+            if invalidar:
+                keys.append(chave(item))
+            no_lote += 1
+            if no_lote >= self.chunk_size:
+                executar()
+                pipe = None
+        if pipe is not None:
+            executar()
+        return relatorio
+    
+    def _resumo_lotes(self, relatorio):
+        """Texto curto com chaves, lotes e tempo total de uma escrita em lote"""
+        total_ms = sum(relatorio['lotes']) * 1000
+        return (f"{relatorio['chaves']} chaves, {len(relatorio['lotes'])} lote(s), "
+                f"{total_ms:.1f} ms")
+    
+    def store_clientes(self, clientes, ns=None, token=None):
+        """Armazena lista de clientes (ns: namespace em construção; token: da trava dele)"""
+        construindo = ns is not None
+        ns = self._ns(ns)
+        
+        def escrever(pipe, cliente):
+            gravar_cliente(pipe, cliente, ns)
+            pipe.lpush(ns + 'clientes', f"cliente:{cliente['id']}")
+            return 1
+        
+        try:
+            self.client.delete(ns + 'clientes', ns + 'clientes:ids', ns + CHAVE_INDICE_CPF)
+            # Um namespace em construção ainda não é lido por ninguém
+            relatorio = self._escrever_em_lotes(
+                clientes, escrever,
+                chave=None if construindo else lambda cliente: f"cliente:{cliente['id']}",
+                token=token
+            )
+            relatorio['chaves'] += 3 if relatorio['itens'] else 0
+            print(f"✓ {relatorio['itens']} clientes armazenados no Redis "
+                  f"({self._resumo_lotes(relatorio)})")
+            return relatorio
         except Exception as e:
             print(f"✗ Erro ao armazenar clientes: {e}")
             return False
     
-    def store_compras(self, compras):
-        """Armazena lista de compras"""
-        try:
-            self.client.delete('compras')
-            for compra in compras:
-                key = f"compra:{compra['id']}"
-                self.client.hset(key, mapping={
-                    'id': compra['id'],
-                    'cliente_id': compra['cliente_id'],
-                    'cliente_nome': compra['cliente_nome'],
-                    'produto': compra['produto'],
-                    'valor': str(compra['valor']),
-                    'data': str(compra['data'])
-                })
-                self.client.lpush('compras', key)
-            print(f"✓ {len(compras)} compras armazenadas no Redis")
+    def _remover_chaves(self, *padroes):
+        """Remove as chaves que casam com os padrões (glob), em lotes de chunk_size"""
+        for padrao in padroes:
+            if not any(c in padrao for c in '*?['):
+                self.client.delete(padrao)
+                continue
+            lote = []
+            for key in self.client.scan_iter(match=padrao, count=self.chunk_size):
+                lote.append(key)
+                if len(lote) >= self.chunk_size:
+                    self.client.delete(*lote)
+                    lote = []
+            if lote:
+                self.client.delete(*lote)
+    
+    def store_compras(self, compras, ns, token=None):
+        """Armazena lista de compras no namespace em construção ns.
+        
+        Sem verificar repetidas nem limpar antes: só vale para um namespace
+        novo (iniciar_reconstrucao). No namespace em uso, use append_compras.
+        token é o da trava da reconstrução, renovada a cada lote.
+        """
+        def escrever(pipe, compra):
+            copiar_compra(pipe, compra, ns)
+            return 1
+        
+        if not ns:
+            print("✗ store_compras só grava em um namespace em construção; use append_compras")
+            return False
+        try:
+            relatorio = self._escrever_em_lotes(compras, escrever, token=token)
+            relatorio['chaves'] += 1 if relatorio['itens'] else 0
+            print(f"✓ {relatorio['itens']} compras armazenadas no Redis "
+                  f"({self._resumo_lotes(relatorio)})")
+            return relatorio
+        except Exception as e:
+            print(f"✗ Erro ao armazenar compras: {e}")
+            return False
+    
+    def upsert_clientes(self, clientes):
+        """Grava ou atualiza clientes sem reconstruir a lista 'clientes'"""
+        try:
+            clientes = list(clientes)
+            ns = self._ns()
+            for i in range(0, len(clientes), self.chunk_size):
+                lote = clientes[i:i + self.chunk_size]
+                keys = [f"cliente:{cliente['id']}" for cliente in lote]
+                pipe = self.client.pipeline(transaction=self.transacional)
+                for cliente in lote:
+                    gravar_cliente(pipe, cliente, ns)
+                self._invalidar(pipe, keys)
+                resultados = pipe.execute()
+                if self.cache_local:
+                    self.cache_local.invalidar(keys)
+                # ZADD retorna 1 só para clientes que ainda não estavam no índice
+                novos = clientes_novos(lote, resultados)
+                if novos:
+                    self.client.lpush(ns + 'clientes', *novos)
             return True
+        except Exception as e:
+            print(f"✗ Erro ao armazenar clientes: {e}")
+            return False
+    
+    def append_compras(self, compras):
+        """Acrescenta compras novas ao fim da lista de compras.
+        
+        Compras que já estão no cache são ignoradas (LUA_GRAVAR_COMPRA), então
+        reenviar um trecho já sincronizado não duplica nada. As gravadas agora
+        ficam pendentes (get_compras_pendentes); o relatório traz quantas
+        foram em 'gravadas'.
+        """
+        ns = self._ns()
+        
+        def escrever(pipe, compra):
+            gravar_compra(pipe, self._script_gravar_compra, compra, ns)
+            return 1
+        
+        try:
+            relatorio = self._escrever_em_lotes(
+                compras, escrever, chave=lambda compra: f"compra:{compra['id']}", somar=True
+            )
+            relatorio['gravadas'] = relatorio.pop('soma')
+            print(f"✓ {relatorio['gravadas']} compras acrescentadas no Redis, "
+                  f"{relatorio['itens'] - relatorio['gravadas']} já estavam no cache "
+                  f"({self._resumo_lotes(relatorio)})")
+            return relatorio
         except Exception as e:
             print(f"✗ Erro ao armazenar compras: {e}")
             return False
     
-    def store_amigos(self, cliente_id, amigos):
+    def get_ultima_compra_sincronizada(self):
+        """Retorna o último compras.id sincronizado (None se o cache não tem marca)"""
+        try:
+            valor = self.client.get(self._k(CHAVE_ULTIMA_COMPRA))
+            return int(valor) if valor is not None else None
+        except Exception as e:
+            print(f"✗ Erro ao ler marca de sincronização: {e}")
+            return None
+    
+    def set_ultima_compra_sincronizada(self, compra_id, ns=None):
+        """Avança a marca para compra_id, se for maior (ns: namespace em construção)"""
+        try:
+            keys, args = argumentos_avancar_marca(compra_id, self._ns(ns))
+            self._script_avancar_marca(keys=keys, args=args)
+            return True
+        except Exception as e:
+            print(f"✗ Erro ao gravar marca de sincronização: {e}")
+            return False
+    
+    def compras_ausentes(self, compra_ids):
+        """Dos IDs informados, os que ainda não têm compra:{id} no cache (None em caso de erro)"""
+        try:
+            ns = self._ns()
+            compra_ids = list(compra_ids)
+            ausentes = []
+            for i in range(0, len(compra_ids), self.chunk_size):
+                lote = compra_ids[i:i + self.chunk_size]
+                pipe = self.client.pipeline(transaction=False)
+                for compra_id in lote:
+                    pipe.exists(f"{ns}compra:{compra_id}")
+                ausentes.extend(
+                    compra_id for compra_id, existe in zip(lote, pipe.execute()) if not existe
+                )
+            return ausentes
+        except Exception as e:
+            print(f"✗ Erro ao verificar compras em cache: {e}")
+            return None
+    
+    def get_compras_pendentes(self, limite=None):
+        """Até `limite` compras pendentes, em ordem de ID (None em caso de erro).
+        
+        Cada uma vem com id, cliente_id e produto_id (inteiros), lidos de
+        compra:{id}; IDs sem hash (namespace coletado) saem das pendentes.
+        """
+        try:
+            ns = self._ns()
+            limite = limite or self.chunk_size
+            ids = self.client.zrange(ns + CHAVE_COMPRAS_PENDENTES, 0, limite - 1)
+            if not ids:
+                return []
+            pipe = self.client.pipeline(transaction=False)
+            for compra_id in ids:
+                ler_compra_pendente(pipe, compra_id, ns)
+            compras, sem_hash = compras_pendentes(ids, pipe.execute())
+            if sem_hash:
+                self.client.zrem(ns + CHAVE_COMPRAS_PENDENTES, *sem_hash)
+            return compras
+        except Exception as e:
+            print(f"✗ Erro ao ler compras pendentes: {e}")
+            return None
+    
+    def concluir_compras_pendentes(self, compra_ids):
+        """Tira as compras das pendentes, depois que os passos seguintes terminaram"""
+        try:
+            compra_ids = list(compra_ids)
+            if compra_ids:
+                self.client.zrem(self._k(CHAVE_COMPRAS_PENDENTES), *compra_ids)
+            return True
+        except Exception as e:
+            print(f"✗ Erro ao concluir compras pendentes: {e}")
+            return False
+    
+    def _escrever_listas(self, prefixo, listas, ns=None, token=None):
+        """Regrava as listas {prefixo}:{id} de um dicionário {id: itens}"""
+        codec = self.codecs[prefixo]
+        construindo = ns is not None
+        ns = self._ns(ns)
+        
+        def escrever(pipe, par):
+            id_, itens = par
+            gravar_lista(pipe, codec, f"{ns}{prefixo}:{id_}", itens, self.listas_binarias)
+            return 1
+        
+        return self._escrever_em_lotes(
+            listas.items(), escrever,
+            chave=None if construindo else lambda par: f"{prefixo}:{par[0]}",
+            token=token
+        )
+    
+    def store_amigos(self, cliente_id, amigos, ns=None):
         """Armazena lista de amigos de um cliente"""
         try:
-            key = f"amigos:{cliente_id}"
-            self.client.delete(key)
-            for amigo in amigos:
-                self.client.lpush(key, json.dumps(amigo))
+            self._escrever_listas('amigos', {cliente_id: amigos}, ns)
             print(f"✓ Amigos do cliente {cliente_id} armazenados no Redis")
             return True
         except Exception as e:
             print(f"✗ Erro ao armazenar amigos: {e}")
             return False
     
-    def store_recomendacoes(self, amigo_id, recomendacoes):
+    def store_recomendacoes(self, amigo_id, recomendacoes, ns=None):
         """Armazena recomendações para um amigo"""
         try:
-            key = f"recomendacoes:{amigo_id}"
-            self.client.delete(key)
-            for rec in recomendacoes:
-                self.client.lpush(key, json.dumps(rec))
+            self._escrever_listas('recomendacoes', {amigo_id: recomendacoes}, ns)
             print(f"✓ Recomendações para amigo {amigo_id} armazenadas")
             return True
         except Exception as e:
             print(f"✗ Erro ao armazenar recomendações: {e}")
             return False
     
-    def get_clientes(self):
-        """Retorna todos os clientes do cache"""
+    def store_amigos_lote(self, amigos_por_cliente, ns=None, token=None):
+        """Armazena as listas de amigos de vários clientes ({id: amigos})"""
         try:
-            keys = self.client.lrange('clientes', 0, -1)
-            clientes = []
+            relatorio = self._escrever_listas('amigos', amigos_por_cliente, ns, token)
+            print(f"✓ Amigos de {relatorio['itens']} clientes armazenados no Redis "
+                  f"({self._resumo_lotes(relatorio)})")
+            return relatorio
+        except Exception as e:
+            print(f"✗ Erro ao armazenar amigos: {e}")
+            return False
+    
+    def store_recomendacoes_lote(self, recomendacoes_por_amigo, ns=None, token=None):
+        """Armazena as recomendações de vários amigos ({id: recomendações})"""
+        try:
+            relatorio = self._escrever_listas('recomendacoes', recomendacoes_por_amigo, ns, token)
+            print(f"✓ Recomendações de {relatorio['itens']} amigos armazenadas "
+                  f"({self._resumo_lotes(relatorio)})")
+            return relatorio
+        except Exception as e:
+            print(f"✗ Erro ao armazenar recomendações: {e}")
+            return False
+    
+    def _ler_lote(self, keys, ler, client=None, tolerar_erros=False):
+        """Lê várias chaves em um pipeline, passando antes pelo cache local.
+        
+        keys são chaves lógicas; ler(pipe, key) enfileira a leitura de uma
+        chave já com o namespace. Só as chaves que não estão no cache vão ao
+        Redis. Retorna os valores na ordem de keys; com tolerar_erros, o
+        erro de uma chave vem no lugar do valor dela.
+        """
+        client = client or self.client
+        ns = self._ns()
+        if not self.cache_local:
+            pipe = client.pipeline(transaction=False)
             for key in keys:
-                cliente = self.client.hgetall(key)
-                clientes.append(cliente)
-            return clientes
+                ler(pipe, ns + key)
+            return pipe.execute(raise_on_error=not tolerar_erros)
+        
+        valores = {}
+        faltando = []
+        for key in keys:
+            achou, valor = (
+                self.cache_local.get(key) if self.cache_local.cacheavel(key) else (False, None)
+            )
+            if achou:
+                valores[key] = valor
+            else:
+                faltando.append(key)
+        if faltando:
+            pipe = client.pipeline(transaction=False)
+            for key in faltando:
+                ler(pipe, ns + key)
+            for key, valor in zip(faltando, pipe.execute(raise_on_error=not tolerar_erros)):
+                valores[key] = valor
+                if not isinstance(valor, Exception):
+                    self.cache_local.set(key, valor)
+        # Cópias: quem lê pode alterar o resultado sem mexer no cache
+        return [
+            type(valores[key])(valores[key]) if isinstance(valores[key], (list, dict))
+            else valores[key]
+            for key in keys
+        ]
+    
+    def estatisticas_cache(self):
+        """Contadores do cache local (None se ele estiver desligado)"""
+        return self.cache_local.estatisticas() if self.cache_local else None
+    
+    def _hgetall_lote(self, keys):
+        """Busca vários hashes em um pipeline, ignorando chaves inexistentes"""
+        registros = self._ler_lote(keys, lambda pipe, key: pipe.hgetall(key))
+        # Chaves removidas depois de listadas voltam vazias
+        return [registro for registro in registros if registro]
+    
+    def _iter_hashes(self, lista, offset=0, limit=None):
+        """Percorre os hashes indexados por uma lista, em lotes pipelined.
+        
+        Lê chunk_size chaves da lista por vez e busca os hashes delas em
+        um único pipeline, sem carregar a lista inteira na memória.
+        """
+        inicio = offset
+        fim = None if limit is None else offset + limit
+        while fim is None or inicio < fim:
+            tamanho = self.chunk_size if fim is None else min(self.chunk_size, fim - inicio)
+            keys = self.client.lrange(self._k(lista), inicio, inicio + tamanho - 1)
+            if not keys:
+                break
+            yield from self._hgetall_lote(keys)
+            if len(keys) < tamanho:
+                break
+            inicio += tamanho
+    
+    def iter_clientes(self, offset=0, limit=None):
+        """Gera os clientes do cache em lotes, sem montar a lista inteira.
+        
+        Como PostgresDB.iter_clientes, um erro no meio do caminho é impresso
+        e repassado, para que um resultado parcial não seja tomado por completo.
+        """
+        try:
+            yield from self._iter_hashes('clientes', offset, limit)
+        except Exception as e:
+            print(f"✗ Erro ao buscar clientes: {e}")
+            raise
+    
+    def iter_compras(self, offset=0, limit=None):
+        """Gera as compras do cache em lotes (um erro é repassado, como em iter_clientes)"""
+        try:
+            yield from self._iter_hashes('compras', offset, limit)
+        except Exception as e:
+            print(f"✗ Erro ao buscar compras: {e}")
+            raise
+    
+    def get_clientes(self, offset=0, limit=None):
+        """Retorna os clientes do cache (todos, ou a página offset/limit)"""
+        try:
+            return list(self._iter_hashes('clientes', offset, limit))
+        except Exception as e:
+            print(f"✗ Erro ao buscar clientes: {e}")
+            return []
+    
+    def get_compras(self, offset=0, limit=None):
+        """Retorna as compras do cache (todas, ou a página offset/limit)"""
+        try:
+            return list(self._iter_hashes('compras', offset, limit))
+        except Exception as e:
+            print(f"✗ Erro ao buscar compras: {e}")
+            return []
+    
+    def versao_compras(self):
+        """Identifica as compras em cache: (namespace em uso, tamanho da lista).
+        
+        Muda a cada reconstrução e a cada compra acrescentada, então serve
+        para saber se algo montado com as compras ainda vale. None em caso
+        de erro.
+        """
+        try:
+            ns = self._ns()
+            return ns, self.client.llen(ns + 'compras')
+        except Exception as e:
+            print(f"✗ Erro ao ler versão das compras: {e}")
+            return None
+    
+    def get_clientes_pagina(self, apos_id=0, limite=50):
+        """Retorna até `limite` clientes com ID maior que apos_id, em ordem de ID"""
+        try:
+            keys = self.client.zrangebyscore(
+                self._k('clientes:ids'), f"({apos_id}", '+inf', start=0, num=limite
+            )
+            return self._hgetall_lote(keys) if keys else []
         except Exception as e:
             print(f"✗ Erro ao buscar clientes: {e}")
             return []
     
-    def get_compras(self):
-        """Retorna todas as compras do cache"""
+    def get_compras_recentes(self, cliente_id, n=10):
+        """Retorna as n compras mais recentes do cliente, da mais nova para a mais antiga"""
+        try:
+            keys = self.client.zrevrange(self._k(f"{PREFIXO_COMPRAS_CLIENTE}{cliente_id}"), 0, n - 1)
+            return self._hgetall_lote(keys) if keys else []
+        except Exception as e:
+            print(f"✗ Erro ao buscar compras do cliente: {e}")
+            return []
+    
+    def get_compras_periodo(self, cliente_id, inicio=None, fim=None, limite=None):
+        """Retorna as compras do cliente entre inicio e fim (inclusive), em ordem de data.
+        
+        inicio e fim são datas (datetime, texto ISO ou timestamp); None deixa
+        o intervalo aberto daquele lado.
+        """
+        try:
+            keys = self.client.zrangebyscore(
+                self._k(f"{PREFIXO_COMPRAS_CLIENTE}{cliente_id}"),
+                '-inf' if inicio is None else para_timestamp(inicio),
+                '+inf' if fim is None else para_timestamp(fim),
+                start=None if limite is None else 0,
+                num=limite
+            )
+            return self._hgetall_lote(keys) if keys else []
+        except Exception as e:
+            print(f"✗ Erro ao buscar compras do cliente: {e}")
+            return []
+    
+    def get_compras_clientes(self, cliente_ids):
+        """Retorna as compras de vários clientes, da mais nova para a mais antiga de cada um"""
         try:
-            keys = self.client.lrange('compras', 0, -1)
             compras = []
-            for key in keys:
-                compra = self.client.hgetall(key)
-                compras.append(compra)
+            ids = list(cliente_ids)
+            for i in range(0, len(ids), self.chunk_size):
+                pipe = self.client.pipeline(transaction=False)
+                for cliente_id in ids[i:i + self.chunk_size]:
+                    pipe.zrevrange(self._k(f"{PREFIXO_COMPRAS_CLIENTE}{cliente_id}"), 0, -1)
+                keys = [key for lista in pipe.execute() for key in lista]
+                for j in range(0, len(keys), self.chunk_size):
+                    compras.extend(self._hgetall_lote(keys[j:j + self.chunk_size]))
             return compras
         except Exception as e:
-            print(f"✗ Erro ao buscar compras: {e}")
+            print(f"✗ Erro ao buscar compras dos clientes: {e}")
+            return []
+    
+    def _detalhar_ranking(self, ranking, campo='compras', converter=int):
+        """Junta os dados de cada produto a um ranking [(produto_id, score)]"""
+        produtos = self._ler_lote(
+            [f"produto:{produto_id}" for produto_id, _ in ranking],
+            lambda pipe, key: pipe.hgetall(key)
+        )
+        return [
+            {**produto, 'id': produto_id, campo: converter(score)}
+            for (produto_id, score), produto in zip(ranking, produtos)
+        ]
+    
+    def get_top_produtos(self, k=10, tipo=None):
+        """Os k produtos mais comprados (no total ou de um tipo), com o número de compras"""
+        try:
+            key = CHAVE_RANKING_PRODUTOS if tipo is None else f"{PREFIXO_RANKING_TIPO}{tipo}"
+            ranking = self.client.zrevrange(self._k(key), 0, k - 1, withscores=True)
+            return self._detalhar_ranking(ranking) if ranking else []
+        except Exception as e:
+            print(f"✗ Erro ao buscar ranking de produtos: {e}")
+            return []
+    
+    def get_top_produtos_amigos(self, cliente_id, k=10):
+        """Os k produtos mais comprados pelos amigos do cliente.
+        
+        Soma os contadores por cliente dos amigos com ZUNIONSTORE; o
+        resultado fica guardado por ranking_amigos_ttl segundos.
+        """
+        try:
+            destino = self._k(f"{PREFIXO_RANKING_AMIGOS}{cliente_id}")
+            ranking = self.client.zrevrange(destino, 0, k - 1, withscores=True)
+            if not ranking and not self.client.exists(destino):
+                amigos = self.get_amigos(cliente_id)
+                if not amigos:
+                    return []
+                pipe = self.client.pipeline(transaction=False)
+                pipe.zunionstore(destino, [
+                    self._k(f"{PREFIXO_PRODUTOS_CLIENTE}{amigo['id']}") for amigo in amigos
+                ])
+                pipe.expire(destino, self.ttl_ranking_amigos)
+                pipe.zrevrange(destino, 0, k - 1, withscores=True)
+                ranking = pipe.execute()[-1]
+            return self._detalhar_ranking(ranking) if ranking else []
+        except Exception as e:
+            print(f"✗ Erro ao buscar ranking dos amigos: {e}")
             return []
     
+    def store_recomendacoes_top(self, ranking_por_cliente, ns=None, token=None):
+        """Grava uma nova geração de recomendações pontuadas e passa a usá-la.
+        
+        ranking_por_cliente é {cliente_id: [(produto_id, pontuação)]}. A
+        geração nova é escrita inteira antes da troca do ponteiro (um SET);
+        só então a anterior é apagada. Retorna o número da nova geração.
+        ns é o namespace em construção, se for parte de uma reconstrução, e
+        token o da trava dela.
+        """
+        def escrever(pipe, par):
+            cliente_id, ranking = par
+            return gravar_recomendacoes_top(
+                pipe, prefixo, cliente_id, ranking, self.top_k_recomendacoes
+            )
+        
+        try:
+            ns = self._ns(ns)
+            anterior = self.client.get(ns + CHAVE_GERACAO_RECOMENDACOES)
+            geracao = self.client.incr(ns + CHAVE_SEQ_RECOMENDACOES)
+            prefixo = f"{ns}{PREFIXO_RECOMENDACOES_TOP}{geracao}:"
+            relatorio = self._escrever_em_lotes(ranking_por_cliente.items(), escrever, token=token)
+            self.client.set(ns + CHAVE_GERACAO_RECOMENDACOES, geracao)
+            if anterior is not None:
+                self._remover_chaves(f"{ns}{PREFIXO_RECOMENDACOES_TOP}{anterior}:*")
+            print(f"✓ Recomendações pontuadas de {relatorio['itens']} clientes "
+                  f"(geração {geracao}, {self._resumo_lotes(relatorio)})")
+            return geracao
+        except Exception as e:
+            print(f"✗ Erro ao armazenar recomendações pontuadas: {e}")
+            return None
+    
+    def get_recomendacoes_top(self, cliente_id, k=10):
+        """Os k produtos recomendados ao cliente, com pontuação, em uma leitura.
+        
+        Retorna None se nenhuma geração foi calculada ainda.
+        """
+        try:
+            ranking = self._script_top(
+                keys=[self._k(CHAVE_GERACAO_RECOMENDACOES)],
+                args=[self._k(PREFIXO_RECOMENDACOES_TOP), cliente_id, k]
+            )
+            if ranking is None:
+                return None
+            pares = list(zip(ranking[::2], ranking[1::2]))
+            return self._detalhar_ranking(pares, 'pontuacao', float) if pares else []
+        except Exception as e:
+            print(f"✗ Erro ao buscar recomendações: {e}")
+            return None
+    
+    def atualizar_recomendacoes_top(self, compras, recebem_de, peso=1.0):
+        """Aplica compras novas à geração em uso, sem recalcular tudo.
+        
+        recebem_de é {cliente_id: [IDs de quem recebe recomendações dele]}.
+        Deve rodar depois de append_compras, que atualiza produtos:cliente:{id},
+        e só com as compras que ele gravou (get_compras_pendentes). Vai em
+        pipelines de chunk_size compras. Retorna quantos conjuntos mudaram,
+        ou None em caso de erro.
+        """
+        ns = self._ns()
+        
+        def escrever(pipe, compra):
+            atualizar_recomendacoes_top(
+                pipe, self._script_atualizar_top, compra,
+                recebem_de.get(compra['cliente_id'], []), ns, peso,
+                self.top_k_recomendacoes
+            )
+            return 0
+        
+        try:
+            return self._escrever_em_lotes(compras, escrever, somar=True)['soma']
+        except Exception as e:
+            print(f"✗ Erro ao atualizar recomendações: {e}")
+            return None
+    
+    def _ler_listas(self, keys):
+        """Lê e decodifica listas de amigos/recomendações, em qualquer formato.
+        
+        Tenta primeiro o comando do formato em uso (GET para blobs, LRANGE
+        para listas JSON); as chaves ainda no outro formato respondem
+        WRONGTYPE e são relidas com o outro comando. Uma chave com erro ou
+        ilegível vem como lista vazia, sem afetar as demais.
+        """
+        principal = lambda pipe, key: ler_lista(pipe, key, self.listas_binarias)
+        alternativa = lambda pipe, key: ler_lista(pipe, key, not self.listas_binarias)
+        valores = self._ler_lote(keys, principal, self.client_binario, tolerar_erros=True)
+        relerem = outro_formato(valores)
+        if relerem:
+            relidos = self._ler_lote(
+                [keys[i] for i in relerem], alternativa, self.client_binario,
+                tolerar_erros=True
+            )
+            for i, valor in zip(relerem, relidos):
+                valores[i] = valor
+        listas = []
+        for key, valor in zip(keys, valores):
+            itens = tentar_decodificar_lista(self.codecs, key, valor)
+            if itens is None:
+                # Conta como falta; o valor ilegível não fica no cache local
+                if self.cache_local:
+                    self.cache_local.invalidar([key])
+                itens = []
+            listas.append(itens)
+        return listas
+    
+    def limpar_cpfs_ausentes(self, cpfs):
+        """Apaga a marca de CPF inexistente dos CPFs recém-cadastrados.
+        
+        Sem isso, buscar_cliente_por_cpf continuaria respondendo "não existe"
+        até a marca vencer (cpf_ausente_ttl).
+        """
+        ns = self._ns()
+        
+        def escrever(pipe, cpf):
+            limpar_cpf_ausente(pipe, cpf, ns)
+            return 1
+        
+        try:
+            self._escrever_em_lotes(cpfs, escrever)
+            return True
+        except Exception as e:
+            print(f"✗ Erro ao limpar marcas de CPF inexistente: {e}")
+            return False
+    
+    def buscar_cliente_por_cpf(self, cpf, carregar=None):
+        """Busca um cliente pelo CPF no cache, com leitura através (read-through).
+        
+        Na falta, chama carregar(cpf), que deve retornar o cliente, None se
+        o CPF não existe ou False em caso de erro. O cliente encontrado entra
+        no cache; um CPF inexistente fica marcado por cpf_ausente_ttl segundos.
+        """
+        try:
+            ns = self._ns()
+            resultado = self._script_cpf(
+                keys=[ns + CHAVE_INDICE_CPF, ns + PREFIXO_CPF_AUSENTE + cpf], args=[cpf, ns]
+            )
+        except Exception as e:
+            print(f"✗ Erro ao buscar CPF no cache: {e}")
+            resultado = [-1]
+        
+        if resultado[0] == 1:
+            campos = resultado[1]
+            return dict(zip(campos[::2], campos[1::2]))
+        if resultado[0] == 0 or carregar is None:
+            return None
+        
+        cliente = carregar(cpf)
+        if cliente is None:
+            try:
+                self.client.set(self._k(PREFIXO_CPF_AUSENTE + cpf), 1, ex=self.ttl_cpf_ausente)
+            except Exception as e:
+                print(f"✗ Erro ao marcar CPF inexistente: {e}")
+            return None
+        if not cliente:
+            # Erro na origem: não guarda nada
+            return None
+        self.upsert_clientes([cliente])
+        return {campo: str(valor) for campo, valor in cliente_mapping(cliente).items()}
+    
+    def _get_listas(self, prefixos, ids):
+        """Lê as listas {prefixo}:{id} de vários IDs em pipelines de chunk_size IDs"""
+        resultado = {prefixo: {} for prefixo in prefixos}
+        ids = list(ids)
+        for i in range(0, len(ids), self.chunk_size):
+            lote = ids[i:i + self.chunk_size]
+            keys = [f"{prefixo}:{id_}" for id_ in lote for prefixo in prefixos]
+            listas = iter(self._ler_listas(keys))
+            for id_ in lote:
+                for prefixo in prefixos:
+                    resultado[prefixo][id_] = next(listas)
+        return resultado
+    
+    def get_relacoes_lote(self, cliente_ids):
+        """Retorna {'amigos': {id: [...]}, 'recomendacoes': {id: [...]}} de vários clientes"""
+        try:
+            return self._get_listas(('amigos', 'recomendacoes'), cliente_ids)
+        except Exception as e:
+            print(f"✗ Erro ao buscar amigos e recomendações: {e}")
+            return {'amigos': {}, 'recomendacoes': {}}
+    
     def get_amigos(self, cliente_id):
         """Retorna amigos de um cliente do cache"""
         try:
-            key = f"amigos:{cliente_id}"
-            amigos_json = self.client.lrange(key, 0, -1)
-            return [json.loads(amigo) for amigo in amigos_json]
+            amigos, = self._ler_listas([f"amigos:{cliente_id}"])
+            return amigos
         except Exception as e:
             print(f"✗ Erro ao buscar amigos: {e}")
             return []
@@ -151,9 +1014,8 @@ class RedisDB:
     def get_recomendacoes(self, amigo_id):
         """Retorna recomendações de um amigo do cache"""
         try:
-            key = f"recomendacoes:{amigo_id}"
-            recomendacoes_json = self.client.lrange(key, 0, -1)
-            return [json.loads(rec) for rec in recomendacoes_json]
+            recomendacoes, = self._ler_listas([f"recomendacoes:{amigo_id}"])
+            return recomendacoes
         except Exception as e:
             print(f"✗ Erro ao buscar recomendações: {e}")
             return []
@@ -5,6 +5,8 @@ Integra dados de todos os 4 bancos
 from database.postgres_db import PostgresDB
 from database.mongo_db import MongoDB
 from database.neo4j_db import Neo4jDB
+from database.redis_db import RedisDB
+from api.recommendation_engine import RecommendationEngine
 from datetime import datetime
 
 
@@ -27,7 +29,6 @@ def gerar_relatorio_completo():
         return
     
     clientes_pg = pg.get_all_clientes()
-    compras_pg = pg.get_all_compras()
     
     print(f"\n📋 CLIENTES ({len(clientes_pg)}):")
     print("-" * 80)
@@ -40,7 +41,7 @@ def gerar_relatorio_completo():
     print(f"\n📦 PRODUTOS:")
     print("-" * 80)
     try:
-        with pg.conn.cursor() as cur:
+        with pg.cursor() as cur:
             cur.execute("SELECT id, produto, valor, quantidade, tipo FROM produtos")
             produtos = cur.fetchall()
             print(f"{'ID':<5} {'Produto':<35} {'Valor':<12} {'Qtd':<5} {'Tipo':<20}")
@@ -50,38 +51,38 @@ def gerar_relatorio_completo():
     except Exception as e:
         print(f"Erro: {e}")
     
-    print(f"\n🛍️  COMPRAS ({len(compras_pg)}):")
+    # Compras lidas em streaming: o total só é conhecido ao final
+    print(f"\n🛍️  COMPRAS:")
     print("-" * 80)
     print(f"{'ID':<5} {'Cliente':<30} {'Produto':<35} {'Valor':<12} {'Data':<20}")
     print("-" * 80)
-    for compra in compras_pg:
-        data_str = str(compra['data'])[:19]
-        print(f"{compra['id']:<5} {compra['cliente_nome']:<30} {compra['produto']:<35} R$ {compra['valor']:<10.2f} {data_str:<20}")
+    total_compras = 0
+    # Compras por cliente para as recomendações (pelo nome, como no grafo)
+    motor = RecommendationEngine()
+    try:
+        for compra in pg.iter_compras():
+            motor.adicionar_compra(compra['cliente_nome'], compra['produto'])
+            data_str = str(compra['data'])[:19]
+            print(f"{compra['id']:<5} {compra['cliente_nome']:<30} {compra['produto']:<35} R$ {compra['valor']:<10.2f} {data_str:<20}")
+            total_compras += 1
+        print(f"Total: {total_compras} compra(s)")
+    except Exception:
+        # O erro já foi impresso por iter_compras
+        print(f"Listagem incompleta: {total_compras} compra(s) lidas")
     
     # Estatísticas PostgreSQL
     print(f"\n📊 ESTATÍSTICAS:")
     print("-" * 80)
-    try:
-        with pg.conn.cursor() as cur:
-            cur.execute("SELECT SUM(p.valor) FROM compras c JOIN produtos p ON c.id_produto = p.id")
-            total_vendas = cur.fetchone()[0] or 0
-            
-            cur.execute("""
-                SELECT c.nome, COUNT(comp.id) as total, SUM(p.valor) as total_gasto
-                FROM clientes c
-                LEFT JOIN compras comp ON c.id = comp.id_cliente
-                LEFT JOIN produtos p ON comp.id_produto = p.id
-                GROUP BY c.id, c.nome
-                ORDER BY total_gasto DESC
-            """)
-            stats = cur.fetchall()
-            print(f"  • Total de vendas: R$ {total_vendas:.2f}")
-            print(f"  • Clientes com compras:")
-            for nome, total, gasto in stats:
-                if total and total > 0:
-                    print(f"    - {nome}: {total} compra(s), Total gasto: R$ {gasto:.2f}")
-    except Exception as e:
-        print(f"Erro: {e}")
+    # Lidas dos rollups diários (mantidos por trigger a cada compra)
+    estatisticas = pg.get_estatisticas_vendas()
+    if estatisticas:
+        print(f"  • Total de vendas: R$ {estatisticas['total_vendas']:.2f}")
+        print(f"  • Clientes com compras:")
+        for nome, total, gasto in estatisticas['clientes']:
+            print(f"    - {nome}: {total} compra(s), Total gasto: R$ {gasto:.2f}")
+        print(f"  • Produtos mais vendidos:")
+        for produto, total, valor in estatisticas['produtos']:
+            print(f"    - {produto}: {total} venda(s), R$ {valor:.2f}")
     
     pg.disconnect()
     
@@ -163,29 +164,65 @@ def gerar_relatorio_completo():
         # Análise de conectividade
         print(f"\n📊 ANÁLISE DE REDE:")
         print("-" * 80)
+    
+    # Graus, alcance e distâncias calculados em memória, sem voltar ao Neo4j
+    grafo = neo.exportar_amizades('Pessoa')
+    if grafo:
+        nomes = {pessoa['id']: pessoa['nome'] for pessoa in pessoas}
+        mais_conectados = [(id_, grau) for id_, grau in grafo.mais_conectados(5) if grau > 0]
+        print("Pessoas mais conectadas:")
+        for id_, grau in mais_conectados:
+            alcance = len(grafo.k_saltos(id_, 2))
+            print(f"  • {nomes.get(id_, id_)}: {grau} amigo(s), {alcance} pessoa(s) a até 2 saltos")
         
-        result = session.run("""
-            MATCH (p:Pessoa)
-            OPTIONAL MATCH (p)-[r:AMIGO_DE]->()
-            RETURN p.nome as nome, COUNT(r) as grau
-            ORDER BY grau DESC
-        """)
+        print("Distribuição de graus:")
+        for grau, quantidade in sorted(grafo.distribuicao_graus().items()):
+            print(f"  • {grau} amigo(s): {quantidade} pessoa(s)")
         
-        pessoas_grau = [dict(record) for record in result]
-        print("Pessoas mais conectadas:")
-        for pessoa in pessoas_grau[:5]:
-            if pessoa['grau'] > 0:
-                print(f"  • {pessoa['nome']}: {pessoa['grau']} amigo(s)")
+        if mais_conectados:
+            alcancaveis = len(grafo.bfs(mais_conectados[0][0])) - 1
+            print(f"Alcance a partir de {nomes.get(mais_conectados[0][0])}: "
+                  f"{alcancaveis} de {grafo.total_nos - 1} pessoa(s)")
     
     neo.disconnect()
     
+    # 4. Redis (opcional: sem o cache, a seção é omitida)
+    print("\n" + "=" * 80)
+    print("4. CACHE - REDIS: PRODUTOS MAIS POPULARES")
+    print("=" * 80)
+    
+    redis_db = RedisDB()
+    if redis_db.connect():
+        # Contadores mantidos a cada compra sincronizada: sem GROUP BY
+        top_produtos = redis_db.get_top_produtos(5)
+        if top_produtos:
+            print(f"\n🏆 MAIS COMPRADOS:")
+            print("-" * 80)
+            for i, produto in enumerate(top_produtos, 1):
+                print(f"  {i}. {produto.get('produto', produto['id'])}: {produto['compras']} compra(s)")
+            
+            tipos = sorted({p[4] for p in produtos if p[4]}) if 'produtos' in locals() else []
+            for tipo in tipos:
+                top_tipo = redis_db.get_top_produtos(3, tipo=tipo)
+                if top_tipo:
+                    nomes = ', '.join(
+                        f"{produto.get('produto', produto['id'])} ({produto['compras']})"
+                        for produto in top_tipo
+                    )
+                    print(f"  • {tipo}: {nomes}")
+        else:
+            print("\nRanking vazio: sincronize o cache para preenchê-lo")
+        redis_db.disconnect()
+    else:
+        print("Redis indisponível, seção omitida")
+    
     # Resumo Final
     print("\n" + "=" * 80)
     print("RESUMO CONSOLIDADO")
     print("=" * 80)
     print(f"\n✓ Total de Clientes: {len(clientes_pg)}")
     print(f"✓ Total de Produtos: {len(produtos) if 'produtos' in locals() else 'N/A'}")
-    print(f"✓ Total de Compras: {len(compras_pg)}")
+    print(f"✓ Total de Compras: {total_compras}")
     print(f"✓ Perfis de Interesses: {len(documentos)}")
     print(f"✓ Pessoas no Grafo: {len(pessoas)}")
     print(f"✓ Relações de Amizade: {len(amizades)}")
@@ -197,20 +234,13 @@ def gerar_relatorio_completo():
     # Buscar compras e recomendar aos amigos
     print("\nPara cada compra realizada, recomendações podem ser feitas aos amigos:\n")
     
-    neo = Neo4jDB()
-    if neo.connect():
-        with neo.driver.session() as session:
-            # Exemplo de recomendação
-            result = session.run("""
-                MATCH (cliente:Pessoa)-[:AMIGO_DE]->(amigo:Pessoa)
-                RETURN DISTINCT cliente.nome as cliente, amigo.nome as amigo
-                LIMIT 5
-            """)
-            
-            for i, record in enumerate(result, 1):
-                print(f"{i}. {record['cliente']} pode recomendar a {record['amigo']}")
-        
-        neo.disconnect()
+    # Amizades já lidas do grafo; as compras vêm do motor de recomendação
+    for i, amizade in enumerate(amizades[:5], 1):
+        recomendacoes = motor.recomendar_de(amizade['nome1'], amizade['nome2'])
+        if recomendacoes:
+            print(f"{i}. {amizade['nome1']} pode recomendar a {amizade['nome2']}: {', '.join(recomendacoes)}")
+        else:
+            print(f"{i}. {amizade['nome1']} pode recomendar a {amizade['nome2']}")
     
     print("\n" + "=" * 80)
     print("✅ RELATÓRIO CONCLUÍDO")